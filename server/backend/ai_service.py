@@ -1,15 +1,34 @@
 import os
-import requests
+import threading
 from flask import Blueprint, jsonify, request
 from mqtt_service import get_latest_sensor_data
 from datetime import datetime, timezone, timedelta
-from db_connect import get_connection
+from db_connect import get_connection, get_read_connection
+from sensor_wide import read_wide_enabled, fetch_hourly_wide
+from rollups import rollups_enabled, rollups_cover, pick_resolution, fetch_metric_averages, fetch_row_count
+from query_registry import prepared_query
+from threshold_cache import get_threshold_cache
+from suggestion_cache import get_suggestion_cache, suggestion_key
+from llm_broker import get_llm_broker, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from model_engine import get_model_engine
 
-try:
-    import google.generativeai as genai
-    _GENAI_AVAILABLE = True
-except ImportError:
-    _GENAI_AVAILABLE = False
+_genai = None
+_GENAI_AVAILABLE = True
+
+
+def _load_genai():
+    """
+    Import google.generativeai on first use; it is heavy and only needed when a
+    suggestion is actually requested. Returns None when the SDK is missing.
+    """
+    global _genai, _GENAI_AVAILABLE
+    if _genai is None and _GENAI_AVAILABLE:
+        try:
+            import google.generativeai as genai
+            _genai = genai
+        except ImportError:
+            _GENAI_AVAILABLE = False
+    return _genai
 
 ai_bp = Blueprint('ai_bp', __name__)
 
@@ -35,11 +54,16 @@ _FALLBACK_SUGGESTIONS = {
 }
 
 
-def _check_alerts(sensor: dict, crop_type: str, crop_stage: str, ranges: dict = None) -> list:
+def _check_alerts(sensor: dict, crop_type: str, crop_stage: str, ranges: dict = None,
+                  refresh: bool = True) -> list:
     """
     Compare sensor readings against threshold ranges.
-    `ranges` may be pre-fetched from DB; falls back to CROP_IDEAL_RANGES if absent.
+    `ranges` may be pre-fetched; otherwise the crop's crop_thresholds row (from
+    the in-process cache) is used, falling back to CROP_IDEAL_RANGES.
+    refresh=False never reloads the cache inline (MQTT message path).
     """
+    if ranges is None:
+        ranges = get_threshold_cache().get(crop_type, refresh=refresh)
     if ranges is None:
         ranges = CROP_IDEAL_RANGES.get(crop_type, CROP_IDEAL_RANGES["lettuce"])
     alerts = []
@@ -84,34 +108,167 @@ def _check_alerts(sensor: dict, crop_type: str, crop_stage: str, ranges: dict =
     return alerts
 
 
-def _gemini_suggestion(alert: dict, crop_type: str, crop_stage: str) -> str:
+# Per-request timeout of a Gemini call, so a hung upstream cannot hold threads
+_GEMINI_TIMEOUT_SEC = float(os.environ.get("AI_GEMINI_TIMEOUT_SEC", 10))
+
+_gemini_lock = threading.Lock()
+_gemini_client = (None, None)   # (api_key, GenerativeModel)
+
+
+def _gemini_model(api_key):
+    """Configured GenerativeModel, built once per API key and reused."""
+    global _gemini_client
+    key, model = _gemini_client
+    if key == api_key:
+        return model
+    genai = _load_genai()
+    if genai is None:
+        return None
+    with _gemini_lock:
+        if _gemini_client[0] != api_key:
+            genai.configure(api_key=api_key)
+            _gemini_client = (api_key, genai.GenerativeModel("gemini-2.0-flash"))
+        return _gemini_client[1]
+
+
+def _fallback_suggestion(alert: dict) -> str:
+    fallback_key = f"{alert['metric']}_{alert['direction']}"
+    return _FALLBACK_SUGGESTIONS.get(fallback_key, "Check and adjust environmental controls.")
+
+
+def _generate_suggestion(alert: dict, crop_type: str, crop_stage: str, api_key: str, key,
+                         priority=PRIORITY_BACKGROUND) -> str | None:
+    """
+    Ask Gemini for a suggestion through the LLM broker (rate limit,
+    de-duplication, circuit breaker) and cache it. None if refused or failed.
+    """
+    model = _gemini_model(api_key)
+    if model is None:
+        return None
+    prompt = (
+        f"My {crop_type} crop (stage: {crop_stage}) has {alert['label']} reading "
+        f"of {alert['value']:.1f}{alert['unit']} "
+        f"(ideal: {alert['ideal_min']}–{alert['ideal_max']}{alert['unit']}). "
+        "Give one short actionable fix in under 20 words."
+    )
+
+    def call():
+        response = model.generate_content(prompt, request_options={"timeout": _GEMINI_TIMEOUT_SEC})
+        text = response.text.strip()
+        if not text:
+            return None
+        # Cap at 120 chars to ensure it fits in the toast
+        get_suggestion_cache().put(key, text[:120])
+        return text[:120]
+
+    return get_llm_broker().call(key, call, priority, timeout=_GEMINI_TIMEOUT_SEC)
+
+
+def _gemini_suggestion(alert: dict, crop_type: str, crop_stage: str,
+                       priority=PRIORITY_BACKGROUND) -> str:
     """
     Call Gemini API server-side to get a one-line actionable fix.
-    Falls back to a hardcoded suggestion if key is absent or call fails.
+    Answers are cached per crop / stage / metric / value bucket (see
+    suggestion_cache). Falls back to a hardcoded suggestion if key is absent,
+    the call fails or the broker refuses it.
     """
-    fallback_key = f"{alert['metric']}_{alert['direction']}"
-    fallback = _FALLBACK_SUGGESTIONS.get(fallback_key, "Check and adjust environmental controls.")
+    api_key = os.environ.get("GEMINI_API_KEY", "").strip()
+    if not api_key:
+        return _fallback_suggestion(alert)
+
+    key = suggestion_key(alert, crop_type, crop_stage)
+    cached = get_suggestion_cache().get(key)
+    if cached is not None:
+        return cached
+    return _generate_suggestion(alert, crop_type, crop_stage, api_key, key, priority) or _fallback_suggestion(alert)
+
+
+_suggestion_pool = None
+_suggestion_pool_lock = threading.Lock()
+# Submitted suggestion futures by cache key; a key already queued or running is
+# shared, and past AI_SUGGESTION_MAX_BACKLOG unfinished calls nothing new is queued
+_suggestions_in_flight = {}
+_suggestions_lock = threading.Lock()
+
+
+def _suggestion_executor():
+    global _suggestion_pool
+    if _suggestion_pool is None:
+        with _suggestion_pool_lock:
+            if _suggestion_pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _suggestion_pool = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get("AI_SUGGESTION_WORKERS", 4)),
+                    thread_name_prefix="ai-suggest",
+                )
+    return _suggestion_pool
+
+
+def _submit_suggestion(alert, crop_type, crop_stage, api_key, key):
+    """Future for the key's suggestion (an in-flight one if any), or None if the backlog is full."""
+    max_backlog = int(os.environ.get("AI_SUGGESTION_MAX_BACKLOG", 16))
+    with _suggestions_lock:
+        future = _suggestions_in_flight.get(key)
+        if future is not None:
+            return future
+        if len(_suggestions_in_flight) >= max_backlog:
+            return None
+        future = _suggestion_executor().submit(
+            _generate_suggestion, alert, crop_type, crop_stage, api_key, key, PRIORITY_INTERACTIVE
+        )
+        _suggestions_in_flight[key] = future
+
+    def _finished(_):
+        with _suggestions_lock:
+            if _suggestions_in_flight.get(key) is future:
+                del _suggestions_in_flight[key]
+    future.add_done_callback(_finished)
+    return future
+
 
+def _add_suggestions(alerts: list, crop_type: str, crop_stage: str, budget_ms=None):
+    """
+    Fill alert["suggestion"] for every alert. Cache misses are sent to Gemini
+    concurrently under one shared deadline (AI_SUGGESTION_BUDGET_MS); alerts
+    still waiting when it passes get the hardcoded fallback, and the late
+    answers still land in the suggestion cache for the next request.  A miss
+    whose key is already in flight waits for that call; when the backlog is
+    full the alert gets the fallback at once instead of queueing.
+    """
     api_key = os.environ.get("GEMINI_API_KEY", "").strip()
-    if not api_key or not _GENAI_AVAILABLE:
-        return fallback
+    if budget_ms is None:
+        budget_ms = int(os.environ.get("AI_SUGGESTION_BUDGET_MS", 1500))
+    pending = {}
+    skipped = 0
+    cache = get_suggestion_cache()
+    for alert in alerts:
+        if not api_key:
+            alert["suggestion"] = _fallback_suggestion(alert)
+            continue
+        key = suggestion_key(alert, crop_type, crop_stage)
+        cached = cache.get(key)
+        if cached is not None:
+            alert["suggestion"] = cached
+            continue
+        future = _submit_suggestion(alert, crop_type, crop_stage, api_key, key)
+        if future is None:
+            skipped += 1
+            alert["suggestion"] = _fallback_suggestion(alert)
+            continue
+        pending.setdefault(future, []).append(alert)
+    if skipped:
+        print(f"[AI] Suggestion backlog full; {skipped} alert(s) use fallbacks")
+    if not pending:
+        return
 
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-2.0-flash")
-        prompt = (
-            f"My {crop_type} crop (stage: {crop_stage}) has {alert['label']} reading "
-            f"of {alert['value']:.1f}{alert['unit']} "
-            f"(ideal: {alert['ideal_min']}–{alert['ideal_max']}{alert['unit']}). "
-            "Give one short actionable fix in under 20 words."
-        )
-        response = model.generate_content(prompt)
-        text = response.text.strip()
-        # Cap at 120 chars to ensure it fits in the toast
-        return text[:120] if text else fallback
-    except Exception as exc:
-        print(f"[AI] Gemini suggestion failed: {exc}")
-        return fallback
+    from concurrent.futures import wait
+    done, late = wait(pending, timeout=budget_ms / 1000.0)
+    for future, waiting in pending.items():
+        text = future.result() if future in done else None
+        for alert in waiting:
+            alert["suggestion"] = text or _fallback_suggestion(alert)
+    if late:
+        print(f"[AI] {len(late)} suggestion(s) missed the {budget_ms} ms budget; using fallbacks")
 
 
 def _status_to_risk_level(status: str) -> str:
@@ -124,25 +281,15 @@ def _status_to_risk_level(status: str) -> str:
 def _call_model(temp: float, humidity: float, co2: float,
                 crop_type: str, crop_stage: str) -> dict | None:
     """
-    POST to the Random-Forest model server (port 5001).
+    Score one reading with the configured risk model engine (see
+    model_engine): the Random-Forest model server (port 5001) over a
+    keep-alive, circuit-broken client, or the same ensemble in process.
 
-    Payload  → { temperature, humidity, co2, crop_type, crop_stage }
+    Input    → ( temperature, humidity, co2, crop_type, crop_stage )
     Response ← { risk_score: 0-1, status: Optimal|Warning|Critical }
+    None when the remote model is down, slow or its breaker is open.
     """
-    try:
-        payload = {
-            "temperature": temp,
-            "humidity":    humidity,
-            "co2":         co2,
-            "crop_type":   crop_type,
-            "crop_stage":  crop_stage,
-        }
-        resp = requests.post(MODEL_URL, json=payload, timeout=5)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as exc:
-        print(f"[AI] Model call failed: {exc}")
-        return None
+    return get_model_engine(MODEL_URL).predict_batch([(temp, humidity, co2, crop_type, crop_stage)])[0]
 
 
 def _rule_based(co2: float, temp: float, humidity: float) -> tuple:
@@ -200,9 +347,12 @@ def predict_risk():
     # Crop context from frontend query params
     crop_type  = request.args.get("crop_type",  "lettuce").lower().strip()
     crop_stage = request.args.get("crop_stage", "vegetative").lower().strip()
-    user_id    = request.args.get("user_id", 1)
+    # The session user only ever sees their own snapshot; ?user_id is for
+    # session-less callers (scripts, the legacy single-user setup)
+    from flask import session as flask_session
+    user_id    = flask_session.get("user_id") or request.args.get("user_id") or 1
 
-    sensor = get_latest_sensor_data()
+    sensor = get_latest_sensor_data(user_id)
 
     # No MQTT data yet
     if not sensor or not all(k in sensor for k in ("co2", "temp", "humidity")):
@@ -242,8 +392,7 @@ def predict_risk():
     # Try to fetch thresholds from DB for this user & crop
     db_ranges = _fetch_crop_thresholds_from_db(user_id, crop_type)
     alerts = _check_alerts(sensor, crop_type, crop_stage, ranges=db_ranges)
-    for alert in alerts:
-        alert["suggestion"] = _gemini_suggestion(alert, crop_type, crop_stage)
+    _add_suggestions(alerts, crop_type, crop_stage)
     _save_alerts_to_db(alerts, crop_type, crop_stage, user_id)
 
     return jsonify({
@@ -265,19 +414,52 @@ def predict_risk():
     }), 200
 
 
+# ── Hot statements (server-side prepared, see query_registry) ──────────────
+_ALERT_INSERT = prepared_query("crop_alert_insert", """
+    INSERT INTO crop_alerts
+      (user_id, metric, value, ideal_min, ideal_max, severity, message, suggestion, crop_type, crop_stage)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+""")
+
+
+def _alert_page_queries():
+    """
+    One prepared (page, count) pair per filter combination of /api/alerts, so
+    every variant keeps plain indexable predicates.
+    """
+    queries = {}
+    for by_severity in (False, True):
+        for by_user in (False, True):
+            where = "WHERE 1=1"
+            if by_severity:
+                where += " AND LOWER(severity) = %s"
+            if by_user:
+                where += " AND user_id = %s"
+            suffix = ("_severity" if by_severity else "") + ("_user" if by_user else "")
+            queries[(by_severity, by_user)] = (
+                prepared_query(f"crop_alerts_page{suffix}", f"""
+                    SELECT id, metric, value, ideal_min, ideal_max, severity,
+                           message, suggestion, crop_type, crop_stage, created_at
+                    FROM crop_alerts
+                    {where}
+                    ORDER BY created_at DESC LIMIT %s OFFSET %s
+                """),
+                prepared_query(f"crop_alerts_count{suffix}", f"SELECT COUNT(*) FROM crop_alerts {where}"),
+            )
+    return queries
+
+
+_ALERT_PAGE_QUERIES = _alert_page_queries()
+
+
 def _save_alerts_to_db(alerts: list, crop_type: str, crop_stage: str, user_id):
     """Persist each alert to the crop_alerts table."""
     if not alerts:
         return
     try:
         conn = get_connection()
-        cur  = conn.cursor()
-        cur.executemany(
-            """
-            INSERT INTO crop_alerts
-              (user_id, metric, value, ideal_min, ideal_max, severity, message, suggestion, crop_type, crop_stage)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """,
+        _ALERT_INSERT.executemany(
+            conn,
             [
                 (
                     user_id, a["metric"], a["value"], a["ideal_min"], a["ideal_max"],
@@ -288,7 +470,6 @@ def _save_alerts_to_db(alerts: list, crop_type: str, crop_stage: str, user_id):
             ],
         )
         conn.commit()
-        cur.close()
         conn.close()
     except Exception as exc:
         print(f"[AI] Failed to save alerts to DB: {exc}")
@@ -296,40 +477,12 @@ def _save_alerts_to_db(alerts: list, crop_type: str, crop_stage: str, user_id):
 
 def _fetch_crop_thresholds_from_db(user_id, crop_name: str) -> dict | None:
     """
-    Look up crop_thresholds by crop_name.
-    crop_thresholds table: (id, crop_name, temp_min, temp_max, humidity_min, humidity_max, co2_min, co2_max, ...)
+    Look up crop_thresholds by crop_name (case-insensitive) in the in-process
+    threshold cache, see threshold_cache.
     Returns a dict { 'temp': (min, max), 'humidity': (min, max), 'co2': (min, max) }
     or None if not found (caller falls back to CROP_IDEAL_RANGES).
     """
-    conn = None
-    try:
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute(
-            """
-            SELECT temp_min, temp_max,
-                   humidity_min, humidity_max,
-                   co2_min, co2_max
-            FROM crop_thresholds
-            WHERE LOWER(crop_name) = LOWER(%s)
-            LIMIT 1
-            """,
-            (crop_name,)
-        )
-        row = cur.fetchone()
-        cur.close()
-        if row:
-            return {
-                "temp":     (float(row[0]), float(row[1])),
-                "humidity": (float(row[2]), float(row[3])),
-                "co2":      (float(row[4]), float(row[5])),
-            }
-    except Exception as exc:
-        print(f"[AI] DB threshold lookup failed: {exc}")
-    finally:
-        if conn:
-            conn.close()
-    return None
+    return get_threshold_cache().get(crop_name)
 
 
 @ai_bp.route('/api/user/crops', methods=['GET'])
@@ -375,36 +528,18 @@ def get_alerts():
     
     conn = None
     try:
-        conn = get_connection()
-        cur  = conn.cursor()
+        conn = get_read_connection()
 
-        query = """
-            SELECT id, metric, value, ideal_min, ideal_max, severity,
-                   message, suggestion, crop_type, crop_stage, created_at
-            FROM crop_alerts
-            WHERE 1=1
-        """
-        count_query = "SELECT COUNT(*) FROM crop_alerts WHERE 1=1"
+        by_severity = severity in ("warning", "critical")
         params = []
-
-        if severity in ("warning", "critical"):
-            query += " AND LOWER(severity) = %s"
-            count_query += " AND LOWER(severity) = %s"
+        if by_severity:
             params.append(severity)
-            
         if user_id:
-            query += " AND user_id = %s"
-            count_query += " AND user_id = %s"
             params.append(user_id)
-            
-        query += " ORDER BY created_at DESC LIMIT %s OFFSET %s"
-        
-        cur.execute(query, tuple(params + [limit, offset]))
-        rows = cur.fetchall()
+        page_query, count_query = _ALERT_PAGE_QUERIES[(by_severity, bool(user_id))]
 
-        cur.execute(count_query, tuple(params))
-        total = cur.fetchone()[0]
-        cur.close()
+        rows = page_query.fetchall(conn, tuple(params + [limit, offset]))
+        total = count_query.fetchone(conn, tuple(params))[0]
 
         alerts = [
             {
@@ -443,7 +578,7 @@ def get_admin_alerts():
     limit = min(int(request.args.get("limit", 200)), 500)
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection()
         cur  = conn.cursor()
         cur.execute(
             """
@@ -495,17 +630,10 @@ def get_analytics_summary():
 
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
         
-        # 1. Total alerts last 24h for this user
-        cur.execute(
-            "SELECT COUNT(*) FROM crop_alerts WHERE user_id = %s AND created_at >= NOW() - INTERVAL 1 DAY",
-            (user_id,)
-        )
-        total_24h = cur.fetchone()[0]
-        
-        # 2. Distribution by metric for this user
+        # 1. Alerts per metric last 24h for this user (total is their sum)
         cur.execute("""
             SELECT metric, COUNT(*) as count 
             FROM crop_alerts 
@@ -513,13 +641,18 @@ def get_analytics_summary():
             GROUP BY metric
         """, (user_id,))
         distribution = [{"metric": m, "count": c} for m, c in cur.fetchall()]
+        total_24h = sum(d["count"] for d in distribution)
         
-        # 3. Health Score — based on this user's readings
-        cur.execute(
-            "SELECT COUNT(*) FROM sensor_readings WHERE user_id = %s AND timestamp_utc >= NOW() - INTERVAL 1 DAY",
-            (user_id,)
-        )
-        total_points = cur.fetchone()[0] or 1
+        # 2. Health Score — based on this user's readings
+        since = _last_24_hours_start()
+        if rollups_enabled() and rollups_cover(cur, since):
+            total_points = fetch_row_count(cur, user_id, since) or 1
+        else:
+            cur.execute(
+                "SELECT COUNT(*) FROM sensor_readings WHERE user_id = %s AND timestamp_utc >= NOW() - INTERVAL 1 DAY",
+                (user_id,)
+            )
+            total_points = cur.fetchone()[0] or 1
         health_score = max(0, min(100, (1 - (total_24h / total_points)) * 100))
         
         cur.close()
@@ -542,38 +675,80 @@ def get_analytics_summary():
             conn.close()
 
 
+def _last_24_hours_start():
+    """Start of the 24 whole UTC hours ending with the current one (naive UTC)."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    return now - timedelta(hours=23)
+
+
 @ai_bp.route('/api/analytics/trends', methods=['GET'])
 def get_analytics_trends():
-    """Returns hourly averages for the last 24h for CO2, Temp, Humidity."""
+    """
+    Returns hourly averages for the last 24h for CO2, Temp, Humidity.
+    With ?days=N (N > 1) returns daily averages for the last N days instead.
+    """
     from flask import session as flask_session
     user_id = request.args.get('user_id') or flask_session.get('user_id') or 1
+    days = max(1, min(request.args.get('days', 1, type=int), 3660))
+
+    if days > 1:
+        today = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        since, step_sec = today - timedelta(days=days - 1), 86400
+    else:
+        since, step_sec = _last_24_hours_start(), 3600
+    resolution = pick_resolution(since, step_sec) if rollups_enabled() else None
 
     conn = None
     try:
-        conn = get_connection()
+        conn = get_read_connection()
         cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT 
-                HOUR(timestamp_utc) as hr,
-                AVG(CASE WHEN sensor_type = 'temperature' THEN value END) as temp,
-                AVG(CASE WHEN sensor_type = 'humidity' THEN value END) as humidity,
-                AVG(CASE WHEN sensor_type = 'co2' THEN value END) as co2
-            FROM sensor_readings
-            WHERE user_id = %s AND timestamp_utc >= NOW() - INTERVAL 1 DAY
-            GROUP BY hr
-            ORDER BY hr ASC
-        """, (user_id,))
-        rows = cur.fetchall()
+        if resolution and not rollups_cover(cur, since):
+            # Rollups start after `since` (not backfilled yet): use raw rows
+            resolution = None
+
+        if resolution:
+            # Coarsest rollup that covers the request: at most 24 hour or N day buckets
+            rows = fetch_metric_averages(cur, user_id, resolution, since)
+            if days == 1:
+                rows = sorted(((ts.hour,) + tuple(r) for ts, *r in rows), key=lambda r: r[0])
+        elif days > 1:
+            cur.execute("""
+                SELECT 
+                    DATE(timestamp_utc) as d,
+                    AVG(CASE WHEN sensor_type = 'temperature' THEN value END) as temp,
+                    AVG(CASE WHEN sensor_type = 'humidity' THEN value END) as humidity,
+                    AVG(CASE WHEN sensor_type = 'co2' THEN value END) as co2
+                FROM sensor_readings
+                WHERE user_id = %s AND timestamp_utc >= %s
+                GROUP BY d
+                ORDER BY d ASC
+            """, (user_id, since))
+            rows = cur.fetchall()
+        elif read_wide_enabled():
+            rows = fetch_hourly_wide(cur, user_id)
+        else:
+            cur.execute("""
+                SELECT 
+                    HOUR(timestamp_utc) as hr,
+                    AVG(CASE WHEN sensor_type = 'temperature' THEN value END) as temp,
+                    AVG(CASE WHEN sensor_type = 'humidity' THEN value END) as humidity,
+                    AVG(CASE WHEN sensor_type = 'co2' THEN value END) as co2
+                FROM sensor_readings
+                WHERE user_id = %s AND timestamp_utc >= NOW() - INTERVAL 1 DAY
+                GROUP BY hr
+                ORDER BY hr ASC
+            """, (user_id,))
+            rows = cur.fetchall()
         
         trends = []
         for r in rows:
-            trends.append({
-                "hour": f"{r[0]:02}:00",
+            point = {"day": r[0].strftime("%Y-%m-%d")} if days > 1 else {"hour": f"{r[0]:02}:00"}
+            point.update({
                 "temp": round(float(r[1] or 0), 1),
                 "humidity": round(float(r[2] or 0), 1),
                 "co2": round(float(r[3] or 0), 1)
             })
+            trends.append(point)
             
         cur.close()
         return jsonify(trends), 200
@@ -18,22 +18,32 @@ import bcrypt
 import smtplib
 from email.message import EmailMessage
 from urllib.parse import urlencode
-from flask import Flask, jsonify, redirect, request, session
+from flask import Blueprint, Flask, g, jsonify, redirect, request, session
 from flask_cors import CORS
 from dotenv import load_dotenv
-from google_auth_oauthlib.flow import Flow
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
-from db_connect import get_connection, crop_api_bp
+from db_connect import get_connection, get_read_connection, get_pool_stats, get_read_pool_stats, mark_written, crop_api_bp, PoolBusyError
 from user_account import account_bp
 from ai_service import ai_bp
+from device_registry import device_bp
+from sensor_handler import sensor_bp
 from validators import validate_email, validate_password
 
-from flask_socketio import SocketIO
-from mqtt_service import start_mqtt_client, set_socketio, set_active_mqtt_user
-from apscheduler.schedulers.background import BackgroundScheduler
+from flask_socketio import SocketIO, join_room
+from mqtt_service import start_mqtt_client, set_socketio, set_active_mqtt_user, get_ingest_stats, user_room
 from ai_service import _check_alerts, _gemini_suggestion, _save_alerts_to_db
-from mqtt_service import get_latest_sensor_data, ACTIVE_MQTT_USER_ID
+from mqtt_service import get_fleet_sensor_data, reload_topic_routes
+from batch_writer import get_batch_writer_stats
+from query_registry import prepared_query, query_stats
+from threshold_cache import get_threshold_cache, refresh_thresholds
+from suggestion_cache import get_suggestion_cache
+from llm_broker import get_llm_broker
+from model_client import get_model_client_stats
+from window_aggregator import sweep_windows, get_window_stats, window_sec
+from series_compression import compression_mode, reconstruct_series, MODE_OFF
+from sensor_wide import read_wide_enabled, fetch_latest_wide
+from rollups import catch_up_rollups
+from retention import run_retention, begin_user_deletion, purge_user_data_async
+from archive import fetch_range_series
 
 load_dotenv()
 
@@ -50,29 +60,76 @@ def get_cors_origins():
   return [o.strip() for o in raw.split(",") if o.strip()] or ["http://localhost:5173"]
 
 
-app = Flask(__name__)
-app.register_blueprint(account_bp)
-app.register_blueprint(ai_bp)
-app.register_blueprint(crop_api_bp)
-# CORS(app, origins=get_cors_origins(), supports_credentials=True) # SocketIO handles its own CORS usually, but we keep this for HTTP
-CORS(app, supports_credentials=True) # Simplified for now, or keep explicit
+# Routes defined in this module; create_app() registers it with the others
+core_bp = Blueprint("core_bp", __name__)
 
-app.secret_key = os.environ.get("FLASK_SECRET", "dev-secret-change")
-app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
-app.config["SESSION_COOKIE_SECURE"] = False
 
-# Initialize SocketIO
-socketio = SocketIO(app, cors_allowed_origins="*") # Allow all for dev, restrict in prod
-set_socketio(socketio)
+# ── Load shedding: DB pool wait budget exhausted → 429 + Retry-After ───────
+def _shed_response(retry_after):
+  response = jsonify({"message": "Server busy, please retry."})
+  response.status_code = 429
+  response.headers["Retry-After"] = str(retry_after)
+  return response
 
-# Start MQTT Service in Background
-# Use a flag to prevent double-start with reloader?
-# paho-mqtt loop_start() is robust enough mostly.
-if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
-    start_mqtt_client()
-else:
-    # Logic for production servers (gunicorn etc) or first run
-    start_mqtt_client()
+
+@core_bp.app_errorhandler(PoolBusyError)
+def handle_pool_busy(exc):
+  return _shed_response(exc.retry_after)
+
+
+@core_bp.after_app_request
+def track_writes_for_read_routing(response):
+  # A successful write pins this browser session to the primary for a few
+  # seconds, so reads routed to the read pool / replica see its own changes
+  if request.method in ("POST", "PUT", "PATCH", "DELETE") and response.status_code < 400:
+    mark_written()
+  return response
+
+
+@core_bp.after_app_request
+def shed_swallowed_pool_busy(response):
+  # Most routes catch Exception and answer 500; report shedding as 429 instead
+  exc = g.pop("db_pool_busy", None)
+  if exc is not None and response.status_code >= 500:
+    return _shed_response(exc.retry_after)
+  return response
+
+
+socketio = None
+
+
+def _join_user_room(auth=None):
+  """Socket.IO connect: subscribe the logged-in user to their own live readings and alerts."""
+  user_id = session.get("user_id")
+  if user_id:
+    join_room(user_room(user_id))
+
+
+def create_app():
+  """
+  Build the Flask app and its SocketIO server. Nothing here touches the
+  database, the MQTT broker or the scheduler; call start_services() for that.
+  """
+  global socketio
+  app = Flask(__name__)
+  app.register_blueprint(core_bp)
+  app.register_blueprint(account_bp)
+  app.register_blueprint(ai_bp)
+  app.register_blueprint(crop_api_bp)
+  app.register_blueprint(device_bp)
+  app.register_blueprint(sensor_bp)
+  # CORS(app, origins=get_cors_origins(), supports_credentials=True) # SocketIO handles its own CORS usually, but we keep this for HTTP
+  CORS(app, supports_credentials=True) # Simplified for now, or keep explicit
+
+  app.secret_key = os.environ.get("FLASK_SECRET", "dev-secret-change")
+  app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
+  app.config["SESSION_COOKIE_SECURE"] = False
+
+  # Initialize SocketIO
+  socketio = SocketIO(app, cors_allowed_origins="*") # Allow all for dev, restrict in prod
+  socketio.on_event("connect", _join_user_room)
+  set_socketio(socketio)
+  return app
 
 
 # ── Background scheduler: check alerts every 60s autonomously ─────────────
@@ -85,24 +142,46 @@ DEFAULT_CROP_CHECKS = [
 ]
 
 def background_alert_check():
-    """Runs every 60s in background — checks sensor readings and saves alerts."""
-    sensor = get_latest_sensor_data()
-    if not sensor or not sensor.get("temp"):   # no data yet
+    """Runs every 60s in background — checks each user's latest readings and saves alerts."""
+    fleet = get_fleet_sensor_data()
+    if not fleet:   # no data yet
         return
-    for crop_type, crop_stage in DEFAULT_CROP_CHECKS:
-        alerts = _check_alerts(sensor, crop_type, crop_stage)
-        if not alerts:
-            continue
-        for alert in alerts:
-            alert["suggestion"] = _gemini_suggestion(alert, crop_type, crop_stage)
-        _save_alerts_to_db(alerts, crop_type, crop_stage, ACTIVE_MQTT_USER_ID)
-    print(f"[Scheduler] Alert check done — sensor: temp={sensor.get('temp')}, "
-          f"hum={sensor.get('humidity')}, co2={sensor.get('co2')}")
-
-_scheduler = BackgroundScheduler(daemon=True)
-_scheduler.add_job(background_alert_check, 'interval', seconds=60, id='alert_check')
-_scheduler.start()
-print("[Scheduler] Background alert checker started (every 60s)")
+    for user_id, snap in fleet.items():
+        sensor = snap.as_dict()
+        for crop_type, crop_stage in DEFAULT_CROP_CHECKS:
+            alerts = _check_alerts(sensor, crop_type, crop_stage)
+            if not alerts:
+                continue
+            for alert in alerts:
+                alert["suggestion"] = _gemini_suggestion(alert, crop_type, crop_stage)
+            _save_alerts_to_db(alerts, crop_type, crop_stage, user_id)
+        print(f"[Scheduler] Alert check done — user {user_id}: temp={snap.temp}, "
+              f"hum={snap.humidity}, co2={snap.co2}")
+
+_scheduler = None
+
+
+def start_services():
+    """Start the MQTT client and the background scheduler (idempotent)."""
+    global _scheduler
+    if _scheduler is not None:
+        return
+    # Imported here: APScheduler is only needed by the serving process
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    # Preload so the first prediction / alert check is a dict lookup
+    get_threshold_cache().reload()
+    start_mqtt_client()
+
+    _scheduler = BackgroundScheduler(daemon=True)
+    _scheduler.add_job(background_alert_check, 'interval', seconds=60, id='alert_check')
+    _scheduler.add_job(sweep_windows, 'interval', seconds=15, id='window_sweep')
+    _scheduler.add_job(catch_up_rollups, 'interval', minutes=10, id='rollup_catch_up')
+    _scheduler.add_job(run_retention, 'interval', hours=6, id='retention')
+    _scheduler.add_job(refresh_thresholds, 'interval',
+                       seconds=int(os.environ.get("CROP_THRESHOLD_REFRESH_SEC", 15)), id='threshold_refresh')
+    _scheduler.start()
+    print("[Scheduler] Background alert checker started (every 60s)")
 
 
 RESET_LINK_DEBUG = bool(int(os.environ.get("RESET_LINK_DEBUG", "0")))
@@ -225,6 +304,8 @@ def build_google_flow(state: str | None = None):
   redirect_uri = os.environ.get("GOOGLE_REDIRECT_URI")
   if not client_id or not client_secret or not redirect_uri:
     raise RuntimeError("Google OAuth env vars missing (GOOGLE_CLIENT_ID/SECRET/REDIRECT_URI)")
+  # Imported here: the Google auth stack is slow to import and only used for OAuth
+  from google_auth_oauthlib.flow import Flow
   flow = Flow.from_client_config(
     {
       "web": {
@@ -242,7 +323,7 @@ def build_google_flow(state: str | None = None):
   return flow
 
 
-@app.post("/api/signup")
+@core_bp.post("/api/signup")
 def signup_user():
   data = request.get_json(silent=True) or {}
   email = (data.get("email") or "").strip()
@@ -273,7 +354,7 @@ def signup_user():
     conn.close()
 
 
-@app.post("/api/login")
+@core_bp.post("/api/login")
 def login_user():
   data = request.get_json(silent=True) or {}
   email = (data.get("email") or "").strip()
@@ -314,7 +395,7 @@ def login_user():
   finally:
     conn.close()
 
-@app.post("/api/sensors/active_user")
+@core_bp.post("/api/sensors/active_user")
 def update_active_mqtt_user():
   """Sync the frontend's active user session to the MQTT backend process."""
   data = request.get_json(silent=True) or {}
@@ -326,7 +407,7 @@ def update_active_mqtt_user():
   return jsonify({"message": "Active MQTT user updated successfully."}), 200
 
 
-@app.post("/api/forgot-password")
+@core_bp.post("/api/forgot-password")
 def forgot_password():
   data = request.get_json(silent=True) or {}
   email = (data.get("email") or "").strip()
@@ -363,7 +444,7 @@ def forgot_password():
     conn.close()
 
 
-@app.post("/api/reset-password")
+@core_bp.post("/api/reset-password")
 def reset_password():
   data = request.get_json(silent=True) or {}
   token = (data.get("token") or "").strip()
@@ -432,7 +513,7 @@ def reset_password():
     conn.close()
 
 
-@app.get("/api/users")
+@core_bp.get("/api/users")
 def get_all_users():
   """Fetch all users for admin panel. Requires admin role."""
   # Check if user is authenticated and is admin
@@ -445,7 +526,7 @@ def get_all_users():
   if user_role != "ADMIN":
     return jsonify({"message": "Forbidden. Admin access required."}), 403
   
-  conn = get_connection()
+  conn = get_read_connection()
   try:
     cur = conn.cursor()
     cur.execute(
@@ -476,7 +557,7 @@ def get_all_users():
     conn.close()
 
 
-@app.patch("/api/users/<int:user_id_to_mod>/status")
+@core_bp.patch("/api/users/<int:user_id_to_mod>/status")
 def toggle_status(user_id_to_mod):
   """Toggle user status between active and inactive."""
   admin_id = session.get("user_id")
@@ -502,7 +583,7 @@ def toggle_status(user_id_to_mod):
     conn.close()
 
 
-@app.delete("/api/users/<int:user_id_to_del>")
+@core_bp.delete("/api/users/<int:user_id_to_del>")
 def delete_user_account(user_id_to_del):
   """Permanently delete a user account."""
   admin_id = session.get("user_id")
@@ -513,11 +594,17 @@ def delete_user_account(user_id_to_del):
   conn = get_connection()
   try:
     cur = conn.cursor()
-    # Delete related sensor readings first due to FK or logic
-    cur.execute("DELETE FROM sensor_readings WHERE user_id=%s", (user_id_to_del,))
-    cur.execute("DELETE FROM users WHERE id=%s", (user_id_to_del,))
+    # Deactivate, drop devices and record the purge job in one transaction; the
+    # users row itself is deleted by the purge after its child rows, so kept
+    # foreign keys on sensor_readings / crop_alerts neither block nor cascade
+    devices_removed = begin_user_deletion(cur, user_id_to_del)
     conn.commit()
     cur.close()
+    if devices_removed:
+      reload_topic_routes()
+    # Sensor data and alerts are purged in small batches off the request thread;
+    # one big DELETE would lock the hot ingest tables
+    purge_user_data_async(user_id_to_del)
     return jsonify({"message": "User deleted successfully."}), 200
   except Exception as e:
     return jsonify({"message": "Unable to delete user."}), 500
@@ -527,12 +614,40 @@ def delete_user_account(user_id_to_del):
 
 
 
-@app.get("/health")
+@core_bp.get("/health")
 def health():
   return jsonify({"status": "ok"})
 
 
-@app.get("/api/sensors/history")
+@core_bp.get("/api/metrics")
+def get_metrics():
+  """In-process ingest/backend counters for capacity planning. Admin only."""
+  if session.get("role") != "ADMIN":
+    return jsonify({"message": "Forbidden."}), 403
+  return jsonify({
+    "mqtt_ingest": get_ingest_stats(),
+    "sensor_batch_writer": get_batch_writer_stats(),
+    "sensor_windows": get_window_stats(),
+    "db_pool": get_pool_stats(),
+    "db_read_pool": get_read_pool_stats(),
+    "db_queries": query_stats(),
+    "crop_thresholds": get_threshold_cache().stats(),
+    "ai_suggestions": get_suggestion_cache().stats(),
+    "llm_broker": get_llm_broker().stats(),
+    "risk_model": get_model_client_stats(),
+  }), 200
+
+
+_LATEST_READINGS = prepared_query("sensor_readings_latest", """
+  SELECT sensor_type, value, timestamp_utc
+  FROM sensor_readings
+  WHERE user_id = %s
+  ORDER BY timestamp_utc DESC
+  LIMIT 150
+""")
+
+
+@core_bp.get("/api/sensors/history")
 def get_sensor_history():
   """
   Fetch recent sensor readings from database for the logged-in user.
@@ -540,23 +655,35 @@ def get_sensor_history():
   """
   user_id = session.get("user_id") or 1  # Default to 1 for dev if no session
   
-  conn = get_connection()
+  conn = get_read_connection()
   try:
     cur = conn.cursor()
+    if read_wide_enabled():
+      # One row per timestamp already: no pivot, 50 rows instead of 150
+      history = []
+      for ts, co2, temp, humidity in fetch_latest_wide(cur, user_id, 50):
+        point = {"time": ts.strftime("%H:%M:%S")}
+        for key, value in (("co2", co2), ("temp", temp), ("humidity", humidity)):
+          if value is not None:
+            point[key] = float(value)
+        history.append(point)
+      cur.close()
+      return jsonify(history), 200
+
     # Fetch last 60 records (which would be 20 sets of co2/temp/hum)
     # or more if we want a longer history. Let's get last 150 records.
-    cur.execute(
-      """
-      SELECT sensor_type, value, timestamp_utc 
-      FROM sensor_readings 
-      WHERE user_id = %s 
-      ORDER BY timestamp_utc DESC 
-      LIMIT 150
-      """,
-      (user_id,)
-    )
-    rows = cur.fetchall()
     cur.close()
+    rows = _LATEST_READINGS.fetchall(conn, (user_id,))
+
+    if compression_mode() != MODE_OFF:
+      # Compressed series: stored points are sparse, rebuild a per-window grid
+      history = []
+      for ts, values in reconstruct_series(rows, window_sec(), max_points=50):
+        point = {"time": ts.strftime("%H:%M:%S")}
+        for sensor_type, value in values.items():
+          point["temp" if sensor_type == "temperature" else sensor_type] = round(value, 2)
+        history.append(point)
+      return jsonify(history), 200
     
     # Process rows into a list of { time, co2, temp, humidity }
     # Since they are inserted together, they likely have exact same timestamp
@@ -593,16 +720,59 @@ def get_sensor_history():
     conn.close()
 
 
-@app.get("/api/sensors/reports")
+def _utc_arg(name):
+  """Parse an ISO date/datetime query arg into naive UTC (None if absent)."""
+  raw = request.args.get(name)
+  if not raw:
+    return None
+  value = datetime.fromisoformat(raw)
+  if value.tzinfo is not None:
+    value = value.astimezone(timezone.utc).replace(tzinfo=None)
+  return value
+
+
+@core_bp.get("/api/sensors/reports")
 def get_sensor_reports():
   """
   Fetch all sensor readings for the logged-in user to generate reports.
+  With ?start=YYYY-MM-DD[&end=...] returns up to 1000 averaged points for that
+  range, including months already moved to the columnar archive.
   """
   user_id = session.get("user_id") or 1  # Default to 1 for dev
+  try:
+    start = _utc_arg("start")
+    end = _utc_arg("end") or datetime.now(timezone.utc).replace(tzinfo=None)
+  except ValueError:
+    return jsonify({"message": "start and end must be ISO dates."}), 400
+  if start is not None and start >= end:
+    return jsonify({"message": "start must be before end."}), 400
   
-  conn = get_connection()
+  conn = get_read_connection()
   try:
     cur = conn.cursor()
+    if start is not None:
+      reports = []
+      for ts, values in fetch_range_series(cur, user_id, start, end, max_points=1000):
+        point = {"timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"), "co2": 0, "temp": 0, "humidity": 0}
+        for sensor_type, value in values.items():
+          point["temp" if sensor_type == "temperature" else sensor_type] = round(value, 2)
+        reports.append(point)
+      cur.close()
+      return jsonify(reports), 200
+
+    if read_wide_enabled():
+      reports = [
+        {
+          "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"),
+          "co2": float(co2 or 0),
+          "temp": float(temp or 0),
+          "humidity": float(humidity or 0)
+        }
+        for ts, co2, temp, humidity in fetch_latest_wide(cur, user_id, 333)
+      ]
+      cur.close()
+      return jsonify(reports), 200
+
     # Fetch a larger set of records for reporting (e.g., last 1000)
     cur.execute(
       """
@@ -616,6 +786,15 @@ def get_sensor_reports():
     )
     rows = cur.fetchall()
     cur.close()
+
+    if compression_mode() != MODE_OFF:
+      reports = []
+      for ts, values in reconstruct_series(rows, window_sec(), max_points=333):
+        point = {"timestamp": ts.strftime("%Y-%m-%d %H:%M:%S"), "co2": 0, "temp": 0, "humidity": 0}
+        for sensor_type, value in values.items():
+          point["temp" if sensor_type == "temperature" else sensor_type] = round(value, 2)
+        reports.append(point)
+      return jsonify(reports), 200
     
     timestamp_map = {}
     for sensor_type, value, ts in rows:
@@ -645,7 +824,7 @@ def get_sensor_reports():
     conn.close()
 
 
-@app.get("/api/google/start")
+@core_bp.get("/api/google/start")
 def google_start():
   flow = build_google_flow()
   auth_url, state = flow.authorization_url(
@@ -657,12 +836,15 @@ def google_start():
   return redirect(auth_url)
 
 
-@app.get("/api/google/callback")
+@core_bp.get("/api/google/callback")
 def google_callback():
   state = request.args.get("state") or session.get("state")
   if not state:
     return jsonify({"message": "Missing OAuth state."}), 400
 
+  from google.oauth2 import id_token
+  from google.auth.transport import requests as google_requests
+
   flow = build_google_flow(state=state)
   flow.fetch_token(authorization_response=request.url)
 
@@ -696,6 +878,23 @@ def google_callback():
   return redirect(target)
 
 
+_app = None
+
+
+def __getattr__(name):
+  # `app:app` (WSGI servers, flask run) still works: build the app and start
+  # services on first access instead of at import
+  global _app
+  if name == "app":
+    if _app is None:
+      _app = create_app()
+      start_services()
+    return _app
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 if __name__ == "__main__":
+  app = create_app()
+  start_services()
   # Change app.run to socketio.run
   socketio.run(app, host="0.0.0.0", port=int(os.environ.get("PORT", 5000)), debug=bool(int(os.environ.get("FLASK_DEBUG", 0))), allow_unsafe_werkzeug=True)
@@ -0,0 +1,371 @@
+"""
+Columnar archive for sensor_readings months that retention drops from MySQL.
+
+Before a partition is dropped its rows are streamed (unbuffered server-side
+cursor, ordered by the unique key) into one segment file per month:
+
+    <SENSOR_ARCHIVE_DIR>/sensor_readings/pYYYYMM.seg
+
+Segment layout:
+
+    MAGIC (8 bytes)
+    chunks  – per series (user, device, metric), up to SENSOR_ARCHIVE_CHUNK_ROWS
+              rows each, stored as separately zlib-compressed columns:
+                ts     uint32 minute deltas (first minute kept in the index)
+                value  float32 window mean
+                min    float32
+                max    float32
+                count  uint32 samples in the window
+    footer  – zlib JSON index: one entry per chunk with user, device, metric,
+              first/last minute, row count, value min/max and column offsets
+    trailer – uint64 footer offset, uint32 footer length, MAGIC
+
+`ArchiveSegment` memory-maps a segment, prunes chunks by the footer and only
+inflates the columns a query needs.  `fetch_range_series` merges archived
+months with what is still in MySQL for long-range reports.
+
+Commands:
+    python archive.py export pYYYYMM
+    python archive.py import <segment> [--user-id N]
+    python archive.py inspect <segment>
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import zlib
+from array import array
+from datetime import datetime, timezone
+from itertools import accumulate
+
+MAGIC = b"ECOSEG\x01\x00"
+_TRAILER = struct.Struct("<QI8s")
+_COLUMN_TYPES = {"ts": "I", "value": "f", "min": "f", "max": "f", "count": "I"}
+# Partition month names are pYYYYMM (see retention)
+_SEGMENT_SUFFIX = ".seg"
+
+
+def archive_dir():
+    """Archive root; an empty SENSOR_ARCHIVE_DIR disables archiving."""
+    return os.environ.get("SENSOR_ARCHIVE_DIR", "sensor_archive").strip()
+
+
+def _chunk_rows() -> int:
+    return int(os.environ.get("SENSOR_ARCHIVE_CHUNK_ROWS", 4096))
+
+
+def segment_path(root, partition, table="sensor_readings"):
+    return os.path.join(root, table, partition + _SEGMENT_SUFFIX)
+
+
+# ── Writer ──────────────────────────────────────────────────────────────────
+class SegmentWriter:
+    """Append rows of one series at a time; chunks are cut on series change or size."""
+
+    def __init__(self, path, chunk_rows=None):
+        self.path = path
+        self.chunk_rows = chunk_rows or _chunk_rows()
+        self._tmp = path + ".tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._f = open(self._tmp, "wb")
+        self._f.write(MAGIC)
+        self._index = []
+        self._key = None
+        self._cols = None
+        self.rows = 0
+
+    def add(self, user_id, device_id, sensor_type, minute, value, vmin, vmax, count):
+        key = (user_id, device_id, sensor_type)
+        if key != self._key or len(self._cols["ts"]) >= self.chunk_rows:
+            self._flush_chunk()
+            self._key = key
+            self._cols = {name: [] for name in _COLUMN_TYPES}
+        cols = self._cols
+        cols["ts"].append(minute)
+        cols["value"].append(value)
+        cols["min"].append(vmin)
+        cols["max"].append(vmax)
+        cols["count"].append(count)
+        self.rows += 1
+
+    def _flush_chunk(self):
+        if not self._cols or not self._cols["ts"]:
+            return
+        minutes = self._cols["ts"]
+        deltas = [0] + [b - a for a, b in zip(minutes, minutes[1:])]
+        columns = {}
+        for name, typecode in _COLUMN_TYPES.items():
+            data = deltas if name == "ts" else self._cols[name]
+            blob = zlib.compress(array(typecode, data).tobytes(), 6)
+            columns[name] = [self._f.tell(), len(blob)]
+            self._f.write(blob)
+        user_id, device_id, sensor_type = self._key
+        self._index.append({
+            "user":   user_id,
+            "device": device_id,
+            "metric": sensor_type,
+            "t0":     minutes[0],
+            "t1":     minutes[-1],
+            "n":      len(minutes),
+            "vmin":   min(self._cols["min"]),
+            "vmax":   max(self._cols["max"]),
+            "cols":   columns,
+        })
+        self._cols = None
+
+    def close(self):
+        """Write footer + trailer and atomically move the segment into place."""
+        self._flush_chunk()
+        footer = zlib.compress(json.dumps(self._index, separators=(",", ":")).encode(), 6)
+        offset = self._f.tell()
+        self._f.write(footer)
+        self._f.write(_TRAILER.pack(offset, len(footer), MAGIC))
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._f.close()
+        try:
+            os.remove(self._tmp)
+        except FileNotFoundError:
+            pass
+
+
+def export_partition(conn, partition, root=None, fetch_size=5000):
+    """
+    Stream one sensor_readings partition into a segment. Returns the row count.
+    Raises on failure, leaving no partial segment behind.
+    """
+    root = root or archive_dir()
+    writer = SegmentWriter(segment_path(root, partition))
+    cur = conn.cursor(buffered=False)
+    try:
+        cur.execute(
+            f"""
+            SELECT user_id, device_id, sensor_type, minute_bucket, value,
+                   COALESCE(value_min, value), COALESCE(value_max, value), sample_count
+            FROM sensor_readings PARTITION ({partition})
+            ORDER BY user_id, device_id, sensor_type, minute_bucket
+            """
+        )
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                writer.add(*row)
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    finally:
+        cur.close()
+    print(f"[Archive] Exported {writer.rows} row(s) of {partition} to {writer.path}")
+    return writer.rows
+
+
+# ── Reader ──────────────────────────────────────────────────────────────────
+class ArchiveSegment:
+    """Memory-mapped, read-only view of one segment file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an archive segment")
+        offset, length, magic = _TRAILER.unpack_from(self._mm, len(self._mm) - _TRAILER.size)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} has a damaged trailer")
+        self.index = json.loads(zlib.decompress(self._mm[offset:offset + length]))
+
+    def _column(self, entry, name):
+        off, length = entry["cols"][name]
+        values = array(_COLUMN_TYPES[name])
+        values.frombytes(zlib.decompress(self._mm[off:off + length]))
+        return values
+
+    def scan(self, user_id=None, start_minute=None, end_minute=None, metrics=None, columns=("value",)):
+        """
+        Yield (user_id, device_id, metric, minutes, {column: values}) per matching
+        chunk, trimmed to [start_minute, end_minute). Chunks outside the range or
+        for other users are skipped using the footer alone.
+        """
+        for entry in self.index:
+            if user_id is not None and entry["user"] != user_id:
+                continue
+            if metrics is not None and entry["metric"] not in metrics:
+                continue
+            if start_minute is not None and entry["t1"] < start_minute:
+                continue
+            if end_minute is not None and entry["t0"] >= end_minute:
+                continue
+            minutes = list(accumulate(self._column(entry, "ts"), initial=entry["t0"]))[1:]
+            data = {name: self._column(entry, name) for name in columns}
+            lo, hi = 0, len(minutes)
+            if start_minute is not None or end_minute is not None:
+                keep = [i for i, m in enumerate(minutes)
+                        if (start_minute is None or m >= start_minute) and (end_minute is None or m < end_minute)]
+                if not keep:
+                    continue
+                lo, hi = keep[0], keep[-1] + 1
+            yield (entry["user"], entry["device"], entry["metric"], minutes[lo:hi],
+                   {name: values[lo:hi] for name, values in data.items()})
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def _month_of(minute):
+    return datetime.fromtimestamp(minute * 60, tz=timezone.utc).strftime("p%Y%m")
+
+
+def archived_segments(root, start_minute, end_minute, table="sensor_readings"):
+    """Segment paths whose month overlaps [start_minute, end_minute), oldest first."""
+    directory = os.path.join(root, table)
+    if not os.path.isdir(directory):
+        return []
+    first, last = _month_of(start_minute), _month_of(end_minute - 1)
+    return [
+        os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.endswith(_SEGMENT_SUFFIX) and first <= name[:-len(_SEGMENT_SUFFIX)] <= last
+    ]
+
+
+# ── Long-range reports ──────────────────────────────────────────────────────
+def fetch_range_series(cur, user_id, start, end, max_points=1000):
+    """
+    Count-weighted means per bucket for [start, end) (naive UTC), merged from
+    MySQL and the archive, as [(bucket_start, {sensor_type: mean})] oldest first.
+    The bucket width is a whole number of minutes chosen so the result has at
+    most `max_points` buckets. Archived months still present in MySQL are read
+    from MySQL only.
+    """
+    from batch_writer import minute_bucket
+    from retention import PARTITIONED_TABLES, FUTURE_PARTITION, _partitions
+
+    start_min, end_min = minute_bucket(start), minute_bucket(end)
+    step = max(1, -(-(end_min - start_min) // max_points))
+    buckets = {}
+
+    def _add(bucket, sensor_type, total, count):
+        acc = buckets.setdefault(bucket, {}).setdefault(sensor_type, [0.0, 0])
+        acc[0] += total
+        acc[1] += count
+
+    cur.execute(
+        """
+        SELECT (minute_bucket - %s) DIV %s AS b, sensor_type, SUM(value * sample_count), SUM(sample_count)
+        FROM sensor_readings
+        WHERE user_id = %s AND minute_bucket >= %s AND minute_bucket < %s
+        GROUP BY b, sensor_type
+        """,
+        (start_min, step, user_id, start_min, end_min)
+    )
+    for b, sensor_type, total, count in cur.fetchall():
+        _add(int(b), sensor_type, float(total), int(count))
+
+    # Months before the oldest partition still in MySQL live only in the archive
+    root = archive_dir()
+    partitions, _ = _partitions(cur, PARTITIONED_TABLES[0])
+    monthly = [p for p in partitions if p != FUTURE_PARTITION]
+    archive_end = min(end_min, minute_bucket(datetime.strptime(monthly[0], "p%Y%m"))) if monthly else start_min
+    if root and archive_end > start_min:
+        for path in archived_segments(root, start_min, archive_end):
+            segment = ArchiveSegment(path)
+            try:
+                for _, _, sensor_type, minutes, cols in segment.scan(
+                        int(user_id), start_min, archive_end, columns=("value", "count")):
+                    for m, value, count in zip(minutes, cols["value"], cols["count"]):
+                        _add((m - start_min) // step, sensor_type, value * count, count)
+            finally:
+                segment.close()
+
+    series = []
+    for b in sorted(buckets):
+        ts = datetime.fromtimestamp((start_min + b * step) * 60, tz=timezone.utc).replace(tzinfo=None)
+        series.append((ts, {t: total / count for t, (total, count) in buckets[b].items() if count}))
+    return series
+
+
+# ── Import ──────────────────────────────────────────────────────────────────
+def import_segment(path, user_id=None, chunk=2000):
+    """Load a segment back into sensor_readings (duplicates are skipped)."""
+    from db_connect import get_connection
+    from batch_writer import build_insert, ON_DUPLICATE_IGNORE
+
+    segment = ArchiveSegment(path)
+    conn = get_connection()
+    inserted = 0
+    try:
+        cur = conn.cursor()
+        items = []
+        for uid, device_id, sensor_type, minutes, cols in segment.scan(
+                user_id, columns=("value", "min", "max", "count")):
+            for i, m in enumerate(minutes):
+                ts = datetime.fromtimestamp(m * 60, tz=timezone.utc)
+                value = cols["value"][i]
+                items.append((uid, device_id, ts,
+                              ((sensor_type, value, cols["min"][i], cols["max"][i], value, cols["count"][i]),)))
+                if len(items) >= chunk:
+                    sql, params, _ = build_insert(items, ON_DUPLICATE_IGNORE)
+                    cur.execute(sql, params)
+                    conn.commit()
+                    inserted += cur.rowcount
+                    items = []
+        if items:
+            sql, params, _ = build_insert(items, ON_DUPLICATE_IGNORE)
+            cur.execute(sql, params)
+            conn.commit()
+            inserted += cur.rowcount
+        cur.close()
+    finally:
+        conn.close()
+        segment.close()
+    print(f"[Archive] Imported {inserted} row(s) from {path}")
+    return inserted
+
+
+def _inspect(path):
+    segment = ArchiveSegment(path)
+    try:
+        rows = sum(e["n"] for e in segment.index)
+        series = {(e["user"], e["device"], e["metric"]) for e in segment.index}
+        size = os.path.getsize(path)
+        print(f"{path}: {rows} rows, {len(series)} series, {len(segment.index)} chunks, "
+              f"{size} bytes ({size / rows:.2f} B/row)" if rows else f"{path}: empty")
+    finally:
+        segment.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sensor_readings columnar archive")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_ex = sub.add_parser("export", help="write one sensor_readings partition to a segment")
+    p_ex.add_argument("partition", help="partition name, e.g. p202401")
+    p_im = sub.add_parser("import", help="load a segment back into sensor_readings")
+    p_im.add_argument("segment")
+    p_im.add_argument("--user-id", type=int, default=None, help="only this user's series")
+    p_in = sub.add_parser("inspect", help="print segment statistics")
+    p_in.add_argument("segment")
+    args = parser.parse_args()
+
+    if args.cmd == "export":
+        from db_connect import get_connection
+        conn = get_connection()
+        try:
+            export_partition(conn, args.partition)
+        finally:
+            conn.close()
+    elif args.cmd == "import":
+        import_segment(args.segment, args.user_id)
+    else:
+        _inspect(args.segment)
@@ -0,0 +1,387 @@
+"""
+Write-behind buffer for sensor_readings.
+
+Both ingest paths (MQTT and /api/sensors/ingest) used to check out a pooled
+connection and commit a 3-row INSERT per accepted reading.  Readings are now
+appended to an in-memory buffer shared by all users and flushed as one
+multi-row INSERT when either SENSOR_BATCH_MAX_READINGS readings are pending
+or SENSOR_BATCH_FLUSH_MS milliseconds have passed.  The buffer is flushed on
+interpreter shutdown as well.
+
+A failed flush is classified: transient errors (lost connection, lock wait
+timeout, deadlock, busy pool) keep the batch at the head for the next flush,
+up to SENSOR_BATCH_MAX_RETRIES attempts; permanent ones (DataError,
+IntegrityError, ProgrammingError) split the batch to isolate the bad items.
+Items that cannot be written are appended to SENSOR_DEAD_LETTER_PATH (one
+JSON line each) so one poison batch never blocks the ones behind it.
+
+Rows carry the window summary produced by window_aggregator (mean in `value`
+plus min / max / last / sample_count); single raw readings are stored as a
+one-sample window.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from db_connect import get_connection, PRIORITY_INGEST
+from query_registry import multirow_query
+from snapshot_store import DEFAULT_DEVICE_ID
+
+# EAV layout: each reading becomes one row per sensor_type
+_SENSOR_TYPES = ("co2", "temperature", "humidity")
+_INSERT_COLUMNS = ("(user_id, device_id, sensor_type, value, value_min, value_max, value_last, "
+                   "sample_count, timestamp_utc, minute_bucket)")
+_ROW_PLACEHOLDER = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+
+# Dedup is enforced by UNIQUE (user_id, device_id, sensor_type, minute_bucket):
+#   merge  – live ingest: a window split across a restart is folded into the stored
+#            row (count-weighted mean, min/max widened, newest last). MySQL applies
+#            the assignments left to right, so sample_count must be updated last.
+#   ignore – bulk uploads: re-sending the same batch is a no-op.
+ON_DUPLICATE_MERGE = "merge"
+ON_DUPLICATE_IGNORE = "ignore"
+_MERGE_CLAUSE = """
+    ON DUPLICATE KEY UPDATE
+      value = (value * sample_count + VALUES(value) * VALUES(sample_count)) / (sample_count + VALUES(sample_count)),
+      value_min = LEAST(COALESCE(value_min, VALUES(value_min)), VALUES(value_min)),
+      value_max = GREATEST(COALESCE(value_max, VALUES(value_max)), VALUES(value_max)),
+      value_last = IF(VALUES(timestamp_utc) >= timestamp_utc, VALUES(value_last), value_last),
+      sample_count = sample_count + VALUES(sample_count)
+"""
+
+
+def minute_bucket(ts) -> int:
+    """Minutes since the epoch for an aware or naive-UTC datetime."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() // 60)
+
+
+def build_insert(batch, on_duplicate=ON_DUPLICATE_MERGE):
+    """
+    Build one multi-row INSERT for a list of (user_id, device_id, ts, metrics) items,
+    where metrics is a tuple of (sensor_type, mean, min, max, last, count).
+    Returns (sql, params, row_count).
+    """
+    params = []
+    rows = 0
+    for row in insert_rows(batch):
+        params.extend(row)
+        rows += 1
+    placeholders = ", ".join([_ROW_PLACEHOLDER] * rows)
+    if on_duplicate == ON_DUPLICATE_IGNORE:
+        sql = f"INSERT IGNORE INTO sensor_readings {_INSERT_COLUMNS} VALUES {placeholders}"
+    else:
+        sql = f"INSERT INTO sensor_readings {_INSERT_COLUMNS} VALUES {placeholders}{_MERGE_CLAUSE}"
+    return sql, params, rows
+
+
+def insert_rows(batch):
+    """Per-row parameter tuples of a batch, in _INSERT_COLUMNS order."""
+    rows = []
+    for user_id, device_id, ts, metrics in batch:
+        bucket = minute_bucket(ts)
+        for sensor_type, value, vmin, vmax, vlast, count in metrics:
+            rows.append((user_id, device_id, sensor_type, value, vmin, vmax, vlast, count, ts, bucket))
+    return rows
+
+
+# Live flushes go through a prepared statement (see query_registry)
+SENSOR_INSERT = multirow_query(
+    "sensor_readings_insert", f"INSERT INTO sensor_readings {_INSERT_COLUMNS}", _ROW_PLACEHOLDER, _MERGE_CLAUSE
+)
+
+
+# Errors that retrying the same rows cannot fix: driver errors (matched by class
+# name so this module imports without mysql.connector) and malformed items that
+# fail while the statements are built
+_PERMANENT_ERRORS = {"DataError", "IntegrityError", "ProgrammingError", "NotSupportedError",
+                     "TypeError", "ValueError", "KeyError", "IndexError", "AttributeError"}
+_TRANSIENT_ERRNOS = {1205, 1213}   # lock wait timeout, deadlock
+
+
+def is_transient_error(exc) -> bool:
+    """True for errors worth retrying unchanged (connection, lock wait, deadlock, pool)."""
+    if getattr(exc, "errno", None) in _TRANSIENT_ERRNOS:
+        return True
+    return not any(cls.__name__ in _PERMANENT_ERRORS for cls in type(exc).__mro__)
+
+
+def window_item(agg):
+    """Convert a closed WindowAggregate into a build_insert item."""
+    metrics = tuple(
+        (sensor_type, m.mean, m.vmin, m.vmax, m.last, m.count)
+        for sensor_type, m in agg.metrics.items()
+    )
+    return (agg.user_id, agg.device_id, agg.window_start, metrics)
+
+
+class SensorBatchWriter:
+    """Collects readings / window aggregates from all users and flushes them in bulk."""
+
+    def __init__(self, max_readings=200, flush_ms=500, max_pending=20000, max_retries=5,
+                 dead_letter_path="sensor_dead_letter.ndjson"):
+        self.max_readings = max(1, int(max_readings))
+        self.flush_interval = max(1, int(flush_ms)) / 1000.0
+        self.max_pending = max(self.max_readings, int(max_pending))
+        self.max_retries = max(1, int(max_retries))
+        self.dead_letter_path = dead_letter_path
+
+        self._buffer = []
+        self._retry = None          # (batch, attempts) after a transient failure; written first
+        # Optional observer(batch, committed_at) called after each commit — used by ingest_bench
+        self.on_flush = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+
+        self._flushes = 0
+        self._readings_written = 0
+        self._failures = 0
+        self._dropped = 0
+        self._dead_lettered = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+        self._max_batch = 0
+        self._rows_merged = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sensor-batch-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def add(self, user_id, co2, temp, humidity, ts=None, device_id=DEFAULT_DEVICE_ID):
+        """Buffer one raw reading. Returns immediately; the DB write happens later."""
+        if ts is None:
+            ts = datetime.now(timezone.utc)
+        metrics = tuple(
+            (sensor_type, value, value, value, value, 1)
+            for sensor_type, value in zip(_SENSOR_TYPES, (co2, temp, humidity))
+        )
+        self._append((user_id, device_id, ts, metrics))
+
+    def add_window(self, agg):
+        """Buffer a closed WindowAggregate (see window_aggregator)."""
+        self._append(window_item(agg))
+
+    def add_point(self, user_id, device_id, ts, sensor_type, m):
+        """Buffer a single metric of a window (compressed series keep metrics independently)."""
+        self._append((user_id, device_id, ts, ((sensor_type, m.mean, m.vmin, m.vmax, m.last, m.count),)))
+
+    def _append(self, item):
+        with self._lock:
+            if len(self._buffer) >= self.max_pending:
+                del self._buffer[0]
+                self._dropped += 1
+            self._buffer.append(item)
+            full = len(self._buffer) >= self.max_readings
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exc:
+                # Keep the flusher alive; add() would otherwise buffer until drop-oldest
+                print(f"[BatchWriter] Flush loop error: {exc}")
+
+    def flush(self) -> int:
+        """Write everything currently buffered. Returns the number of readings written."""
+        with self._flush_lock:
+            written = 0
+            while True:
+                attempts = 0
+                if self._retry is not None:
+                    batch, attempts = self._retry
+                    self._retry = None
+                else:
+                    with self._lock:
+                        batch = self._buffer[:self.max_readings]
+                        del self._buffer[:self.max_readings]
+                if not batch:
+                    return written
+                ok, done = self._write_isolating(batch, attempts)
+                written += done
+                if not ok:
+                    # Transient failure: the batch is held for the next flush
+                    return written
+
+    def _write_isolating(self, batch, attempts):
+        """
+        Write a batch, bisecting it on permanent errors so only the bad items are
+        dead-lettered. Returns (ok, readings_written); ok is False when a
+        transient error left the unwritten rest in self._retry.
+        """
+        pending = [batch]
+        written = 0
+        while pending:
+            part = pending.pop()
+            exc = self._write(part)
+            if exc is None:
+                written += len(part)
+                if self.on_flush is not None:
+                    try:
+                        self.on_flush(part, time.monotonic())
+                    except Exception as observer_exc:
+                        print(f"[BatchWriter] on_flush observer error: {observer_exc}")
+            elif is_transient_error(exc):
+                attempts += 1
+                if attempts < self.max_retries:
+                    # Keep everything not yet written, in order, for the next flush
+                    rest = [item for chunk in reversed(pending) for item in chunk]
+                    self._retry = (part + rest, attempts)
+                    return False, written
+                self._dead_letter(part, exc)
+            elif len(part) > 1:
+                mid = len(part) // 2
+                pending.append(part[mid:])
+                pending.append(part[:mid])
+            else:
+                self._dead_letter(part, exc)
+        return True, written
+
+    def _dead_letter(self, batch, exc):
+        """Append unwritable items to the dead-letter file (or the log if that fails)."""
+        self._dead_lettered += len(batch)
+        print(f"[BatchWriter] Dead-lettering {len(batch)} reading(s) after: {exc}")
+        try:
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for user_id, device_id, ts, metrics in batch:
+                    f.write(json.dumps({
+                        "user_id":   user_id,
+                        "device_id": device_id,
+                        "ts":        ts.isoformat() if hasattr(ts, "isoformat") else ts,
+                        "metrics":   metrics,
+                        "error":     str(exc),
+                    }, default=str) + "\n")
+        except OSError as write_exc:
+            print(f"[BatchWriter] Dead-letter file {self.dead_letter_path} not writable "
+                  f"({write_exc}), lost: {batch!r}")
+
+    def _write(self, batch):
+        """Write one batch in a transaction. Returns None on success, else the exception."""
+        # Imported here: sensor_wide and rollups build on this module's helpers
+        from sensor_wide import build_wide_insert, dual_write_enabled
+        from rollups import build_rollup_upsert, recompute_rollups, rollups_enabled
+
+        started = time.perf_counter()
+        conn = None
+        try:
+            # Built inside the try so a malformed item is classified and dead-lettered
+            rows = insert_rows(batch)
+            dual_write = dual_write_enabled()
+            rollup_sql, rollup_params = build_rollup_upsert(batch) if rollups_enabled() else (None, None)
+            conn = get_connection(PRIORITY_INGEST)
+            # ON DUPLICATE KEY UPDATE reports 2 per merged row, 1 per inserted row
+            merged = max(0, SENSOR_INSERT.execute_rows(conn, rows) - len(rows))
+            cur = conn.cursor()
+            if dual_write:
+                wide_sql, wide_params, _ = build_wide_insert(batch)
+                if wide_sql:
+                    cur.execute(wide_sql, wide_params)
+            if rollup_sql and not merged:
+                cur.execute(rollup_sql, rollup_params)
+            elif rollup_sql:
+                # Some windows were folded into stored rows (e.g. split across a
+                # restart); adding them again would double their row_count, so
+                # rebuild the touched buckets from sensor_readings instead
+                recompute_rollups(
+                    cur, min(item[2] for item in batch), max(item[2] for item in batch),
+                    user_ids=list({item[0] for item in batch}),
+                )
+            conn.commit()
+            cur.close()
+        except Exception as exc:
+            self._failures += 1
+            print(f"[BatchWriter] Flush of {len(batch)} reading(s) failed: {exc}")
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return exc
+        finally:
+            if conn:
+                conn.close()
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._flushes += 1
+        self._readings_written += len(batch)
+        self._rows_merged += merged
+        self._last_flush_ms = elapsed_ms
+        self._total_flush_ms += elapsed_ms
+        self._max_flush_ms = max(self._max_flush_ms, elapsed_ms)
+        self._max_batch = max(self._max_batch, len(batch))
+        return None
+
+    def close(self):
+        """Stop the flusher thread and write whatever is still buffered."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        self.flush()
+        # Whatever a transient failure still holds would be lost with the process
+        with self._flush_lock:
+            held = self._retry[0] if self._retry is not None else []
+            self._retry = None
+            with self._lock:
+                held, self._buffer = held + self._buffer, []
+            if held:
+                self._dead_letter(held, "writer closed")
+
+    def stats(self) -> dict:
+        flushes = self._flushes
+        retry = self._retry
+        return {
+            "pending":           len(self._buffer) + (len(retry[0]) if retry else 0),
+            "flushes":           flushes,
+            "readings_written":  self._readings_written,
+            "rows_merged":       self._rows_merged,
+            "failures":          self._failures,
+            "dropped":           self._dropped,
+            "dead_lettered":     self._dead_lettered,
+            "last_flush_ms":     round(self._last_flush_ms, 2),
+            "max_flush_ms":      round(self._max_flush_ms, 2),
+            "avg_flush_ms":      round(self._total_flush_ms / flushes, 2) if flushes else 0.0,
+            "avg_batch_size":    round(self._readings_written / flushes, 1) if flushes else 0.0,
+            "max_batch_size":    self._max_batch,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_batch_writer() -> SensorBatchWriter:
+    """Return the process-wide writer, starting its flush thread on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = SensorBatchWriter(
+                    max_readings=int(os.environ.get("SENSOR_BATCH_MAX_READINGS", 200)),
+                    flush_ms=int(os.environ.get("SENSOR_BATCH_FLUSH_MS", 500)),
+                    max_pending=int(os.environ.get("SENSOR_BATCH_MAX_PENDING", 20000)),
+                    max_retries=int(os.environ.get("SENSOR_BATCH_MAX_RETRIES", 5)),
+                    dead_letter_path=os.environ.get("SENSOR_DEAD_LETTER_PATH", "sensor_dead_letter.ndjson"),
+                )
+                writer.start()
+                _writer = writer
+    return _writer
+
+
+def get_batch_writer_stats() -> dict:
+    return _writer.stats() if _writer is not None else {}
@@ -0,0 +1,92 @@
+"""
+Circuit breaker for calls to flaky upstreams (Gemini, the remote risk model).
+
+  closed     calls go through; `failure_threshold` consecutive failures open it
+  open       calls are refused (callers use their fallback) for `reset_timeout`
+             seconds
+  half-open  up to `half_open_max` probe calls go through; a success closes
+             the breaker, a failure opens it again
+
+Usage:
+
+    if not breaker.allow():
+        return fallback
+    try:
+        result = call()
+    except Exception:
+        breaker.record_failure()
+        return fallback
+    breaker.record_success()
+"""
+
+import threading
+import time
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max=1):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_timeout = reset_timeout
+        self.half_open_max = max(1, int(half_open_max))
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._opens = 0
+        self._rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self):
+        if self._state == STATE_OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = STATE_HALF_OPEN
+            self._probes = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == STATE_CLOSED:
+                return True
+            if self._state == STATE_HALF_OPEN and self._probes < self.half_open_max:
+                self._probes += 1
+                return True
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                print(f"[Breaker] {self.name} closed")
+            self._state = STATE_CLOSED
+            self._failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == STATE_HALF_OPEN or (
+                    self._state == STATE_CLOSED and self._failures >= self.failure_threshold):
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+                self._opens += 1
+                print(f"[Breaker] {self.name} open for {self.reset_timeout:.0f}s "
+                      f"after {self._failures} failure(s)")
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._maybe_half_open()
+            return {
+                "state":                self._state,
+                "consecutive_failures": self._failures,
+                "opens":                self._opens,
+                "rejected":             self._rejected,
+            }
@@ -6,20 +6,27 @@ Uses mysql-connector pooling for efficient reuse across requests.
 """
 
 import os
+import threading
+import time
 from dotenv import load_dotenv
-import mysql.connector
-from mysql.connector import pooling
+from db_pool import InstrumentedPool, PoolBusyError, PRIORITY_INGEST, PRIORITY_DEFAULT
 
 load_dotenv()
 
 
-def get_pool():
-	"""Create or return a shared MySQL connection pool."""
+def _mysql_pool(name, size, host, port):
+	# Imported here so importing this module needs neither the driver nor a server
+	from mysql.connector import pooling
 	return pooling.MySQLConnectionPool(
-		pool_name="ecogrow_flask_pool",
-		pool_size=int(os.environ.get("DB_POOL_SIZE", 15)),
-		host=os.environ.get("DB_HOST", "127.0.0.1"),
-		port=int(os.environ.get("DB_PORT", 3306)),
+		pool_name=name,
+		pool_size=size,
+		# Session state is set once when a physical connection is opened (and on
+		# reconnect) rather than with a SET round trip on every checkout. Resetting
+		# the session on return would undo it, so that is off too.
+		pool_reset_session=False,
+		time_zone="+00:00",
+		host=host,
+		port=port,
 		user=os.environ.get("DB_USER"),
 		password=os.environ.get("DB_PASSWORD"),
 		database=os.environ.get("DB_NAME"),
@@ -29,18 +36,116 @@ def get_pool():
 	)
 
 
-pool = get_pool()
+def get_pool():
+	"""Create or return a shared MySQL connection pool."""
+	size = int(os.environ.get("DB_POOL_SIZE", 15))
+	return InstrumentedPool(
+		_mysql_pool(
+			"ecogrow_flask_pool", size,
+			os.environ.get("DB_HOST", "127.0.0.1"), int(os.environ.get("DB_PORT", 3306)),
+		),
+		size,
+		# Connections only ingest writes may use, so reads can never starve them
+		reserved=int(os.environ.get("DB_POOL_INGEST_RESERVED", 2)),
+		wait_s={
+			PRIORITY_INGEST: int(os.environ.get("DB_POOL_INGEST_WAIT_MS", 10000)) / 1000.0,
+			PRIORITY_DEFAULT: int(os.environ.get("DB_POOL_WAIT_MS", 2000)) / 1000.0,
+		},
+	)
+
+
+def get_read_pool():
+	"""
+	Pool for read-only analytics / report / admin endpoints. Points at a replica
+	when DB_READ_HOST is set, otherwise it is a second, separately sized pool on
+	the primary. Statements are capped by MariaDB's max_statement_time.
+	"""
+	size = int(os.environ.get("DB_READ_POOL_SIZE", 5))
+	max_statement_s = int(os.environ.get("DB_READ_MAX_STATEMENT_MS", 5000)) / 1000.0
+	return InstrumentedPool(
+		_mysql_pool(
+			"ecogrow_flask_read_pool", size,
+			os.environ.get("DB_READ_HOST") or os.environ.get("DB_HOST", "127.0.0.1"),
+			int(os.environ.get("DB_READ_PORT") or os.environ.get("DB_PORT", 3306)),
+		),
+		size,
+		wait_s={PRIORITY_DEFAULT: int(os.environ.get("DB_READ_POOL_WAIT_MS", 2000)) / 1000.0},
+		session_init=[f"SET SESSION max_statement_time = {max_statement_s:.3f}"] if max_statement_s > 0 else None,
+	)
+
+
+# Both pools are created on first checkout, not at import
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _shared(name, factory):
+	target = _pools.get(name)
+	if target is None:
+		with _pools_lock:
+			target = _pools.get(name)
+			if target is None:
+				target = _pools[name] = factory()
+	return target
+
+# How long after a write the same browser session keeps reading from the primary
+READ_YOUR_WRITES_SEC = float(os.environ.get("DB_READ_YOUR_WRITES_SEC", 5))
+
+
+def _checkout(target, priority, timeout):
+	try:
+		return target.get_connection(priority, timeout)
+	except PoolBusyError as exc:
+		if has_request_context():
+			# Lets the app answer 429 even if the route swallowed the exception
+			g.db_pool_busy = exc
+		raise
+
+
+def get_connection(priority=PRIORITY_DEFAULT, timeout=None):
+	"""
+	Get a pooled connection for request-scoped use (session time zone is UTC).
+	Waits FIFO up to the priority's budget (or `timeout` seconds) when the pool
+	is busy, then raises PoolBusyError. Ingest writes pass PRIORITY_INGEST.
+	"""
+	return _checkout(_shared("primary", get_pool), priority, timeout)
+
+
+def mark_written():
+	"""Record a write by this browser session so its next reads see it (see get_read_connection)."""
+	if has_request_context():
+		session["db_wrote_at"] = time.time()
+
+
+def get_read_connection(fresh=False):
+	"""
+	Connection for read-only queries, from the read pool. Falls back to the
+	primary (read-your-writes) when `fresh` is set, the request asks for it with
+	?fresh=1 or an X-Read-Your-Writes header, or this browser session wrote
+	within the last DB_READ_YOUR_WRITES_SEC seconds.
+	"""
+	if not fresh and has_request_context():
+		fresh = (
+			request.args.get("fresh") == "1"
+			or request.headers.get("X-Read-Your-Writes") == "1"
+			or time.time() - session.get("db_wrote_at", 0) < READ_YOUR_WRITES_SEC
+		)
+	if fresh:
+		return _checkout(_shared("primary", get_pool), PRIORITY_DEFAULT, None)
+	return _checkout(_shared("read", get_read_pool), PRIORITY_DEFAULT, None)
+
+
+def get_pool_stats():
+	"""Checkout wait, occupancy, exhaustion and per-statement latency of the pool ({} before first use)."""
+	target = _pools.get("primary")
+	return target.snapshot() if target is not None else {}
 
 
-def get_connection():
-	"""Get a pooled connection for request-scoped use and force UTC session time zone."""
-	conn = pool.get_connection()
-	cur = conn.cursor()
-	cur.execute("SET time_zone = '+00:00'")
-	cur.close()
-	return conn
+def get_read_pool_stats():
+	target = _pools.get("read")
+	return target.snapshot() if target is not None else {}
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, g, has_request_context, session
 
 crop_api_bp = Blueprint('crop_api_bp', __name__)
 
@@ -67,9 +172,12 @@ def save_crop_threshold(crop_name, temp_min, temp_max, humidity_min, humidity_ma
 		conn.commit()
 		threshold_id = cur.lastrowid
 		cur.close()
-		return threshold_id
 	finally:
 		conn.close()
+	# Imported here: threshold_cache reads through this module's pool
+	from threshold_cache import invalidate_thresholds
+	invalidate_thresholds()
+	return threshold_id
 
 def get_user_crops(user_id):
 	conn = get_connection()
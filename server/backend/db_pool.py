@@ -0,0 +1,411 @@
+"""
+Instrumentation around the mysql-connector pool used by db_connect.
+
+`InstrumentedPool.get_connection` hands out `PooledConnection` proxies that
+record, in process:
+
+  checkout    – wait time histogram, checkouts, exhaustion events (no free
+                connection on arrival), shed checkouts per priority
+  occupancy   – connections currently in use and the high-water mark
+  queries     – latency histogram per statement fingerprint (whitespace
+                collapsed, literals untouched since statements are
+                parameterised), capped at MAX_FINGERPRINTS entries
+
+Prepared cursors (see query_registry) are cached per physical connection,
+keyed by server connection id, and reused across checkouts.
+
+Session settings are applied once per physical connection (the pool passes
+time_zone to connect and does not reset sessions on return), so the proxy
+rolls back a transaction left open by a read-only caller before the
+connection goes back to the pool.
+
+mysql-connector's pool raises as soon as it is empty.  Checkouts therefore go
+through a `FairGate` first: callers queue FIFO within their priority, ingest
+waiters are served before everyone else, and `reserved` connections are only
+ever handed to ingest so slow reads cannot occupy the whole pool.  A caller
+whose wait budget runs out gets `PoolBusyError`, which the app turns into
+429 + Retry-After.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import deque
+
+# Upper bounds in milliseconds; the last bucket is open-ended
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+MAX_FINGERPRINTS = 200
+_WS_RE = re.compile(r"\s+")
+
+PRIORITY_INGEST = "ingest"
+PRIORITY_DEFAULT = "default"
+
+
+class PoolBusyError(Exception):
+    """
+    No connection became free within the caller's wait budget. Not derived from
+    mysql.connector's PoolError so this module imports without the driver;
+    callers catching Exception still see it.
+    """
+
+    def __init__(self, priority, retry_after):
+        super().__init__(f"database pool busy ({priority}), retry after {retry_after}s")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class FairGate:
+    """
+    Counting gate in front of the pool: FIFO per priority, ingest first, and
+    `reserved` permits that only ingest may take.
+    """
+
+    def __init__(self, size, reserved=0):
+        self.size = size
+        self.reserved = max(0, min(int(reserved), size - 1))
+        self._lock = threading.Lock()
+        self._free = size
+        self._default_in_use = 0
+        self._queues = {PRIORITY_INGEST: deque(), PRIORITY_DEFAULT: deque()}
+
+    def _can_take(self, priority):
+        if self._free <= 0:
+            return False
+        if priority == PRIORITY_INGEST:
+            return True
+        return self._default_in_use < self.size - self.reserved
+
+    def _take(self, priority):
+        self._free -= 1
+        if priority != PRIORITY_INGEST:
+            self._default_in_use += 1
+
+    def acquire(self, priority, timeout):
+        """Returns (acquired, waited)."""
+        with self._lock:
+            if not self._queues[PRIORITY_INGEST] and (
+                    priority == PRIORITY_INGEST or not self._queues[PRIORITY_DEFAULT]) \
+                    and self._can_take(priority):
+                self._take(priority)
+                return True, False
+            waiter = [threading.Event(), False]
+            self._queues[priority].append(waiter)
+        waiter[0].wait(timeout)
+        with self._lock:
+            if waiter[1]:
+                return True, True
+            self._queues[priority].remove(waiter)
+            return False, True
+
+    def release(self, priority):
+        with self._lock:
+            self._free += 1
+            if priority != PRIORITY_INGEST:
+                self._default_in_use -= 1
+            self._dispatch()
+
+    def _dispatch(self):
+        for priority in (PRIORITY_INGEST, PRIORITY_DEFAULT):
+            queue = self._queues[priority]
+            while queue and self._can_take(priority):
+                waiter = queue.popleft()
+                self._take(priority)
+                waiter[1] = True
+                waiter[0].set()
+
+    def waiting(self) -> dict:
+        with self._lock:
+            return {p: len(q) for p, q in self._queues.items()}
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (not thread-safe; callers hold a lock)."""
+
+    __slots__ = ("counts", "count", "total_ms", "max_ms")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms):
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (max_ms for the open bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else round(self.max_ms, 2)
+        return round(self.max_ms, 2)
+
+    def as_dict(self) -> dict:
+        labels = [f"le_{b}" for b in LATENCY_BUCKETS_MS] + ["inf"]
+        return {
+            "count":   self.count,
+            "avg_ms":  round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "max_ms":  round(self.max_ms, 2),
+            "p50_ms":  self.quantile(0.50),
+            "p95_ms":  self.quantile(0.95),
+            "p99_ms":  self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+def fingerprint(statement) -> str:
+    if isinstance(statement, (bytes, bytearray)):
+        statement = statement.decode("utf-8", "replace")
+    return _WS_RE.sub(" ", statement).strip()[:120]
+
+
+class _TimedCursor:
+    """Cursor proxy that times execute / executemany."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._stats.record_query(operation, (time.perf_counter() - started) * 1000)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._stats.record_query(operation, (time.perf_counter() - started) * 1000)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class PooledConnection:
+    """Connection proxy: timed cursors, in-use accounting and clean return on close()."""
+
+    def __init__(self, conn, pool, priority=PRIORITY_DEFAULT):
+        self._conn = conn
+        self._pool = pool
+        self._priority = priority
+        self._closed = False
+        self._checked_out = time.monotonic()
+
+    def cursor(self, *args, **kwargs):
+        return _TimedCursor(self._conn.cursor(*args, **kwargs), self._pool.stats)
+
+    def prepared_cursor(self, key):
+        """Server-side prepared cursor cached on this physical connection under `key`."""
+        return self._pool.prepared_cursor(self._conn, key)
+
+    def forget_prepared(self):
+        self._pool.forget_prepared(self._conn)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._conn.in_transaction:
+                self._conn.rollback()
+        except Exception:
+            pass
+        finally:
+            self._pool.release(self._conn, self._priority, time.monotonic() - self._checked_out)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class PoolStats:
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.exhausted = 0
+        self.in_use = 0
+        self.max_in_use = 0
+        self.wait = LatencyHistogram()
+        self.shed = {PRIORITY_INGEST: 0, PRIORITY_DEFAULT: 0}
+        self.hold_total_s = 0.0
+        self.releases = 0
+        self.queries = {}
+        self.query_overflow = 0
+
+    def record_checkout(self, wait_ms):
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.wait.observe(wait_ms)
+
+    def record_release(self, held_s):
+        with self._lock:
+            self.in_use -= 1
+            self.releases += 1
+            self.hold_total_s += held_s
+
+    def record_exhausted(self):
+        with self._lock:
+            self.exhausted += 1
+
+    def record_shed(self, priority):
+        with self._lock:
+            self.shed[priority] += 1
+
+    def avg_hold_s(self) -> float:
+        return self.hold_total_s / self.releases if self.releases else 0.0
+
+    def record_query(self, statement, ms):
+        key = fingerprint(statement)
+        with self._lock:
+            hist = self.queries.get(key)
+            if hist is None:
+                if len(self.queries) >= MAX_FINGERPRINTS:
+                    self.query_overflow += 1
+                    return
+                hist = self.queries[key] = LatencyHistogram()
+            hist.observe(ms)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            queries = sorted(self.queries.items(), key=lambda kv: kv[1].total_ms, reverse=True)
+            return {
+                "size":            self.size,
+                "in_use":          self.in_use,
+                "max_in_use":      self.max_in_use,
+                "checkouts":       self.checkouts,
+                "exhausted":       self.exhausted,
+                "shed":            dict(self.shed),
+                "avg_hold_ms":     round(self.avg_hold_s() * 1000, 2),
+                "checkout_wait":   self.wait.as_dict(),
+                # Heaviest statements (by total time) first
+                "queries":         [dict(statement=k, **h.as_dict()) for k, h in queries],
+                "queries_untracked": self.query_overflow,
+            }
+
+
+class InstrumentedPool:
+    """Wraps a mysql.connector pooling.MySQLConnectionPool behind a FairGate."""
+
+    def __init__(self, pool, size, reserved=0, wait_s=None, session_init=None):
+        self._pool = pool
+        # Statements run once per physical session (keyed by server connection id)
+        self._session_init = list(session_init or ())
+        self._initialized = set()
+        self._initialized_lock = threading.Lock()
+        # connection id -> {key: prepared cursor}
+        self._prepared = {}
+        self._prepared_lock = threading.Lock()
+        self.gate = FairGate(size, reserved)
+        self.stats = PoolStats(size)
+        # Default wait budget per priority, seconds
+        self.wait_s = {PRIORITY_INGEST: 10.0, PRIORITY_DEFAULT: 2.0}
+        self.wait_s.update(wait_s or {})
+
+    def get_connection(self, priority=PRIORITY_DEFAULT, timeout=None):
+        if timeout is None:
+            timeout = self.wait_s[priority]
+        started = time.perf_counter()
+        acquired, waited = self.gate.acquire(priority, timeout)
+        if waited:
+            # No free connection on arrival
+            self.stats.record_exhausted()
+        if not acquired:
+            self.stats.record_shed(priority)
+            raise PoolBusyError(priority, self.retry_after())
+        try:
+            conn = self._pool.get_connection()
+        except Exception:
+            self.gate.release(priority)
+            raise
+        self.stats.record_checkout((time.perf_counter() - started) * 1000)
+        pooled = PooledConnection(conn, self, priority)
+        if self._session_init and not self._session_initialized(conn.connection_id):
+            try:
+                cur = pooled.cursor()
+                for stmt in self._session_init:
+                    cur.execute(stmt)
+                cur.close()
+            except Exception:
+                pooled.close()
+                raise
+            with self._initialized_lock:
+                if len(self._initialized) >= 2 * self.gate.size:
+                    # Ids of sessions that reconnected or were replaced; live ones
+                    # just run the (idempotent) init statements once more
+                    self._initialized.clear()
+                self._initialized.add(conn.connection_id)
+        return pooled
+
+    def _session_initialized(self, connection_id) -> bool:
+        with self._initialized_lock:
+            return connection_id in self._initialized
+
+    def prepared_cursor(self, conn, key):
+        # A physical connection is only ever used by the thread holding it, so
+        # only the outer map needs the lock
+        connection_id = conn.connection_id
+        with self._prepared_lock:
+            cursors = self._prepared.get(connection_id)
+            if cursors is None:
+                if len(self._prepared) >= 2 * self.gate.size:
+                    # Ids of connections that reconnected or were replaced
+                    self._prepared.clear()
+                cursors = self._prepared[connection_id] = {}
+        cur = cursors.get(key)
+        if cur is None:
+            cur = cursors[key] = conn.cursor(prepared=True)
+        return cur
+
+    def forget_prepared(self, conn):
+        try:
+            connection_id = conn.connection_id
+        except Exception:
+            return
+        with self._prepared_lock:
+            cursors = self._prepared.pop(connection_id, {})
+        for cur in cursors.values():
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+    def release(self, conn, priority=PRIORITY_DEFAULT, held_s=0.0):
+        try:
+            conn.close()
+        finally:
+            self.gate.release(priority)
+            self.stats.record_release(held_s)
+
+    def snapshot(self) -> dict:
+        return dict(self.stats.as_dict(), waiting=self.gate.waiting(), reserved_for_ingest=self.gate.reserved)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue should have drained, at least 1."""
+        waiting = sum(self.gate.waiting().values())
+        return max(1, math.ceil(self.stats.avg_hold_s() * (waiting + 1) / self.gate.size))
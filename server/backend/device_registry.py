@@ -0,0 +1,156 @@
+"""
+Device registration for topic-routed MQTT ingest.
+
+A device publishes to ecogrow/<tenant>/<device_key>/sensors; the devices
+table maps that (tenant, device_key) pair to the owning user.  The tenant is
+always the owner's user id, taken from the session.  Registering or
+removing a device reloads the MQTT routing table in-process.  Each device also
+declares its payload format (json / binary / auto, see payload_codec).
+"""
+
+import re
+from flask import Blueprint, jsonify, request, session
+from db_connect import get_connection
+from payload_codec import PAYLOAD_FORMATS, FORMAT_AUTO
+
+device_bp = Blueprint("device_bp", __name__)
+
+# Topic levels must not contain MQTT wildcards or separators
+_TOPIC_LEVEL_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def load_device_routes():
+    """Return [(tenant, device_key, user_id, payload_format)] for every registered device."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT tenant, device_key, user_id, payload_format FROM devices")
+        rows = cur.fetchall()
+        cur.close()
+        return rows
+    finally:
+        conn.close()
+
+
+def _reload_routes():
+    # Imported here: mqtt_service pulls in paho and starts nothing until asked
+    from mqtt_service import reload_topic_routes
+    reload_topic_routes()
+
+
+@device_bp.get("/api/devices")
+def list_devices():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "Unauthorized."}), 401
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT id, tenant, device_key, name, created_at, payload_format FROM devices WHERE user_id=%s ORDER BY created_at",
+            (user_id,)
+        )
+        rows = cur.fetchall()
+        cur.close()
+        return jsonify([
+            {
+                "id":         r[0],
+                "tenant":     r[1],
+                "device_key": r[2],
+                "name":       r[3],
+                "topic":      f"ecogrow/{r[1]}/{r[2]}/sensors",
+                "created_at": r[4].isoformat() if r[4] else None,
+                "payload_format": r[5],
+            }
+            for r in rows
+        ]), 200
+    finally:
+        conn.close()
+
+
+@device_bp.post("/api/devices")
+def register_device():
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "Unauthorized."}), 401
+
+    data = request.get_json(silent=True) or {}
+    device_key = (data.get("device_key") or "").strip()
+    # The tenant is always the session user; a device can never be put on
+    # another user's topic namespace
+    tenant = str(user_id)
+    requested_tenant = data.get("tenant")
+    if requested_tenant is not None and str(requested_tenant).strip() != tenant:
+        return jsonify({"message": "tenant must be your own user id."}), 403
+    name = (data.get("name") or "").strip()[:100] or None
+    payload_format = (data.get("payload_format") or FORMAT_AUTO).strip().lower()
+
+    if not _TOPIC_LEVEL_RE.match(device_key) or not _TOPIC_LEVEL_RE.match(tenant):
+        return jsonify({"message": "tenant and device_key may only contain letters, digits, '_' and '-'."}), 400
+    if payload_format not in PAYLOAD_FORMATS:
+        return jsonify({"message": f"payload_format must be one of {', '.join(PAYLOAD_FORMATS)}."}), 400
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT user_id FROM devices WHERE tenant=%s AND device_key=%s LIMIT 1",
+            (tenant, device_key)
+        )
+        existing = cur.fetchone()
+        if existing:
+            cur.close()
+            return jsonify({"message": "Device already registered."}), 409
+        # Rows written before tenants were tied to the owner may squat on it
+        cur.execute(
+            "SELECT 1 FROM devices WHERE tenant=%s AND user_id<>%s LIMIT 1",
+            (tenant, user_id)
+        )
+        if cur.fetchone():
+            cur.close()
+            return jsonify({"message": "Tenant is owned by another account."}), 409
+        cur.execute(
+            "INSERT INTO devices (user_id, tenant, device_key, name, payload_format) VALUES (%s, %s, %s, %s, %s)",
+            (user_id, tenant, device_key, name, payload_format)
+        )
+        conn.commit()
+        device_id = cur.lastrowid
+        cur.close()
+    except Exception:
+        conn.rollback()
+        return jsonify({"message": "Unable to register device."}), 500
+    finally:
+        conn.close()
+
+    _reload_routes()
+    return jsonify({
+        "message": "Device registered.",
+        "id": device_id,
+        "topic": f"ecogrow/{tenant}/{device_key}/sensors",
+    }), 201
+
+
+@device_bp.delete("/api/devices/<int:device_row_id>")
+def delete_device(device_row_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return jsonify({"message": "Unauthorized."}), 401
+
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM devices WHERE id=%s AND user_id=%s", (device_row_id, user_id))
+        conn.commit()
+        deleted = cur.rowcount
+        cur.close()
+    except Exception:
+        conn.rollback()
+        return jsonify({"message": "Unable to delete device."}), 500
+    finally:
+        conn.close()
+
+    if not deleted:
+        return jsonify({"message": "Device not found."}), 404
+    _reload_routes()
+    return jsonify({"message": "Device deleted."}), 200
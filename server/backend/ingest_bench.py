@@ -0,0 +1,463 @@
+"""
+MQTT ingest record / replay harness.
+
+Measures how many messages per second mqtt_service can absorb, offline.
+
+Commands:
+    # Record live traffic from the configured broker (MQTT_BROKER_* env vars)
+    python ingest_bench.py record traffic.ndjson --seconds 600
+
+    # Generate a synthetic fleet: 500 devices publishing every 10s for 10 minutes
+    # (JSON on the legacy topic; --binary uses per-device topics, see synth_messages)
+    python ingest_bench.py synth traffic.ndjson --devices 500 --seconds 600 [--binary]
+
+    # Replay at 100x into the in-process broker stand-in (paho-style on_message thread)
+    python ingest_bench.py replay traffic.ndjson --speed 100 --target loopback --null-db
+
+    # Replay straight into process_message (no queue), or publish to a real/local broker
+    # (run with MQTT_BROKER_HOST/MQTT_BROKER_PORT/MQTT_TLS=0 pointing the consumer at it too)
+    python ingest_bench.py replay traffic.ndjson --target handler
+    python ingest_bench.py replay traffic.ndjson --target broker --host localhost --port 1883
+
+Recording format: one JSON object per line
+    {"t": <seconds since first message>, "topic": "...", "payload": "<base64>"}
+
+The report covers throughput and three latency percentiles per message:
+
+  emit_latency_ms       publish → its Socket.IO sensor_update emit
+  processed_latency_ms  publish → handler finished (window fold, emit, alerts)
+  commit_latency_ms     publish → batch-writer commit of the window holding it;
+                        includes the window length (SENSOR_WINDOW_SEC), and
+                        windows still open at the end are closed by the final
+                        flush
+
+plus DB flush latency/batch size from the batch writer, the number of
+Socket.IO emits, and queue drop counts.
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+from collections import defaultdict, deque
+
+# Tenant prefix of synthetic device topics; replay routes these without a devices table
+BENCH_TENANT_PREFIX = "bench"
+
+
+# ── Recording file helpers ────────────────────────────────────────────────
+def write_recording(path, messages):
+    """messages: iterable of (offset_sec, topic, payload_bytes)."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for t, topic, payload in messages:
+            f.write(json.dumps({"t": round(t, 6), "topic": topic,
+                                "payload": base64.b64encode(payload).decode("ascii")}) + "\n")
+            count += 1
+    return count
+
+
+def read_recording(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                rec = json.loads(line)
+                yield rec["t"], rec["topic"], base64.b64decode(rec["payload"])
+
+
+# ── Synthetic fleet generator ─────────────────────────────────────────────
+def synth_messages(devices, seconds, interval=10.0, binary=False, topic="ecogrow/sensors", users=None):
+    """
+    Yield (offset, topic, payload) for `devices` devices publishing every `interval`
+    seconds. Devices are spread over `users` tenants (default: one per device).
+    JSON devices publish on the legacy topic with user_id/device_id in the
+    payload. Binary payloads carry only a hardware id, so binary devices publish
+    on their own ecogrow/bench<user>/dev<d>/sensors topic, which replay routes
+    with a stub loader (see _install_bench_routes). No devices table is needed
+    either way.
+    """
+    from payload_codec import encode_binary
+
+    users = users or devices
+    rng = random.Random(42)
+    phase = [rng.uniform(0, interval) for _ in range(devices)]
+    base = [(rng.uniform(380, 900), rng.uniform(16, 30), rng.uniform(45, 85)) for _ in range(devices)]
+    events = []
+    for d in range(devices):
+        t = phase[d]
+        seq = 0
+        while t < seconds:
+            co2, temp, hum = base[d]
+            co2 += rng.gauss(0, 15)
+            temp += rng.gauss(0, 0.2)
+            hum += rng.gauss(0, 0.8)
+            if binary:
+                msg_topic = f"ecogrow/{BENCH_TENANT_PREFIX}{1 + d % users}/dev{d}/sensors"
+                payload = encode_binary(co2, temp, hum, hw_id=d, seq=seq, device_ts=int(t))
+            else:
+                msg_topic = topic
+                payload = json.dumps({
+                    "co2": round(co2), "temp": round(temp, 1), "humidity": round(hum, 1),
+                    "ts": int(t), "seq": seq, "user_id": 1 + d % users, "device_id": f"dev{d}",
+                }).encode("utf-8")
+            events.append((t, msg_topic, payload))
+            seq += 1
+            t += interval
+    events.sort(key=lambda e: e[0])
+    return events
+
+
+# ── Recorder ──────────────────────────────────────────────────────────────
+def record(path, seconds, topics):
+    import paho.mqtt.client as mqtt
+    from mqtt_service import broker_config_from_env
+
+    cfg = broker_config_from_env()
+    captured = []
+    start = [None]
+    lock = threading.Lock()
+
+    def on_connect(client, userdata, flags, rc):
+        client.subscribe([(t, 0) for t in topics])
+        print(f"[Bench] Recording {', '.join(topics)} from {cfg['host']}:{cfg['port']}")
+
+    def on_message(client, userdata, msg):
+        now = time.monotonic()
+        with lock:
+            if start[0] is None:
+                start[0] = now
+            captured.append((now - start[0], msg.topic, bytes(msg.payload)))
+
+    client = mqtt.Client(client_id=f"ecogrow_bench_rec_{int(time.time())}")
+    if cfg["tls"]:
+        client.tls_set(cert_reqs=mqtt.ssl.CERT_NONE, tls_version=mqtt.ssl.PROTOCOL_TLSv1_2)
+        client.tls_insecure_set(True)
+    if cfg["username"]:
+        client.username_pw_set(cfg["username"], cfg["password"])
+    client.on_connect = on_connect
+    client.on_message = on_message
+    client.connect(cfg["host"], cfg["port"], 60)
+    client.loop_start()
+    try:
+        time.sleep(seconds)
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    with lock:
+        n = write_recording(path, captured)
+    print(f"[Bench] Recorded {n} message(s) to {path}")
+
+
+# ── Replay targets ────────────────────────────────────────────────────────
+class _LoopbackMessage:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class LoopbackBroker:
+    """
+    In-process broker stand-in: delivers messages to mqtt_service.on_message from a
+    single "network" thread, the way paho does, without any sockets.
+    """
+
+    def __init__(self, on_message):
+        self.on_message = on_message
+        self._inbox = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name="loopback-broker", daemon=True)
+        self._thread.start()
+
+    def publish(self, topic, payload):
+        with self._cond:
+            self._inbox.append(_LoopbackMessage(topic, payload))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._inbox and not self._closed:
+                    self._cond.wait()
+                if not self._inbox:
+                    return
+                msg = self._inbox.popleft()
+            self.on_message(self, None, msg)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+
+# What the handler did for the message it is processing, per worker thread
+_probe = threading.local()
+
+
+class _SocketIORecorder:
+    """Counts Socket.IO emits in place of the real server."""
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+
+    def emit(self, event, data=None, **kwargs):
+        if event == "sensor_update":
+            _probe.emitted_at = time.monotonic()
+        self.counts[event] += 1
+
+
+def _probe_snapshot_updates(store):
+    """Note which (user_id, device_id) each handled message belongs to."""
+    update = store.update
+
+    def probed(user_id, device_id, *args, **kwargs):
+        _probe.device = (user_id, device_id)
+        return update(user_id, device_id, *args, **kwargs)
+
+    store.update = probed
+
+
+class _LatencyTracker:
+    """Matches processed payloads, emits and DB commits back to their publish time."""
+
+    def __init__(self):
+        self._sent = defaultdict(deque)
+        self._awaiting_commit = defaultdict(deque)
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.emit_latencies = []
+        self.commit_latencies = []
+
+    def sent(self, payload, t):
+        with self._lock:
+            self._sent[payload].append(t)
+
+    def done(self, topic, payload, received_at, finished_at):
+        emitted_at = getattr(_probe, "emitted_at", None)
+        device = getattr(_probe, "device", None)
+        _probe.emitted_at = _probe.device = None
+        with self._lock:
+            q = self._sent.get(payload)
+            if not q:
+                return
+            published = q.popleft()
+            self.latencies.append(finished_at - published)
+            if emitted_at is not None:
+                self.emit_latencies.append(emitted_at - published)
+            if device is not None:
+                self._awaiting_commit[device].append(published)
+
+    def flushed(self, batch, committed_at):
+        """Batch writer observer: each window item commits its sample_count oldest readings."""
+        with self._lock:
+            for user_id, device_id, _, metrics in batch:
+                count = next((m[5] for m in metrics if m[0] == "co2"), 0)
+                q = self._awaiting_commit.get((user_id, device_id))
+                while q and count > 0:
+                    self.commit_latencies.append(committed_at - q.popleft())
+                    count -= 1
+
+    def outstanding(self):
+        with self._lock:
+            return sum(len(q) for q in self._sent.values())
+
+    def uncommitted(self):
+        with self._lock:
+            return sum(len(q) for q in self._awaiting_commit.values())
+
+
+def _percentiles(values, pcts=(50, 90, 99, 99.9)):
+    if not values:
+        return {}
+    ordered = sorted(values)
+    out = {}
+    for p in pcts:
+        idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        out[f"p{p:g}"] = round(ordered[idx] * 1000, 3)
+    out["max"] = round(ordered[-1] * 1000, 3)
+    return out
+
+
+def _use_null_db():
+    """Swap the batch writer for one that counts batches but never touches a database."""
+    import batch_writer
+
+    class NullSinkWriter(batch_writer.SensorBatchWriter):
+        def _write(self, batch):
+            self._flushes += 1
+            self._readings_written += len(batch)
+            self._max_batch = max(self._max_batch, len(batch))
+            return None
+
+    writer = NullSinkWriter()
+    writer.start()
+    batch_writer._writer = writer
+
+
+def _install_bench_routes(mqtt_service, messages):
+    """
+    Route the synthetic ecogrow/bench<user>/dev<d>/sensors topics of a recording
+    to (user, dev<d>, binary), on top of whatever the devices table provides.
+    """
+    from payload_codec import FORMAT_BINARY
+
+    bench = {}
+    for _, topic, _ in messages:
+        parts = topic.split("/")
+        if len(parts) == 4 and parts[1].startswith(BENCH_TENANT_PREFIX):
+            user = parts[1][len(BENCH_TENANT_PREFIX):]
+            if user.isdigit():
+                bench[(parts[1], parts[2])] = int(user)
+    if not bench:
+        return
+    router = mqtt_service.topic_router
+    registered = router.loader
+
+    def loader():
+        rows = [(tenant, device, user_id, FORMAT_BINARY) for (tenant, device), user_id in bench.items()]
+        try:
+            rows.extend(registered())
+        except Exception as exc:
+            print(f"[Bench] Devices table not loaded, routing synthetic topics only: {exc}")
+        return rows
+
+    router.loader = loader
+    router.reload()
+
+
+def replay(path, speed, target, host=None, port=None, null_db=False, drain_timeout=30.0):
+    import mqtt_service
+    from batch_writer import get_batch_writer
+    from window_aggregator import get_window_aggregator
+
+    if null_db:
+        _use_null_db()
+    messages = list(read_recording(path))
+    if not messages:
+        print("[Bench] Recording is empty")
+        return
+
+    _install_bench_routes(mqtt_service, messages)
+    sio = _SocketIORecorder()
+    mqtt_service.set_socketio(sio)
+    tracker = _LatencyTracker()
+    _probe_snapshot_updates(mqtt_service.snapshot_store)
+    writer = get_batch_writer()
+    writer.on_flush = tracker.flushed
+
+    if target == "handler":
+        def deliver(topic, payload):
+            mqtt_service.process_message(topic, payload)
+            tracker.done(topic, payload, None, time.monotonic())
+        close = lambda: None
+    elif target == "loopback":
+        pipeline = mqtt_service.start_ingest_pipeline()
+        pipeline.on_processed = tracker.done
+        broker = LoopbackBroker(mqtt_service.on_message)
+        deliver = broker.publish
+        close = broker.close
+    elif target == "broker":
+        import paho.mqtt.client as mqtt
+        pipeline = mqtt_service.start_ingest_pipeline()
+        pipeline.on_processed = tracker.done
+        mqtt_service.start_mqtt_client()
+        pub = mqtt.Client(client_id=f"ecogrow_bench_pub_{int(time.time())}")
+        pub.connect(host or "localhost", port or 1883, 60)
+        pub.loop_start()
+        time.sleep(1.0)  # let the consumer subscribe
+        deliver = lambda topic, payload: pub.publish(topic, payload)
+        close = pub.loop_stop
+    else:
+        raise ValueError(f"Unknown target: {target}")
+
+    print(f"[Bench] Replaying {len(messages)} message(s) at {speed:g}x into {target}")
+    started = time.monotonic()
+    for offset, topic, payload in messages:
+        due = started + offset / speed
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        tracker.sent(payload, time.monotonic())
+        deliver(topic, payload)
+    publish_done = time.monotonic()
+
+    # Wait until every message is either processed or counted as dropped
+    deadline = publish_done + drain_timeout
+    while tracker.outstanding() and time.monotonic() < deadline:
+        stats = mqtt_service.get_ingest_stats()
+        if stats["depth"] == 0 and len(tracker.latencies) + stats["dropped"] >= len(messages):
+            break
+        time.sleep(0.05)
+    processed_done = time.monotonic()
+    close()
+
+    get_window_aggregator().flush_all()
+    writer.flush()
+
+    elapsed = processed_done - started
+    report = {
+        "messages":             len(messages),
+        "speed":                speed,
+        "target":               target,
+        "publish_sec":          round(publish_done - started, 3),
+        "elapsed_sec":          round(elapsed, 3),
+        "throughput_msg_s":     round(len(tracker.latencies) / elapsed, 1) if elapsed else 0.0,
+        "emit_latency_ms":      _percentiles(tracker.emit_latencies),
+        "processed_latency_ms": _percentiles(tracker.latencies),
+        "commit_latency_ms":    _percentiles(tracker.commit_latencies),
+        "unprocessed":          tracker.outstanding(),
+        "uncommitted":          tracker.uncommitted(),
+        "socketio_emits":       dict(sio.counts),
+        "ingest":               mqtt_service.get_ingest_stats(),
+        "db_writer":            writer.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="EcoGrow MQTT ingest record/replay benchmark")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_rec = sub.add_parser("record", help="record live broker traffic")
+    p_rec.add_argument("path")
+    p_rec.add_argument("--seconds", type=float, default=600)
+    p_rec.add_argument("--topic", action="append", default=None,
+                       help="topic filter (repeatable, default: ecogrow/sensors and ecogrow/+/+/sensors)")
+
+    p_syn = sub.add_parser("synth", help="generate a synthetic N-device recording")
+    p_syn.add_argument("path")
+    p_syn.add_argument("--devices", type=int, default=100)
+    p_syn.add_argument("--users", type=int, default=None)
+    p_syn.add_argument("--seconds", type=float, default=600)
+    p_syn.add_argument("--interval", type=float, default=10.0)
+    p_syn.add_argument("--binary", action="store_true", help="emit binary v1 payloads instead of JSON")
+
+    p_rep = sub.add_parser("replay", help="replay a recording and report throughput/latency")
+    p_rep.add_argument("path")
+    p_rep.add_argument("--speed", type=float, default=1.0, help="1 = real time, up to 1000")
+    p_rep.add_argument("--target", choices=("loopback", "handler", "broker"), default="loopback")
+    p_rep.add_argument("--host", default="localhost")
+    p_rep.add_argument("--port", type=int, default=1883)
+    p_rep.add_argument("--null-db", action="store_true", help="discard DB writes (no database needed)")
+
+    args = parser.parse_args(argv)
+    if args.cmd == "record":
+        record(args.path, args.seconds, args.topic or ["ecogrow/sensors", "ecogrow/+/+/sensors"])
+    elif args.cmd == "synth":
+        n = write_recording(args.path, synth_messages(args.devices, args.seconds, args.interval,
+                                                      args.binary, users=args.users))
+        print(f"[Bench] Wrote {n} synthetic message(s) to {args.path}")
+    else:
+        replay(args.path, max(0.001, min(args.speed, 1000.0)), args.target,
+               host=args.host, port=args.port, null_db=args.null_db)
+
+
+if __name__ == "__main__":
+    main()
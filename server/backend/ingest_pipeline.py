@@ -0,0 +1,235 @@
+"""
+Bounded ingest pipeline for MQTT sensor messages.
+
+paho-mqtt invokes on_message on its network thread, so anything slow done
+there (DB writes, Socket.IO emits, Gemini calls) stalls keepalives for every
+device.  The MQTT callback only hands the raw payload to `IngestPipeline.submit`
+and a small worker pool drains the queue and runs the real handler.
+
+Overflow behaviour when the queue is full is explicit:
+  drop-oldest – discard the oldest queued message to make room (default)
+  block       – make the caller wait up to `block_timeout` seconds, then drop
+  spill       – append the message to an on-disk spill file that workers
+                replay once the in-memory queue has drained
+
+A worker claims the spill file by renaming it to `<spill>.<thread>.draining`
+and deletes it only after every line was replayed; corrupt lines are counted
+and skipped.  A drain file left behind by a crash is picked up again by the
+next replay, so its messages are delivered at least once.
+"""
+
+import glob
+import os
+import threading
+import time
+from collections import deque
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+OVERFLOW_BLOCK = "block"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK, OVERFLOW_SPILL)
+
+
+class IngestPipeline:
+    """Bounded FIFO of (topic, payload, received_at) drained by worker threads."""
+
+    def __init__(self, handler, maxsize=1000, workers=2, overflow=OVERFLOW_DROP_OLDEST,
+                 block_timeout=1.0, spill_path=None, name="ingest"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        if overflow == OVERFLOW_SPILL and not spill_path:
+            raise ValueError("spill overflow policy requires a spill_path")
+        self.handler = handler
+        self.maxsize = max(1, int(maxsize))
+        self.workers = max(1, int(workers))
+        self.overflow = overflow
+        self.block_timeout = float(block_timeout)
+        self.spill_path = spill_path
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._draining = set()          # drain files claimed by live workers
+        self._leftover_drains = False   # set by start() if a crash left drain files
+        self._threads = []
+        self._running = False
+        # Optional observer(topic, payload, received_at, finished_at) — used by ingest_bench
+        self.on_processed = None
+
+        self._enqueued = 0
+        self._processed = 0
+        self._dropped = 0
+        self._spilled = 0
+        self._replayed = 0
+        self._corrupt = 0
+        self._errors = 0
+        self._max_depth = 0
+
+    # ── Producer side (MQTT network thread) ──────────────────────────────
+    def submit(self, topic, payload) -> bool:
+        """Queue a raw message. Returns False if it was dropped."""
+        item = (topic, bytes(payload), time.monotonic())
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.overflow == OVERFLOW_DROP_OLDEST:
+                    self._queue.popleft()
+                    self._dropped += 1
+                elif self.overflow == OVERFLOW_BLOCK:
+                    deadline = time.monotonic() + self.block_timeout
+                    while len(self._queue) >= self.maxsize:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._dropped += 1
+                            return False
+                        self._cond.wait(remaining)
+                else:
+                    self._spill(item)
+                    self._cond.notify()
+                    return True
+            self._queue.append(item)
+            self._enqueued += 1
+            if len(self._queue) > self._max_depth:
+                self._max_depth = len(self._queue)
+            self._cond.notify()
+        return True
+
+    def _spill(self, item):
+        topic, payload, _ = item
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="ascii") as f:
+                f.write(f"{topic}\t{payload.hex()}\n")
+            self._spilled += 1
+        except OSError as exc:
+            self._dropped += 1
+            print(f"[Ingest] Spill write failed, message dropped: {exc}")
+
+    # ── Consumer side ────────────────────────────────────────────────────
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._leftover_drains = bool(self.spill_path) and bool(self._orphan_drains())
+        for i in range(self.workers):
+            t = threading.Thread(target=self._worker, name=f"{self.name}-worker-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        print(f"[Ingest] Pipeline started: {self.workers} worker(s), "
+              f"queue={self.maxsize}, overflow={self.overflow}")
+
+    def stop(self, timeout=5.0):
+        """Stop workers after the in-memory queue has drained (or timeout)."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._queue and self._running and not self._spill_pending():
+                    self._cond.wait(1.0)
+                if self._queue:
+                    topic, payload, received_at = self._queue.popleft()
+                    self._cond.notify_all()  # wake producers waiting under "block"
+                elif not self._running:
+                    return
+                else:
+                    topic = None
+            if topic is None:
+                self._replay_spill()
+                continue
+            self._run(topic, payload, received_at)
+
+    def _run(self, topic, payload, received_at=None):
+        try:
+            self.handler(topic, payload)
+        except Exception as exc:
+            self._errors += 1
+            print(f"[Ingest] Handler error: {exc}")
+        finally:
+            self._processed += 1
+            if self.on_processed is not None:
+                try:
+                    self.on_processed(topic, payload, received_at, time.monotonic())
+                except Exception as exc:
+                    print(f"[Ingest] on_processed observer error: {exc}")
+
+    def _spill_pending(self):
+        return bool(self.spill_path) and (self._leftover_drains or os.path.exists(self.spill_path))
+
+    def _orphan_drains(self):
+        """Drain files no live worker owns (an earlier process or an interrupted replay)."""
+        paths = sorted(glob.glob(glob.escape(self.spill_path) + ".*.draining"))
+        return [p for p in paths if p not in self._draining]
+
+    def _replay_spill(self):
+        """Claim a drain file (left over first, else the spill file) and replay it in order."""
+        draining = f"{self.spill_path}.{threading.get_ident()}.draining"
+        with self._spill_lock:
+            orphans = self._orphan_drains()
+            self._leftover_drains = len(orphans) > 1
+            source = orphans[0] if orphans else self.spill_path
+            try:
+                if source != draining:
+                    os.replace(source, draining)
+            except FileNotFoundError:
+                return
+            self._draining.add(draining)
+        try:
+            with open(draining, encoding="ascii", errors="replace") as f:
+                for line_no, line in enumerate(f, start=1):
+                    topic, _, hex_payload = line.rstrip("\n").partition("\t")
+                    try:
+                        payload = bytes.fromhex(hex_payload)
+                    except ValueError:
+                        self._corrupt += 1
+                        print(f"[Ingest] Skipping corrupt spill line {line_no} of {draining}")
+                        continue
+                    self._replayed += 1
+                    self._run(topic, payload)
+        except OSError as exc:
+            # Keep the file: the next replay or restart picks it up again
+            print(f"[Ingest] Spill replay of {draining} interrupted: {exc}")
+        else:
+            os.remove(draining)
+        finally:
+            with self._spill_lock:
+                self._draining.discard(draining)
+
+    # ── Metrics ──────────────────────────────────────────────────────────
+    def stats(self) -> dict:
+        return {
+            "depth":     len(self._queue),
+            "max_depth": self._max_depth,
+            "capacity":  self.maxsize,
+            "workers":   self.workers,
+            "overflow":  self.overflow,
+            "enqueued":  self._enqueued,
+            "processed": self._processed,
+            "dropped":   self._dropped,
+            "spilled":   self._spilled,
+            "replayed":  self._replayed,
+            "corrupt":   self._corrupt,
+            "errors":    self._errors,
+        }
+
+
+def pipeline_from_env(handler) -> IngestPipeline:
+    """Build a pipeline configured from MQTT_INGEST_* environment variables."""
+    return IngestPipeline(
+        handler,
+        maxsize=int(os.environ.get("MQTT_INGEST_QUEUE_SIZE", 1000)),
+        workers=int(os.environ.get("MQTT_INGEST_WORKERS", 2)),
+        overflow=os.environ.get("MQTT_INGEST_OVERFLOW", OVERFLOW_DROP_OLDEST).strip().lower(),
+        block_timeout=float(os.environ.get("MQTT_INGEST_BLOCK_TIMEOUT", 1.0)),
+        spill_path=os.environ.get("MQTT_INGEST_SPILL_PATH", "mqtt_ingest_spill.log"),
+        name="mqtt-ingest",
+    )
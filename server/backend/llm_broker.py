@@ -0,0 +1,197 @@
+"""
+Process-wide broker for outbound LLM (Gemini) calls.
+
+HTTP predictions, the MQTT callback and the 60 s scheduler can all ask for
+the same suggestion at once, and nothing else bounded the call volume.  Every
+call now goes through `LlmBroker.call(key, fn, priority)`:
+
+  singleflight  callers with the same key while a call is in flight wait
+                for that call's result instead of issuing their own
+  rate          token bucket of LLM_RATE_PER_MIN calls per minute with bursts
+                of LLM_BURST (defaults 60 / 10)
+  concurrency   at most LLM_MAX_CONCURRENT calls running (default 4)
+  priority      interactive callers (HTTP) wait up to LLM_QUEUE_WAIT_MS for a
+                token and a slot; background callers (scheduler, MQTT) never
+                wait, and are refused while interactive callers are queued
+                or fewer than LLM_INTERACTIVE_RESERVE tokens would remain
+  breaker       LLM_BREAKER_FAILURES consecutive failures (errors, timeouts,
+                quota) open a circuit breaker for LLM_BREAKER_RESET_SEC; while
+                open every call is refused at once
+
+A refused or failed call returns None and the caller uses its fallback, so an
+outage or quota hit never piles up blocked threads.
+"""
+
+import os
+import threading
+import time
+from circuit_breaker import CircuitBreaker
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+
+
+class _Flight:
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class LlmBroker:
+    def __init__(self, rate_per_min=60.0, burst=10, max_concurrent=4, queue_wait_s=1.0,
+                 interactive_reserve=2, breaker=None):
+        self.rate_per_s = rate_per_min / 60.0
+        self.burst = max(1.0, float(burst))
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.queue_wait_s = queue_wait_s
+        self.interactive_reserve = min(float(interactive_reserve), self.burst - 1)
+        self.breaker = breaker or CircuitBreaker("llm")
+
+        self._cond = threading.Condition()
+        self._tokens = self.burst
+        self._refilled = time.monotonic()
+        self._running = 0
+        self._interactive_waiting = 0
+        self._flights = {}
+
+        self._calls = 0
+        self._coalesced = 0
+        self._failures = 0
+        self._refused = {"rate": 0, "busy": 0, "breaker": 0}
+
+    # ── Admission ────────────────────────────────────────────────────────
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate_per_s)
+        self._refilled = now
+
+    def _admit_background(self) -> str | None:
+        """Take a token and a slot now, or return why not."""
+        self._refill()
+        if self._interactive_waiting or self._running >= self.max_concurrent:
+            return "busy"
+        if self._tokens < 1 + self.interactive_reserve:
+            return "rate"
+        self._tokens -= 1
+        self._running += 1
+        return None
+
+    def _admit_interactive(self) -> str | None:
+        deadline = time.monotonic() + self.queue_wait_s
+        self._interactive_waiting += 1
+        try:
+            while True:
+                self._refill()
+                if self._running < self.max_concurrent and self._tokens >= 1:
+                    self._tokens -= 1
+                    self._running += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return "busy" if self._running >= self.max_concurrent else "rate"
+                # Wake up for a released slot or the next token
+                wait = remaining
+                if self._tokens < 1 and self.rate_per_s > 0:
+                    wait = min(wait, (1 - self._tokens) / self.rate_per_s)
+                self._cond.wait(wait)
+        finally:
+            self._interactive_waiting -= 1
+
+    def _give_back(self):
+        """Return an unused token and slot (caller holds the lock)."""
+        self._tokens = min(self.burst, self._tokens + 1)
+        self._running -= 1
+        self._cond.notify_all()
+
+    # ── Calls ────────────────────────────────────────────────────────────
+    def call(self, key, fn, priority=PRIORITY_BACKGROUND, timeout=None):
+        """
+        Run fn() unless refused; identical keys in flight share one call.
+        Returns fn's result, or None when refused, failed or (for a coalesced
+        caller) not finished within `timeout` seconds.
+        """
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight is None:
+                if priority == PRIORITY_INTERACTIVE:
+                    refused = self._admit_interactive()
+                else:
+                    refused = self._admit_background()
+                if refused is None:
+                    # An identical call may have started while we queued
+                    flight = self._flights.get(key)
+                    if flight is not None:
+                        self._give_back()
+                    elif not self.breaker.allow():
+                        self._give_back()
+                        refused = "breaker"
+                if refused is not None:
+                    self._refused[refused] += 1
+                    return None
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self._coalesced += 1
+        if not leader:
+            flight.done.wait(timeout)
+            return flight.result
+
+        result = None
+        try:
+            result = fn()
+            self.breaker.record_success()
+        except Exception as exc:
+            self.breaker.record_failure()
+            print(f"[LLM] Call failed: {exc}")
+            with self._cond:
+                self._failures += 1
+        finally:
+            flight.result = result
+            with self._cond:
+                self._flights.pop(key, None)
+                self._running -= 1
+                self._calls += 1
+                self._cond.notify_all()
+            flight.done.set()
+        return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._refill()
+            return {
+                "calls":         self._calls,
+                "failures":      self._failures,
+                "coalesced":     self._coalesced,
+                "refused":       dict(self._refused),
+                "running":       self._running,
+                "in_flight":     len(self._flights),
+                "tokens":        round(self._tokens, 2),
+                "breaker":       self.breaker.stats(),
+            }
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_llm_broker() -> LlmBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = LlmBroker(
+                    rate_per_min=float(os.environ.get("LLM_RATE_PER_MIN", 60)),
+                    burst=int(os.environ.get("LLM_BURST", 10)),
+                    max_concurrent=int(os.environ.get("LLM_MAX_CONCURRENT", 4)),
+                    queue_wait_s=int(os.environ.get("LLM_QUEUE_WAIT_MS", 1000)) / 1000.0,
+                    interactive_reserve=int(os.environ.get("LLM_INTERACTIVE_RESERVE", 2)),
+                    breaker=CircuitBreaker(
+                        "gemini",
+                        failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES", 5)),
+                        reset_timeout=float(os.environ.get("LLM_BREAKER_RESET_SEC", 60)),
+                    ),
+                )
+    return _broker
@@ -0,0 +1,211 @@
+"""
+Idempotent schema migrations for the EcoGrow backend.
+
+Each entry is (name, [statements]).  Statements use IF NOT EXISTS (including
+MariaDB's ADD COLUMN / ADD INDEX IF NOT EXISTS) so the whole list can be re-run
+safely against an existing database.  Steps that SQL alone cannot make
+idempotent are callables taking the cursor and checking the schema themselves.
+
+Command:
+    python migrations.py [--drop-foreign-keys]
+
+--drop-foreign-keys (or MIGRATE_DROP_FOREIGN_KEYS=1) lets migration 007 drop
+foreign keys on the tables it partitions; see retention for what that gives up.
+"""
+
+import argparse
+import os
+from db_connect import get_connection
+from retention import partition_tables
+
+MIGRATIONS = [
+    ("001_devices", [
+        """
+        CREATE TABLE IF NOT EXISTS devices (
+          id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+          user_id BIGINT UNSIGNED NOT NULL,
+          tenant VARCHAR(64) NOT NULL,
+          device_key VARCHAR(64) NOT NULL,
+          name VARCHAR(100) NULL,
+          created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          UNIQUE KEY uq_devices_tenant_device (tenant, device_key),
+          KEY ix_devices_user (user_id)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    ("002_sensor_readings_window_stats", [
+        # One row per metric per device per minute: value is the window mean
+        """
+        ALTER TABLE sensor_readings
+          ADD COLUMN IF NOT EXISTS device_id VARCHAR(64) NOT NULL DEFAULT 'default' AFTER user_id,
+          ADD COLUMN IF NOT EXISTS value_min DOUBLE NULL AFTER value,
+          ADD COLUMN IF NOT EXISTS value_max DOUBLE NULL AFTER value_min,
+          ADD COLUMN IF NOT EXISTS value_last DOUBLE NULL AFTER value_max,
+          ADD COLUMN IF NOT EXISTS sample_count INT UNSIGNED NOT NULL DEFAULT 1 AFTER value_last
+        """,
+    ]),
+    ("003_devices_payload_format", [
+        """
+        ALTER TABLE devices
+          ADD COLUMN IF NOT EXISTS payload_format ENUM('json','binary','auto') NOT NULL DEFAULT 'auto' AFTER device_key
+        """,
+    ]),
+    ("004_sensor_readings_minute_key", [
+        # Dedup moves from a per-request "last reading" SELECT to a unique key.
+        # Runs under the pool's UTC session time zone, so UNIX_TIMESTAMP is UTC-based.
+        """
+        ALTER TABLE sensor_readings
+          ADD COLUMN IF NOT EXISTS minute_bucket INT UNSIGNED NOT NULL DEFAULT 0 AFTER timestamp_utc
+        """,
+        """
+        UPDATE sensor_readings
+        SET minute_bucket = FLOOR(UNIX_TIMESTAMP(timestamp_utc) / 60)
+        WHERE minute_bucket = 0
+        """,
+        # Legacy rows may hold several readings in one minute; keep the earliest
+        """
+        DELETE newer FROM sensor_readings newer
+        JOIN sensor_readings older
+          ON older.user_id = newer.user_id
+         AND older.device_id = newer.device_id
+         AND older.sensor_type = newer.sensor_type
+         AND older.minute_bucket = newer.minute_bucket
+         AND older.id < newer.id
+        """,
+        """
+        ALTER TABLE sensor_readings
+          ADD UNIQUE INDEX IF NOT EXISTS uq_sensor_readings_minute (user_id, device_id, sensor_type, minute_bucket)
+        """,
+    ]),
+    ("005_sensor_readings_wide", [
+        # One row per device per minute, all metrics as columns (see sensor_wide)
+        """
+        CREATE TABLE IF NOT EXISTS sensor_readings_wide (
+          id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+          user_id BIGINT UNSIGNED NOT NULL,
+          device_id VARCHAR(64) NOT NULL DEFAULT 'default',
+          timestamp_utc DATETIME NOT NULL,
+          minute_bucket INT UNSIGNED NOT NULL,
+          sample_count INT UNSIGNED NOT NULL DEFAULT 1,
+          co2 DOUBLE NULL,
+          co2_min DOUBLE NULL,
+          co2_max DOUBLE NULL,
+          temp DOUBLE NULL,
+          temp_min DOUBLE NULL,
+          temp_max DOUBLE NULL,
+          humidity DOUBLE NULL,
+          humidity_min DOUBLE NULL,
+          humidity_max DOUBLE NULL,
+          UNIQUE KEY uq_sensor_readings_wide_minute (user_id, device_id, minute_bucket),
+          KEY ix_sensor_readings_wide_user_ts (user_id, timestamp_utc)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    ("006_sensor_rollups", [
+        # Hour / day count-sum-min-max per metric (see rollups)
+        """
+        CREATE TABLE IF NOT EXISTS sensor_rollups (
+          user_id BIGINT UNSIGNED NOT NULL,
+          resolution ENUM('hour','day') NOT NULL,
+          bucket_start DATETIME NOT NULL,
+          device_id VARCHAR(64) NOT NULL,
+          sensor_type VARCHAR(32) NOT NULL,
+          row_count INT UNSIGNED NOT NULL,
+          sample_count BIGINT UNSIGNED NOT NULL,
+          value_sum DOUBLE NOT NULL,
+          value_min DOUBLE NULL,
+          value_max DOUBLE NULL,
+          PRIMARY KEY (user_id, resolution, bucket_start, device_id, sensor_type)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        # Catch-up recomputes recent buckets for all users by minute range
+        """
+        ALTER TABLE sensor_readings
+          ADD INDEX IF NOT EXISTS ix_sensor_readings_minute_bucket (minute_bucket)
+        """,
+    ]),
+    ("007_monthly_partitions", [
+        # Compacted alert history kept after crop_alerts partitions are dropped
+        """
+        CREATE TABLE IF NOT EXISTS crop_alert_daily (
+          user_id BIGINT UNSIGNED NOT NULL,
+          day DATE NOT NULL,
+          metric VARCHAR(32) NOT NULL,
+          severity VARCHAR(16) NOT NULL,
+          crop_type VARCHAR(64) NOT NULL DEFAULT '',
+          crop_stage VARCHAR(64) NOT NULL DEFAULT '',
+          alert_count INT UNSIGNED NOT NULL,
+          value_min DOUBLE NULL,
+          value_max DOUBLE NULL,
+          PRIMARY KEY (user_id, day, metric, severity, crop_type, crop_stage)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        partition_tables,
+    ]),
+    ("008_sensor_rollup_state", [
+        # Oldest bucket from which rollups are complete (see rollups.rollups_cover)
+        """
+        CREATE TABLE IF NOT EXISTS sensor_rollup_state (
+          id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+          covered_from DATETIME NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        # First run only: with no raw data everything is covered; otherwise the
+        # earliest incremental hour rollup, or the current hour. `rollups.py
+        # rebuild` moves it back.
+        """
+        INSERT IGNORE INTO sensor_rollup_state (id, covered_from)
+        SELECT 1, IF(
+          NOT EXISTS (SELECT 1 FROM sensor_readings),
+          '1970-01-01 00:00:00',
+          COALESCE(
+            (SELECT MIN(bucket_start) FROM sensor_rollups WHERE resolution = 'hour'),
+            DATE_FORMAT(UTC_TIMESTAMP(), '%Y-%m-%d %H:00:00')
+          )
+        )
+        """,
+    ]),
+    ("009_user_purge_jobs", [
+        # Account deletions whose data purge has not finished (see retention)
+        """
+        CREATE TABLE IF NOT EXISTS user_purge_jobs (
+          user_id BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+          requested_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+]
+
+
+def apply_migrations(conn, migrations=None):
+    """Run every migration statement in order. Returns the names applied."""
+    applied = []
+    cur = conn.cursor()
+    try:
+        for name, statements in (migrations or MIGRATIONS):
+            for stmt in statements:
+                if callable(stmt):
+                    stmt(cur)
+                else:
+                    cur.execute(stmt)
+            conn.commit()
+            applied.append(name)
+            print(f"[Migrations] Applied {name}")
+    finally:
+        cur.close()
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--drop-foreign-keys", action="store_true",
+                        help="allow partitioning tables that have foreign keys (the keys are dropped)")
+    args = parser.parse_args()
+    if args.drop_foreign_keys:
+        os.environ["MIGRATE_DROP_FOREIGN_KEYS"] = "1"
+
+    conn = get_connection()
+    try:
+        apply_migrations(conn)
+    finally:
+        conn.close()
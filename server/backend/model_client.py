@@ -0,0 +1,152 @@
+"""
+HTTP client for the remote risk model (MODEL_URL).
+
+  keep-alive  one requests.Session with a small connection pool, so calls
+              reuse the TLS connection instead of handshaking every time
+  timeouts    MODEL_CONNECT_TIMEOUT_SEC / MODEL_READ_TIMEOUT_SEC (1 / 2)
+              instead of a flat 5 s
+  hedging     with MODEL_HEDGE_MS > 0 a second request is sent if the first
+              has not answered by then; the first good answer wins (off by
+              default: it doubles load on a slow host)
+  breaker     MODEL_BREAKER_FAILURES consecutive failures (default 3) open a
+              circuit breaker for MODEL_BREAKER_RESET_SEC (30); while open,
+              `predict` returns None at once so the caller goes straight to
+              its rule-based fallback, and one half-open probe decides when
+              the model is back
+
+`stats()` reports calls, errors, timeouts, hedges, refusals and a latency
+histogram (part of /api/metrics).
+"""
+
+import os
+import threading
+import time
+from circuit_breaker import CircuitBreaker
+from db_pool import LatencyHistogram
+
+
+class RemoteModelClient:
+    def __init__(self, url, connect_timeout=1.0, read_timeout=2.0, hedge_ms=0, pool_size=8, breaker=None):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.hedge_s = hedge_ms / 1000.0
+        self.pool_size = pool_size
+        self.breaker = breaker or CircuitBreaker("risk-model")
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._calls = 0
+        self._errors = 0
+        self._timeouts = 0
+        self._hedged = 0
+        self._refused = 0
+        self._latency = LatencyHistogram()
+
+    def _get_session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    # Imported here: requests is only needed once the model is called
+                    import requests
+                    from requests.adapters import HTTPAdapter
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _post(self, payload):
+        resp = self._get_session().post(self.url, json=payload, timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.json()
+
+    def _post_hedged(self, payload):
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.pool_size,
+                                                        thread_name_prefix="model-hedge")
+        futures = {self._executor.submit(self._post, payload)}
+        done, _ = wait(futures, timeout=self.hedge_s)
+        if not done:
+            with self._stats_lock:
+                self._hedged += 1
+            futures.add(self._executor.submit(self._post, payload))
+        error = None
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result()
+                except Exception as exc:
+                    error = exc
+        raise error
+
+    def predict(self, payload) -> dict | None:
+        """The model's JSON answer, or None (breaker open, timeout, error)."""
+        if not self.breaker.allow():
+            with self._stats_lock:
+                self._refused += 1
+            return None
+        started = time.perf_counter()
+        try:
+            result = self._post_hedged(payload) if self.hedge_s > 0 else self._post(payload)
+        except Exception as exc:
+            self.breaker.record_failure()
+            timed_out = "timeout" in type(exc).__name__.lower() or "timed out" in str(exc).lower()
+            with self._stats_lock:
+                self._calls += 1
+                self._errors += 1
+                if timed_out:
+                    self._timeouts += 1
+                self._latency.observe((time.perf_counter() - started) * 1000)
+            print(f"[AI] Model call failed: {exc}")
+            return None
+        self.breaker.record_success()
+        with self._stats_lock:
+            self._calls += 1
+            self._latency.observe((time.perf_counter() - started) * 1000)
+        return result
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "calls":    self._calls,
+                "errors":   self._errors,
+                "timeouts": self._timeouts,
+                "hedged":   self._hedged,
+                "refused":  self._refused,
+                "latency":  self._latency.as_dict(),
+                "breaker":  self.breaker.stats(),
+            }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_model_client(url) -> RemoteModelClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = RemoteModelClient(
+                    url,
+                    connect_timeout=float(os.environ.get("MODEL_CONNECT_TIMEOUT_SEC", 1.0)),
+                    read_timeout=float(os.environ.get("MODEL_READ_TIMEOUT_SEC", 2.0)),
+                    hedge_ms=int(os.environ.get("MODEL_HEDGE_MS", 0)),
+                    pool_size=int(os.environ.get("MODEL_HTTP_POOL", 8)),
+                    breaker=CircuitBreaker(
+                        "risk-model",
+                        failure_threshold=int(os.environ.get("MODEL_BREAKER_FAILURES", 3)),
+                        reset_timeout=float(os.environ.get("MODEL_BREAKER_RESET_SEC", 30)),
+                    ),
+                )
+    return _client
+
+
+def get_model_client_stats() -> dict:
+    return _client.stats() if _client is not None else {}
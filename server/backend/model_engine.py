@@ -0,0 +1,270 @@
+"""
+Risk model engine with pluggable backends.
+
+  remote  (default) the Random Forest service at MODEL_URL, through
+          model_client (keep-alive, circuit breaker)
+  local   a tree ensemble exported to JSON and scored in process: no network,
+          microseconds per row.  Batches are scored in one vectorised pass
+          when NumPy is installed, with a pure-Python walk otherwise.
+
+RISK_MODEL_BACKEND selects the backend; `local` reads RISK_MODEL_PATH and
+falls back to `remote` if the file cannot be loaded.  Both return the remote
+service's answer shape, {"status": ..., "risk_score": ...}, for each
+(temperature, humidity, co2, crop_type, crop_stage) row.
+
+Ensemble file (written by `python model_engine.py export`):
+
+    {
+      "features":   [{"input": "temperature"},                      numeric
+                     {"input": "crop_type", "categories": [...]},   ordinal code
+                     {"input": "crop_stage", "equals": "flowering"}, one-hot
+                     ...],
+      "classes":    ["Critical", "Optimal", "Warning"],
+      "class_risk": {"Critical": 1.0, "Optimal": 0.0, "Warning": 0.5},
+      "trees":      [{"feature": [...], "threshold": [...], "left": [...],
+                      "right": [...], "value": [[p_class, ...], ...]}, ...]
+    }
+
+Nodes follow scikit-learn: a leaf has left == -1, an input goes left when
+x <= threshold with x rounded to float32 first (as sklearn does), and leaf
+values are class probabilities.  The ensemble's probability is the mean over
+trees; status is the most likely class and risk_score the probability-
+weighted class_risk.  Check a new export against recorded remote answers
+with verify_model_parity.py before switching backends.
+
+Command:
+    python model_engine.py export model.joblib risk_model.json \\
+        --features features.json [--class-risk Critical=1,Warning=0.5,Optimal=0]
+"""
+
+import argparse
+import json
+import os
+import struct
+import threading
+
+INPUTS = ("temperature", "humidity", "co2", "crop_type", "crop_stage")
+BACKEND_REMOTE = "remote"
+BACKEND_LOCAL = "local"
+
+
+def _load_numpy():
+    """NumPy if installed (imported on first local model load, not at startup)."""
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def _float32(value):
+    return struct.unpack("f", struct.pack("f", value))[0]
+
+
+class RemoteBackend:
+    name = BACKEND_REMOTE
+
+    def __init__(self, url):
+        self.url = url
+
+    def predict_batch(self, rows):
+        # Imported here: model_client pulls in requests on first call
+        from model_client import get_model_client
+        client = get_model_client(self.url)
+        return [client.predict(dict(zip(INPUTS, row))) for row in rows]
+
+
+class LocalTreeEnsemble:
+    """Tree ensemble loaded from the JSON export, scored in process."""
+
+    name = BACKEND_LOCAL
+
+    def __init__(self, spec, use_numpy=True):
+        self.features = spec["features"]
+        self.classes = list(spec["classes"])
+        self.class_risk = [float(spec.get("class_risk", {}).get(c, 0.0)) for c in self.classes]
+        self.trees = spec["trees"]
+        self._index = {name: i for i, name in enumerate(INPUTS)}
+        for feature in self.features:
+            if feature["input"] not in self._index:
+                raise ValueError(f"unknown model input {feature['input']!r}")
+        self._codes = [
+            {str(c).lower(): i for i, c in enumerate(f["categories"])} if "categories" in f else None
+            for f in self.features
+        ]
+        self._numpy = _load_numpy() if use_numpy else None
+        if self._numpy is not None:
+            self._compile()
+
+    @classmethod
+    def load(cls, path, use_numpy=True):
+        """Load an export; use_numpy=False forces the pure-Python path (parity checks)."""
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), use_numpy=use_numpy)
+
+    # ── Encoding ─────────────────────────────────────────────────────────
+    def _encode(self, row):
+        """Feature vector of one input row, float32-rounded like sklearn."""
+        vector = []
+        for feature, codes in zip(self.features, self._codes):
+            raw = row[self._index[feature["input"]]]
+            if codes is not None:
+                value = codes.get(str(raw).lower(), -1)
+            elif "equals" in feature:
+                value = 1.0 if str(raw).lower() == str(feature["equals"]).lower() else 0.0
+            else:
+                value = float(raw)
+            vector.append(_float32(value))
+        return vector
+
+    def _answer(self, proba):
+        best = max(range(len(self.classes)), key=lambda i: proba[i])
+        risk = sum(p * w for p, w in zip(proba, self.class_risk))
+        return {"status": self.classes[best], "risk_score": round(float(risk), 4)}
+
+    # ── Pure-Python path ─────────────────────────────────────────────────
+    def _proba_one(self, x):
+        total = [0.0] * len(self.classes)
+        for tree in self.trees:
+            node = 0
+            left, right = tree["left"], tree["right"]
+            while left[node] != -1:
+                if x[tree["feature"][node]] <= tree["threshold"][node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            value = tree["value"][node]
+            norm = sum(value) or 1.0
+            for i, v in enumerate(value):
+                total[i] += v / norm
+        return [t / len(self.trees) for t in total]
+
+    # ── NumPy path ───────────────────────────────────────────────────────
+    def _compile(self):
+        """Pack every tree into flat node arrays so a batch walks all trees at once."""
+        feature, threshold, left, right, value, roots = [], [], [], [], [], []
+        np = self._numpy
+        depth = 0
+        for tree in self.trees:
+            base = len(feature)
+            roots.append(base)
+            for i in range(len(tree["left"])):
+                leaf = tree["left"][i] == -1
+                # Leaves point at themselves, so extra steps are no-ops
+                feature.append(0 if leaf else tree["feature"][i])
+                threshold.append(0.0 if leaf else tree["threshold"][i])
+                left.append(base + i if leaf else base + tree["left"][i])
+                right.append(base + i if leaf else base + tree["right"][i])
+                v = tree["value"][i]
+                norm = sum(v) or 1.0
+                value.append([p / norm for p in v])
+            depth = max(depth, self._depth(tree))
+        self._arrays = {
+            "feature":   np.asarray(feature, dtype=np.intp),
+            "threshold": np.asarray(threshold, dtype=np.float64),
+            "left":      np.asarray(left, dtype=np.intp),
+            "right":     np.asarray(right, dtype=np.intp),
+            "value":     np.asarray(value, dtype=np.float64),
+            "roots":     np.asarray(roots, dtype=np.intp),
+            "depth":     depth,
+        }
+
+    @staticmethod
+    def _depth(tree):
+        depth, stack = 0, [(0, 0)]
+        while stack:
+            node, d = stack.pop()
+            if tree["left"][node] == -1:
+                depth = max(depth, d)
+            else:
+                stack.append((tree["left"][node], d + 1))
+                stack.append((tree["right"][node], d + 1))
+        return depth
+
+    def _proba_numpy(self, X):
+        np, c = self._numpy, self._arrays
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(c["roots"], (X.shape[0], c["roots"].size)).copy()
+        for _ in range(c["depth"]):
+            go_left = X[rows, c["feature"][node]] <= c["threshold"][node]
+            node = np.where(go_left, c["left"][node], c["right"][node])
+        return c["value"][node].mean(axis=1)
+
+    def predict_batch(self, rows):
+        if not rows:
+            return []
+        encoded = [self._encode(row) for row in rows]
+        np = self._numpy
+        if np is not None:
+            proba = self._proba_numpy(np.asarray(encoded, dtype=np.float32).astype(np.float64))
+            best = proba.argmax(axis=1)
+            risk = np.round(proba @ np.asarray(self.class_risk), 4)
+            return [{"status": self.classes[i], "risk_score": float(r)} for i, r in zip(best.tolist(), risk.tolist())]
+        return [self._answer(self._proba_one(x)) for x in encoded]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_model_engine(url):
+    """Backend picked by RISK_MODEL_BACKEND, built once."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                backend = os.environ.get("RISK_MODEL_BACKEND", BACKEND_REMOTE).strip().lower()
+                engine = RemoteBackend(url)
+                if backend == BACKEND_LOCAL:
+                    path = os.environ.get("RISK_MODEL_PATH", "risk_model.json")
+                    try:
+                        engine = LocalTreeEnsemble.load(path)
+                        print(f"[AI] Local risk model loaded from {path} "
+                              f"({len(engine.trees)} trees, numpy={engine._numpy is not None})")
+                    except (OSError, ValueError, KeyError) as exc:
+                        print(f"[AI] Local risk model {path} not loaded, using remote: {exc}")
+                _engine = engine
+    return _engine
+
+
+# ── Export ───────────────────────────────────────────────────────────────────
+def export_sklearn(model, features, class_risk):
+    """JSON spec of a fitted scikit-learn forest (or single tree) classifier."""
+    estimators = getattr(model, "estimators_", [model])
+    trees = []
+    for est in estimators:
+        t = est.tree_
+        trees.append({
+            "feature":   [int(f) for f in t.feature],
+            "threshold": [float(v) for v in t.threshold],
+            "left":      [int(n) for n in t.children_left],
+            "right":     [int(n) for n in t.children_right],
+            "value":     [[float(v) for v in node[0]] for node in t.value],
+        })
+    return {
+        "features":   features,
+        "classes":    [str(c) for c in model.classes_],
+        "class_risk": class_risk,
+        "trees":      trees,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Risk model engine tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_ex = sub.add_parser("export", help="convert a pickled scikit-learn forest to the JSON ensemble format")
+    p_ex.add_argument("model", help="joblib / pickle file of the fitted classifier")
+    p_ex.add_argument("out")
+    p_ex.add_argument("--features", required=True,
+                      help="JSON file with the feature list, in the order the model was trained on")
+    p_ex.add_argument("--class-risk", default="Critical=1,Warning=0.5,Optimal=0")
+    args = parser.parse_args()
+
+    import joblib
+    with open(args.features, encoding="utf-8") as f:
+        feature_spec = json.load(f)
+    risk = {k: float(v) for k, v in (pair.split("=") for pair in args.class_risk.split(","))}
+    spec = export_sklearn(joblib.load(args.model), feature_spec, risk)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    print(f"[AI] Exported {len(spec['trees'])} tree(s) to {args.out}")
@@ -1,25 +1,32 @@
-import json
+import atexit
 import os
 import threading
 import time
-import traceback
-from datetime import datetime, timezone
+from datetime import datetime
 import paho.mqtt.client as mqtt
-from db_connect import get_connection
+from ingest_pipeline import pipeline_from_env
+from window_aggregator import get_window_aggregator
+from snapshot_store import SnapshotStore, DEFAULT_DEVICE_ID, normalize_user_id
+from topic_router import TopicRouter
+from payload_codec import decode_payload, FORMAT_AUTO
+from device_registry import load_device_routes
 
 # Global reference to socketio instance (will be set from app.py)
 socketio_instance = None
 
-# In-memory cache for throttling DB writes: { user_id: last_timestamp_utc }
-LAST_SAVED = {}
-
-# In-memory cooldown for real-time alert emissions: { metric_key: last_epoch }
+# In-memory cooldown for real-time alert emissions: { (user_id, device_id, metric): last_epoch }
 _ALERT_EMIT_COOLDOWN = {}
-_ALERT_COOLDOWN_SEC = 60  # don't re-emit the same metric alert within 60s
+_ALERT_COOLDOWN_SEC = 60  # don't re-emit the same device's metric alert within 60s
+_ALERT_COOLDOWN_LOCK = threading.Lock()
+
+# Legacy single-topic feed (current ESP32 firmware). Devices registered in the
+# devices table publish to ecogrow/<tenant>/<device>/sensors instead and are
+# routed to their owner without any global user context.
+LEGACY_SENSOR_TOPIC = "ecogrow/sensors"
 
-# Global active user ID. We use this to decide which user is associated
-# with incoming hardware sensor data, since the raw MQTT streams don't carry web sessions.
-# This gets updated dynamically when a user logs into the web app.
+# Global active user ID. Only used for the legacy topic: we use this to decide which
+# user is associated with incoming hardware sensor data, since the raw MQTT streams
+# don't carry web sessions. This gets updated dynamically when a user logs into the web app.
 ACTIVE_MQTT_USER_ID = 1
 
 def set_active_mqtt_user(user_id):
@@ -28,51 +35,75 @@ def set_active_mqtt_user(user_id):
     ACTIVE_MQTT_USER_ID = int(user_id)
     print(f"[MQTT] Active user context updated to: {ACTIVE_MQTT_USER_ID}")
 
-# Latest sensor snapshot — updated on every MQTT message
-LATEST_SENSOR_DATA = {}
+# Latest sensor snapshot per (user_id, device_id) — updated on every MQTT message
+snapshot_store = SnapshotStore()
+
+def get_latest_sensor_data(user_id, device_id=None):
+    """Return the most recent sensor values received from MQTT for one user (or {})."""
+    snap = snapshot_store.latest(user_id, device_id)
+    return snap.as_dict() if snap else {}
 
-def get_latest_sensor_data():
-    """Return the most recent sensor values received from MQTT."""
-    return LATEST_SENSOR_DATA
+def get_fleet_sensor_data():
+    """Return { user_id: SensorSnapshot } with the latest reading of every recently seen user."""
+    return snapshot_store.fleet()
 
 def set_socketio(sio):
     global socketio_instance
     socketio_instance = sio
 
+def user_room(user_id):
+    """Socket.IO room of one user; live readings and alerts are only emitted there."""
+    return f"user:{normalize_user_id(user_id)}"
+
+def reload_topic_routes():
+    """Rebuild the topic → (user, device) table, e.g. after a device is registered."""
+    topic_router.reload()
+
 def on_connect(client, userdata, flags, rc):
     if rc == 0:
         print("[MQTT] Connected to Broker")
-        client.subscribe("ecogrow/sensors")
+        topics = [LEGACY_SENSOR_TOPIC] + topic_router.subscriptions()
+        client.subscribe([(t, 0) for t in topics])
     else:
         print(f"[MQTT] Connection Failed. Return Code: {rc}")
 
 def on_message(client, userdata, msg):
     """
-    Process incoming MQTT message:
-    1. Parse JSON
-    2. Insert to DB (throttled to 1 min)
+    Runs on paho's network thread: only hand the raw payload to the ingest
+    pipeline so slow DB / Socket.IO / Gemini work never stalls the MQTT loop.
+    """
+    _pipeline.submit(msg.topic, msg.payload)
+
+def process_message(topic, payload):
+    """
+    Process one queued MQTT message (runs on an ingest worker thread):
+    1. Decode JSON or binary payload (format negotiated per topic)
+    2. Fold into the 1-minute window aggregate (written on window close)
     3. Emit via SocketIO (live)
     4. Check thresholds and emit new_alerts if out of range
     """
     try:
-        payload = msg.payload.decode("utf-8")
-        
-        data = json.loads(payload)
-        
+        if topic == LEGACY_SENSOR_TOPIC:
+            data = decode_payload(payload, FORMAT_AUTO)
+            user_id = normalize_user_id(data.get("user_id", ACTIVE_MQTT_USER_ID))
+            device_id = data.get("device_id") or DEFAULT_DEVICE_ID
+        else:
+            route = topic_router.resolve(topic)
+            if route is None:
+                print(f"[MQTT] Ignoring message on unregistered topic: {topic}")
+                return
+            user_id, device_id, payload_format = route
+            data = decode_payload(payload, payload_format)
+
         co2 = float(data.get("co2", 0))
         temp = float(data.get("temp", 0))
         humidity = float(data.get("humidity", 0))
-        
-        user_id = data.get("user_id", ACTIVE_MQTT_USER_ID)
 
         # 0. Update in-memory snapshot
-        LATEST_SENSOR_DATA["co2"]       = co2
-        LATEST_SENSOR_DATA["temp"]      = temp
-        LATEST_SENSOR_DATA["humidity"]  = humidity
-        LATEST_SENSOR_DATA["timestamp"] = datetime.now().strftime("%H:%M:%S")
+        snapshot_store.update(user_id, device_id, co2, temp, humidity)
         
-        # 1. Database Insertion (Throttled)
-        save_to_db_throttled(user_id, co2, temp, humidity)
+        # 1. Database Insertion (1-minute windowed aggregate)
+        save_to_db_windowed(user_id, device_id, co2, temp, humidity)
         
         # 2. SocketIO Emission (Real-time)
         if socketio_instance:
@@ -80,27 +111,34 @@ def on_message(client, userdata, msg):
                 "co2": co2,
                 "temp": temp,
                 "humidity": humidity,
-                "timestamp": datetime.now().strftime("%H:%M:%S")
+                "timestamp": datetime.now().strftime("%H:%M:%S"),
+                "user_id": user_id,
+                "device_id": device_id,
             }
-            socketio_instance.emit("sensor_update", emit_data)
+            socketio_instance.emit("sensor_update", emit_data, to=user_room(user_id))
 
             # 3. Real-time alert check
             try:
                 from ai_service import _check_alerts, _gemini_suggestion
                 sensor_snapshot = {"co2": co2, "temp": temp, "humidity": humidity}
-                alerts = _check_alerts(sensor_snapshot, "lettuce", "vegetative")
+                # Cached thresholds only: the scheduler refreshes them, not this thread
+                alerts = _check_alerts(sensor_snapshot, "lettuce", "vegetative", refresh=False)
                 if alerts:
                     now = time.time()
                     fresh_alerts = []
                     for alert in alerts:
-                        metric = alert.get("metric", "")
-                        last = _ALERT_EMIT_COOLDOWN.get(metric, 0)
-                        if (now - last) >= _ALERT_COOLDOWN_SEC:
-                            alert["suggestion"] = _gemini_suggestion(alert, "lettuce", "vegetative")
-                            fresh_alerts.append(alert)
-                            _ALERT_EMIT_COOLDOWN[metric] = now
+                        cooldown_key = (user_id, device_id, alert.get("metric", ""))
+                        # Claim the cooldown slot before the slow Gemini call so
+                        # parallel workers don't emit the same metric twice.
+                        with _ALERT_COOLDOWN_LOCK:
+                            last = _ALERT_EMIT_COOLDOWN.get(cooldown_key, 0)
+                            if (now - last) < _ALERT_COOLDOWN_SEC:
+                                continue
+                            _ALERT_EMIT_COOLDOWN[cooldown_key] = now
+                        alert["suggestion"] = _gemini_suggestion(alert, "lettuce", "vegetative")
+                        fresh_alerts.append(alert)
                     if fresh_alerts:
-                        socketio_instance.emit("new_alerts", fresh_alerts)
+                        socketio_instance.emit("new_alerts", fresh_alerts, to=user_room(user_id))
                         print(f"[MQTT] Emitted {len(fresh_alerts)} real-time alert(s) via SocketIO")
             except Exception as alert_err:
                 print(f"[MQTT] Alert check error (non-fatal): {alert_err}")
@@ -108,97 +146,70 @@ def on_message(client, userdata, msg):
     except Exception as e:
         print(f"[MQTT] Error processing message: {e}")
 
-def save_to_db_throttled(user_id, co2, temp, humidity):
+# Precompiled topic → (user_id, device_id, payload_format) routes for ecogrow/<tenant>/<device>/sensors
+topic_router = TopicRouter(load_device_routes)
+
+# Bounded queue + worker pool between the MQTT network thread and process_message
+_pipeline = pipeline_from_env(process_message)
+
+def get_ingest_stats():
+    """Return queue depth / drop counters for the MQTT ingest pipeline."""
+    stats = _pipeline.stats()
+    stats.update(topic_router.stats())
+    return stats
+
+def save_to_db_windowed(user_id, device_id, co2, temp, humidity):
     """
-    Saves to DB only if 60 seconds have passed since the last save for this user.
-    Uses in-memory cache to minimize DB reads.
+    Fold the reading into the device's 1-minute window. The aggregator emits one
+    row per metric per minute (mean/min/max/last/count) to the batch writer, so
+    readings inside the window are summarised instead of discarded.
     """
-    global LAST_SAVED
-    
-    now_utc = datetime.now(timezone.utc)
-    
-    # 1. Check Memory Cache
-    last_time = LAST_SAVED.get(user_id)
-    
-    # 2. If Cache Miss, Check Database
-    if not last_time:
-        conn = get_connection()
-        try:
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT timestamp_utc FROM sensor_readings WHERE user_id = %s ORDER BY timestamp_utc DESC LIMIT 1",
-                (user_id,)
-            )
-            row = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            if row:
-                db_time = row[0]
-                if db_time.tzinfo is None:
-                    db_time = db_time.replace(tzinfo=timezone.utc)
-                last_time = db_time
-                LAST_SAVED[user_id] = last_time
-        except Exception:
-            pass
-            
-    # 3. Check Interval
-    if last_time:
-        diff = (now_utc - last_time).total_seconds()
-        if diff < 60:
-            return
-            
-    # 4. Insert Data
-    conn = get_connection()
-    try:
-        cur = conn.cursor()
-        query = """
-            INSERT INTO sensor_readings (user_id, sensor_type, value, timestamp_utc)
-            VALUES 
-            (%s, 'co2', %s, %s),
-            (%s, 'temperature', %s, %s),
-            (%s, 'humidity', %s, %s)
-        """
-        cur.execute(query, (
-            user_id, co2, now_utc,
-            user_id, temp, now_utc,
-            user_id, humidity, now_utc
-        ))
-        conn.commit()
-        cur.close()
-        
-        LAST_SAVED[user_id] = now_utc
-        print(f"[MQTT] Data Saved for User {user_id} (Throttled Insert)")
-        
-    except Exception as e:
-        print(f"[MQTT] DB Error: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    get_window_aggregator().add(user_id, device_id, co2, temp, humidity)
+
+def start_ingest_pipeline():
+    """Start the ingest worker pool (idempotent). Also used by ingest_bench."""
+    if not _pipeline.running:
+        _pipeline.start()
+        atexit.register(_pipeline.stop)
+    return _pipeline
+
+def broker_config_from_env():
+    """Broker connection settings; defaults are the production HiveMQ cluster."""
+    return {
+        "host":     os.environ.get("MQTT_BROKER_HOST", "e940b6ecad9b415cbf9c361f773ed91c.s1.eu.hivemq.cloud"),
+        "port":     int(os.environ.get("MQTT_BROKER_PORT", 8883)),
+        "username": os.environ.get("MQTT_USERNAME", "albinjojo"),
+        "password": os.environ.get("MQTT_PASSWORD", "Albin@2004"),
+        "tls":      bool(int(os.environ.get("MQTT_TLS", "1"))),
+    }
 
 def start_mqtt_client():
     """
     Starts the MQTT client in a non-blocking background thread.
+    Set MQTT_BROKER_HOST / MQTT_BROKER_PORT / MQTT_TLS=0 to point it at a local broker.
     """
-    broker_address = "e940b6ecad9b415cbf9c361f773ed91c.s1.eu.hivemq.cloud"
-    port = 8883
+    cfg = broker_config_from_env()
 
     client_id = f"ecogrow_backend_{int(time.time())}"
     client = mqtt.Client(client_id=client_id)
 
-    client.tls_set(ca_certs=None, certfile=None, keyfile=None,
-                   cert_reqs=mqtt.ssl.CERT_NONE,
-                   tls_version=mqtt.ssl.PROTOCOL_TLSv1_2)
-    client.tls_insecure_set(True)
+    if cfg["tls"]:
+        client.tls_set(ca_certs=None, certfile=None, keyfile=None,
+                       cert_reqs=mqtt.ssl.CERT_NONE,
+                       tls_version=mqtt.ssl.PROTOCOL_TLSv1_2)
+        client.tls_insecure_set(True)
 
-    client.username_pw_set("albinjojo", "Albin@2004")
+    if cfg["username"]:
+        client.username_pw_set(cfg["username"], cfg["password"])
 
     client.on_connect = on_connect
     client.on_message = on_message
 
+    start_ingest_pipeline()
+
     try:
-        client.connect(broker_address, port, 60)
+        client.connect(cfg["host"], cfg["port"], 60)
         client.loop_start()
         print("[MQTT] Service Started")
     except Exception as e:
-        print(f"[MQTT] Failed to start: {e}")
\ No newline at end of file
+        print(f"[MQTT] Failed to start: {e}")
@@ -0,0 +1,82 @@
+"""
+MQTT sensor payload formats.
+
+json    – ArduinoJson text: {"co2": .., "temp": .., "humidity": .., "ts": ..}
+binary  – versioned fixed-layout little-endian record (32 bytes, v1):
+
+    offset  type     field
+    0       uint8    version (1)
+    1       uint8    flags (reserved, 0)
+    2       2 bytes  padding
+    4       uint64   hardware device id (e.g. ESP32 MAC)
+    12      uint32   sequence number
+    16      uint32   device timestamp (seconds since boot or epoch)
+    20      float32  co2 (ppm)
+    24      float32  temperature (°C)
+    28      float32  humidity (%RH)
+
+The format is chosen per topic (devices.payload_format); "auto" sniffs the
+first byte, since a JSON object always starts with '{' (0x7B) and binary
+payloads start with a small version number.
+"""
+
+import json
+import struct
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+FORMAT_AUTO = "auto"
+PAYLOAD_FORMATS = (FORMAT_JSON, FORMAT_BINARY, FORMAT_AUTO)
+
+BINARY_V1 = struct.Struct("<BBxxQIIfff")
+_BINARY_LAYOUTS = {1: BINARY_V1}
+
+
+class PayloadError(ValueError):
+    """Raised when a payload cannot be decoded in the negotiated format."""
+
+
+def decode_binary(payload: bytes) -> dict:
+    if not payload:
+        raise PayloadError("empty binary payload")
+    layout = _BINARY_LAYOUTS.get(payload[0])
+    if layout is None:
+        raise PayloadError(f"unsupported binary payload version {payload[0]}")
+    if len(payload) < layout.size:
+        raise PayloadError(f"binary payload too short ({len(payload)} < {layout.size} bytes)")
+    _, _, hw_id, seq, device_ts, co2, temp, humidity = layout.unpack_from(payload)
+    return {
+        "co2":       co2,
+        "temp":      temp,
+        "humidity":  humidity,
+        "hw_id":     hw_id,
+        "seq":       seq,
+        "ts":        device_ts,
+    }
+
+
+def encode_binary(co2, temp, humidity, hw_id=0, seq=0, device_ts=0) -> bytes:
+    """Pack a v1 binary payload (used by tooling and tests of the firmware format)."""
+    return BINARY_V1.pack(1, 0, hw_id, seq & 0xFFFFFFFF, device_ts & 0xFFFFFFFF,
+                          float(co2), float(temp), float(humidity))
+
+
+def decode_json(payload: bytes) -> dict:
+    try:
+        data = json.loads(payload)
+    except ValueError as exc:
+        raise PayloadError(f"invalid JSON payload: {exc}") from exc
+    if not isinstance(data, dict):
+        raise PayloadError("JSON payload is not an object")
+    return data
+
+
+def decode_payload(payload: bytes, payload_format: str = FORMAT_AUTO) -> dict:
+    """Decode a raw MQTT payload into a dict with co2 / temp / humidity keys."""
+    if payload_format == FORMAT_BINARY:
+        return decode_binary(payload)
+    if payload_format == FORMAT_JSON:
+        return decode_json(payload)
+    if payload[:1] in (b"{", b" ", b"\t", b"\r", b"\n"):
+        return decode_json(payload)
+    return decode_binary(payload)
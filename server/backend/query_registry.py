@@ -0,0 +1,179 @@
+"""
+Named, server-side prepared statements for the hot SQL paths.
+
+Modules declare each hot statement once at import:
+
+    THRESHOLDS = prepared_query("crop_thresholds_by_name", "SELECT ... WHERE crop_name = %s")
+    row = THRESHOLDS.fetchone(conn, (name,))
+
+and run it on a connection from db_connect.  The statement is prepared on
+first use per physical connection (MySQL keeps prepared statements per
+session) and the prepared cursor is cached by the pool, so later calls only
+send the parameters.  Cursors are fully drained on every call, so a cached
+cursor never holds unread rows.
+
+Multi-row INSERTs change text with their row count.  `multirow_query` splits
+rows into chunks of max_rows and then powers of two, so at most
+log2(max_rows) + 1 statements get prepared per connection.
+
+Every call is counted and timed per statement name (see `query_stats`, part
+of /api/metrics).  DB_PREPARED_STATEMENTS=0 runs the same statements as
+plain text queries, e.g. behind a proxy that does not support the binary
+protocol.
+"""
+
+import os
+import threading
+import time
+from db_pool import LatencyHistogram
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def prepared_enabled() -> bool:
+    return bool(int(os.environ.get("DB_PREPARED_STATEMENTS", "1")))
+
+
+class _QueryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.latency = LatencyHistogram()
+
+    def record(self, ms, rows, failed):
+        with self._lock:
+            self.calls += 1
+            self.rows += rows
+            if failed:
+                self.errors += 1
+            self.latency.observe(ms)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return dict(self.latency.as_dict(), calls=self.calls, errors=self.errors, rows=self.rows)
+
+
+class PreparedQuery:
+    """One named statement with %s placeholders."""
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.stats = _QueryStats()
+
+    def _run(self, conn, key, sql, params, many=False):
+        """Execute on the cached cursor and drain it. Returns (rows, rowcount)."""
+        started = time.perf_counter()
+        rows, rowcount, failed = [], 0, True
+        try:
+            if prepared_enabled():
+                cur = conn.prepared_cursor(key)
+            else:
+                cur = conn.cursor()
+            try:
+                if many:
+                    cur.executemany(sql, params)
+                else:
+                    cur.execute(sql, params)
+                if cur.description is not None:
+                    rows = cur.fetchall()
+                rowcount = cur.rowcount
+            except Exception:
+                if prepared_enabled():
+                    # The statement handle may be gone (reconnect, server restart)
+                    conn.forget_prepared()
+                raise
+            finally:
+                if not prepared_enabled():
+                    cur.close()
+            failed = False
+            return rows, rowcount
+        finally:
+            self.stats.record((time.perf_counter() - started) * 1000,
+                              len(rows) if rows else max(rowcount, 0), failed)
+
+    def fetchall(self, conn, params=()):
+        return self._run(conn, self.name, self.sql, params)[0]
+
+    def fetchone(self, conn, params=()):
+        rows = self._run(conn, self.name, self.sql, params)[0]
+        return rows[0] if rows else None
+
+    def execute(self, conn, params=()):
+        """Run a write; returns the affected row count."""
+        return self._run(conn, self.name, self.sql, params)[1]
+
+    def executemany(self, conn, seq_params):
+        return self._run(conn, self.name, self.sql, seq_params, many=True)[1]
+
+
+class MultiRowQuery(PreparedQuery):
+    """`head VALUES row, row, ... tail` executed in power-of-two sized chunks."""
+
+    def __init__(self, name, head, row_placeholder, tail="", max_rows=64):
+        super().__init__(name, f"{head} VALUES {row_placeholder}{tail}")
+        self.head = head
+        self.row_placeholder = row_placeholder
+        self.tail = tail
+        self.max_rows = max(1, int(max_rows))
+        # rows -> SQL text; the same str object is reused so the cursor's
+        # "already prepared" check holds
+        self._texts = {}
+
+    def _text(self, rows):
+        sql = self._texts.get(rows)
+        if sql is None:
+            sql = self._texts[rows] = (
+                f"{self.head} VALUES {', '.join([self.row_placeholder] * rows)}{self.tail}"
+            )
+        return sql
+
+    def _chunk_sizes(self, count):
+        sizes = [self.max_rows] * (count // self.max_rows)
+        rest = count % self.max_rows
+        size = 1 << (self.max_rows.bit_length() - 1)
+        while rest:
+            if size <= rest:
+                sizes.append(size)
+                rest -= size
+            size >>= 1
+        return sizes
+
+    def execute_rows(self, conn, rows):
+        """Insert a list of per-row parameter tuples; returns the summed row count."""
+        total = 0
+        start = 0
+        for size in self._chunk_sizes(len(rows)):
+            params = [value for row in rows[start:start + size] for value in row]
+            total += self._run(conn, f"{self.name}:{size}", self._text(size), params)[1]
+            start += size
+        return total
+
+
+def _register(query):
+    with _registry_lock:
+        if query.name in _registry:
+            raise ValueError(f"query {query.name!r} is already registered")
+        _registry[query.name] = query
+    return query
+
+
+def prepared_query(name, sql) -> PreparedQuery:
+    """Declare a hot statement (module level, once)."""
+    return _register(PreparedQuery(name, sql))
+
+
+def multirow_query(name, head, row_placeholder, tail="", max_rows=None) -> MultiRowQuery:
+    if max_rows is None:
+        max_rows = int(os.environ.get("DB_PREPARED_MAX_ROWS", 64))
+    return _register(MultiRowQuery(name, head, row_placeholder, tail, max_rows))
+
+
+def query_stats() -> dict:
+    """{name: {calls, errors, rows, latency...}} for every registered statement."""
+    with _registry_lock:
+        queries = list(_registry.values())
+    return {q.name: q.stats.as_dict() for q in queries}
@@ -0,0 +1,396 @@
+"""
+Monthly partitioning and retention for the append-only tables.
+
+sensor_readings, sensor_readings_wide and crop_alerts are RANGE-partitioned by
+month (pYYYYMM) with an empty p_future catch-all on top.  `run_retention`
+(scheduler job) keeps RETENTION_PREMAKE_MONTHS future partitions split off
+p_future and removes whole months once they are past retention, so old data
+leaves with an ALTER TABLE ... DROP PARTITION instead of a row-by-row DELETE:
+
+  sensor_readings, sensor_readings_wide
+      dropped after SENSOR_RAW_RETENTION_DAYS (default 90); hour/day rollups
+      (see rollups) are kept, so analytics still cover the full history, and
+      sensor_readings months are first exported to the columnar archive
+      (see archive) unless SENSOR_ARCHIVE_DIR is empty
+  crop_alerts
+      after ALERT_COMPACT_DAYS (default 30) a month is summarised into
+      crop_alert_daily (count / min / max per user, day, metric, severity and
+      crop) and then dropped
+
+A month is removed once its *end* is older than the retention window, so rows
+live between N days and N days + one month.
+
+InnoDB requires the partition column in every unique key and allows no
+foreign keys on partitioned tables; `partition_tables` (migration 007)
+widens the primary keys.  A table that still has foreign keys is only
+partitioned when MIGRATE_DROP_FOREIGN_KEYS=1 (`python migrations.py
+--drop-foreign-keys`): dropping them means the database no longer rejects
+rows for a missing user or cascades an account deletion, so orphans are
+cleaned up only by the purge below.  Without the flag the table is left
+unpartitioned and `run_retention` reports it.
+
+Account deletion deactivates the user, removes their devices (so their MQTT
+topics stop routing) and records a user_purge_jobs row (migration 009), all
+in one transaction.  `purge_user_data` then deletes the user's rows in small
+batches and deletes the users row last, so foreign keys that were kept
+(RESTRICT or CASCADE) never block the delete or turn it into one huge
+cascade.  The job row goes with the users row; `run_retention` resumes any
+job a restart or failure left behind.
+
+Command:
+    python retention.py            # one maintenance pass
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from db_connect import get_connection
+from archive import archive_dir, export_partition
+
+FUTURE_PARTITION = "p_future"
+
+
+# TO_SECONDS('1970-01-01'): DATETIME columns are partitioned by TO_SECONDS
+_TO_SECONDS_EPOCH = 62167219200
+
+
+class PartitionedTable:
+    """
+    How a table is partitioned. minute_bucket tables use RANGE(minute_bucket);
+    time columns use UNIX_TIMESTAMP (TIMESTAMP) or TO_SECONDS (DATETIME), the
+    partitioning functions MariaDB accepts for each type.
+    """
+
+    def __init__(self, name, column, retention_env, retention_default, compact=None, archive=None):
+        self.name = name
+        self.column = column
+        self.retention_env = retention_env
+        self.retention_default = retention_default
+        self.compact = compact
+        self.archive = archive
+
+    def bound(self, month, expression):
+        """Partition bound for the first instant of `month` (naive UTC datetime)."""
+        epoch = int(month.replace(tzinfo=timezone.utc).timestamp())
+        if self.column == "minute_bucket":
+            return epoch // 60
+        if expression.lower().startswith("to_seconds"):
+            return epoch + _TO_SECONDS_EPOCH
+        return epoch
+
+    def retention_days(self) -> int:
+        return int(os.environ.get(self.retention_env, self.retention_default))
+
+
+def _compact_alerts(cur, partition):
+    """Summarise one crop_alerts partition into crop_alert_daily (idempotent)."""
+    cur.execute(
+        f"""
+        INSERT INTO crop_alert_daily
+          (user_id, day, metric, severity, crop_type, crop_stage, alert_count, value_min, value_max)
+        SELECT user_id, DATE(created_at), metric, severity,
+               COALESCE(crop_type, ''), COALESCE(crop_stage, ''),
+               COUNT(*), MIN(value), MAX(value)
+        FROM crop_alerts PARTITION ({partition})
+        GROUP BY user_id, DATE(created_at), metric, severity, COALESCE(crop_type, ''), COALESCE(crop_stage, '')
+        ON DUPLICATE KEY UPDATE
+          alert_count = VALUES(alert_count),
+          value_min = VALUES(value_min),
+          value_max = VALUES(value_max)
+        """
+    )
+
+
+def _archive_readings(conn, partition):
+    """Export one sensor_readings partition before it is dropped."""
+    if archive_dir():
+        export_partition(conn, partition)
+
+
+PARTITIONED_TABLES = (
+    PartitionedTable("sensor_readings", "minute_bucket", "SENSOR_RAW_RETENTION_DAYS", 90,
+                     archive=_archive_readings),
+    PartitionedTable("sensor_readings_wide", "minute_bucket", "SENSOR_RAW_RETENTION_DAYS", 90),
+    PartitionedTable("crop_alerts", "created_at", "ALERT_COMPACT_DAYS", 30, compact=_compact_alerts),
+)
+
+
+# ── Month arithmetic ─────────────────────────────────────────────────────────
+def _month_start(dt):
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _partition_name(month):
+    return f"p{month:%Y%m}"
+
+
+def _partition_month(name):
+    return datetime.strptime(name[1:], "%Y%m")
+
+
+def _premake_months() -> int:
+    return int(os.environ.get("RETENTION_PREMAKE_MONTHS", 2))
+
+
+def _monthly_definitions(table, expression, first, last):
+    """PARTITION clauses for every month from `first` to `last` inclusive."""
+    defs = []
+    month = first
+    while month <= last:
+        bound = table.bound(_add_months(month, 1), expression)
+        defs.append(f"PARTITION {_partition_name(month)} VALUES LESS THAN ({bound})")
+        month = _add_months(month, 1)
+    return defs
+
+
+# ── Schema ───────────────────────────────────────────────────────────────────
+def _partitions(cur, table):
+    """Return ([partition names in order], partition expression); ([], None) if unpartitioned."""
+    cur.execute(
+        """
+        SELECT PARTITION_NAME, PARTITION_EXPRESSION FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        ORDER BY PARTITION_ORDINAL_POSITION
+        """,
+        (table.name,)
+    )
+    rows = cur.fetchall()
+    return [r[0] for r in rows], (rows[0][1].replace("`", "") if rows else None)
+
+
+def _partition_expression(cur, table):
+    if table.column == "minute_bucket":
+        return "minute_bucket"
+    cur.execute(
+        """
+        SELECT DATA_TYPE FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """,
+        (table.name, table.column)
+    )
+    data_type = cur.fetchone()[0].lower()
+    return f"UNIX_TIMESTAMP({table.column})" if data_type == "timestamp" else f"TO_SECONDS({table.column})"
+
+
+def drop_foreign_keys_allowed() -> bool:
+    return os.environ.get("MIGRATE_DROP_FOREIGN_KEYS", "0").lower() in ("1", "true", "yes")
+
+
+def partition_tables(cur):
+    """
+    Migration step: convert each table to monthly RANGE partitions covering its
+    existing data plus the premade future months. Already-partitioned tables
+    are left alone, so re-running is a no-op. Tables with foreign keys are
+    skipped unless drop_foreign_keys_allowed().
+    """
+    now_month = _month_start(datetime.now(timezone.utc))
+    for table in PARTITIONED_TABLES:
+        if _partitions(cur, table)[0]:
+            continue
+
+        cur.execute(
+            """
+            SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+            WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s
+            """,
+            (table.name,)
+        )
+        foreign_keys = [fk for (fk,) in cur.fetchall()]
+        if foreign_keys and not drop_foreign_keys_allowed():
+            print(f"[Retention] Not partitioning {table.name}: it has foreign key(s) "
+                  f"{', '.join(foreign_keys)}, which partitioning would drop. Re-run with "
+                  f"MIGRATE_DROP_FOREIGN_KEYS=1 to accept losing them.")
+            continue
+        for fk in foreign_keys:
+            print(f"[Retention] Dropping foreign key {fk} on {table.name} (not allowed on partitioned tables)")
+            cur.execute(f"ALTER TABLE {table.name} DROP FOREIGN KEY {fk}")
+
+        cur.execute(f"SELECT MIN({table.column}) FROM {table.name}")
+        oldest = cur.fetchone()[0]
+        if oldest is None:
+            first = now_month
+        elif table.column == "minute_bucket":
+            first = _month_start(datetime.fromtimestamp(oldest * 60, tz=timezone.utc))
+        else:
+            first = _month_start(oldest)
+
+        expression = _partition_expression(cur, table)
+        defs = _monthly_definitions(table, expression, first, _add_months(now_month, _premake_months()))
+        defs.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+        print(f"[Retention] Partitioning {table.name} into {len(defs)} partitions")
+        cur.execute(
+            f"ALTER TABLE {table.name} DROP PRIMARY KEY, ADD PRIMARY KEY (id, {table.column})"
+        )
+        cur.execute(
+            f"ALTER TABLE {table.name} PARTITION BY RANGE ({expression}) (\n  " + ",\n  ".join(defs) + "\n)"
+        )
+
+
+# ── Maintenance ──────────────────────────────────────────────────────────────
+def _ensure_future_partitions(cur, table, partitions, expression, now_month):
+    """Split upcoming months off p_future (instant while p_future is empty)."""
+    monthly = [p for p in partitions if p != FUTURE_PARTITION]
+    if not monthly:
+        return 0
+    first = _add_months(_partition_month(monthly[-1]), 1)
+    last = _add_months(now_month, _premake_months())
+    if first > last:
+        return 0
+    defs = _monthly_definitions(table, expression, first, last)
+    defs.append(f"PARTITION {FUTURE_PARTITION} VALUES LESS THAN MAXVALUE")
+    cur.execute(
+        f"ALTER TABLE {table.name} REORGANIZE PARTITION {FUTURE_PARTITION} INTO (\n  "
+        + ",\n  ".join(defs) + "\n)"
+    )
+    return len(defs) - 1
+
+
+def _drop_expired_partitions(conn, cur, table, partitions, now):
+    cutoff = now.timestamp() - table.retention_days() * 86400
+    dropped = []
+    for name in partitions:
+        if name == FUTURE_PARTITION:
+            continue
+        month_end = _add_months(_partition_month(name), 1).replace(tzinfo=timezone.utc)
+        if month_end.timestamp() > cutoff:
+            break
+        if table.archive is not None:
+            table.archive(conn, name)
+        if table.compact is not None:
+            table.compact(cur, name)
+        cur.execute(f"ALTER TABLE {table.name} DROP PARTITION {name}")
+        dropped.append(name)
+    return dropped
+
+
+def run_retention():
+    """Scheduler job: premake future partitions, drop expired months, resume purges."""
+    now = datetime.now(timezone.utc)
+    now_month = _month_start(now)
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        for table in PARTITIONED_TABLES:
+            partitions, expression = _partitions(cur, table)
+            if not partitions:
+                print(f"[Retention] {table.name} is not partitioned; run migrations.py")
+                continue
+            added = _ensure_future_partitions(cur, table, partitions, expression, now_month)
+            dropped = _drop_expired_partitions(conn, cur, table, partitions, now)
+            conn.commit()
+            if added or dropped:
+                print(f"[Retention] {table.name}: {added} partition(s) added, "
+                      f"dropped {', '.join(dropped) if dropped else 'none'}")
+        cur.close()
+    except Exception as exc:
+        print(f"[Retention] Maintenance failed: {exc}")
+    finally:
+        if conn:
+            conn.close()
+    resume_user_purges()
+
+
+# ── Account deletion ─────────────────────────────────────────────────────────
+# devices first, so a resumed purge stops the user's topics before anything else
+_USER_DATA_TABLES = ("devices", "sensor_readings", "sensor_readings_wide", "sensor_rollups",
+                     "crop_alerts", "crop_alert_daily")
+
+
+_purges_running = set()
+_purges_lock = threading.Lock()
+
+
+def begin_user_deletion(cur, user_id):
+    """
+    First, in-request step of account deletion (the caller commits, then calls
+    purge_user_data_async): block logins, drop the user's devices and record
+    the purge job. Returns the number of devices removed.
+    """
+    cur.execute("UPDATE users SET status = 'inactive' WHERE id = %s", (user_id,))
+    cur.execute("DELETE FROM devices WHERE user_id = %s", (user_id,))
+    devices = cur.rowcount
+    cur.execute("INSERT IGNORE INTO user_purge_jobs (user_id) VALUES (%s)", (user_id,))
+    return devices
+
+
+def _reload_routes():
+    # Imported here: mqtt_service pulls in paho and starts nothing until asked
+    from mqtt_service import reload_topic_routes
+    reload_topic_routes()
+
+
+def purge_user_data(user_id, batch=5000, pause_ms=20):
+    """
+    Delete a user's rows in short batches, one commit each, so account deletion
+    never holds long locks on the hot ingest tables. Once every table is done
+    the users row and the user_purge_jobs row are deleted together; a failed
+    or interrupted purge keeps both.
+    """
+    with _purges_lock:
+        if user_id in _purges_running:
+            return
+        _purges_running.add(user_id)
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        for table in _USER_DATA_TABLES:
+            removed = 0
+            while True:
+                cur.execute(f"DELETE FROM {table} WHERE user_id = %s LIMIT %s", (user_id, batch))
+                conn.commit()
+                removed += cur.rowcount
+                if cur.rowcount < batch:
+                    break
+                if pause_ms:
+                    time.sleep(pause_ms / 1000.0)
+            if removed:
+                print(f"[Retention] Purged {removed} {table} row(s) of user {user_id}")
+                if table == "devices":
+                    _reload_routes()
+        cur.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        cur.execute("DELETE FROM user_purge_jobs WHERE user_id = %s", (user_id,))
+        conn.commit()
+        cur.close()
+    except Exception as exc:
+        print(f"[Retention] Purge of user {user_id} failed (resumed by the next run_retention): {exc}")
+    finally:
+        with _purges_lock:
+            _purges_running.discard(user_id)
+        if conn:
+            conn.close()
+
+
+def purge_user_data_async(user_id):
+    threading.Thread(target=purge_user_data, args=(user_id,), name=f"purge-user-{user_id}", daemon=True).start()
+
+
+def resume_user_purges():
+    """Finish purges left in user_purge_jobs by a restart or an earlier failure."""
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("SELECT user_id FROM user_purge_jobs ORDER BY requested_at")
+        pending = [row[0] for row in cur.fetchall()]
+        cur.close()
+    except Exception as exc:
+        print(f"[Retention] Could not read pending purges: {exc}")
+        return
+    finally:
+        if conn:
+            conn.close()
+    for user_id in pending:
+        print(f"[Retention] Resuming purge of user {user_id}")
+        purge_user_data(user_id)
+
+
+if __name__ == "__main__":
+    run_retention()
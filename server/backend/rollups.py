@@ -0,0 +1,282 @@
+"""
+Hour / day rollups of sensor_readings for the analytics endpoints.
+
+sensor_rollups keeps count / sum / min / max per (user, device, metric) for
+every hour and day bucket.  Minute resolution needs no table of its own:
+sensor_readings already holds one row per device/metric/minute window with
+the same statistics.
+
+  incremental – the batch writer adds each flushed window to its hour and day
+                buckets in the same transaction as the raw insert
+  catch-up    – `catch_up_rollups` recomputes recent buckets from
+                sensor_readings (scheduler job, bulk uploads, manual rebuild),
+                repairing anything the incremental path missed
+
+Buckets are derived from minute_bucket, so they are UTC like the pool session.
+
+Rollups only exist from the moment they were switched on (migration 008
+records that hour in sensor_rollup_state.covered_from) or from the oldest day
+a `rebuild` reached.  Readers call `rollups_cover(cur, since)` and use raw
+sensor_readings for ranges starting before that, so history does not vanish
+from analytics between deploy and a manual rebuild.  If SENSOR_ROLLUPS was
+off for a while, run a rebuild over that period.
+
+Command:
+    python rollups.py rebuild [--days 30]
+"""
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from db_connect import get_connection
+from batch_writer import minute_bucket
+
+RESOLUTION_HOUR = "hour"
+RESOLUTION_DAY = "day"
+# Bucket width in minutes, coarsest first
+_RESOLUTION_MINUTES = {RESOLUTION_DAY: 1440, RESOLUTION_HOUR: 60}
+
+_ROLLUP_COLUMNS = ("(user_id, device_id, sensor_type, resolution, bucket_start, "
+                   "row_count, sample_count, value_sum, value_min, value_max)")
+_ROLLUP_PLACEHOLDER = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
+_ADD_CLAUSE = """
+    ON DUPLICATE KEY UPDATE
+      row_count = row_count + VALUES(row_count),
+      sample_count = sample_count + VALUES(sample_count),
+      value_sum = value_sum + VALUES(value_sum),
+      value_min = LEAST(value_min, VALUES(value_min)),
+      value_max = GREATEST(value_max, VALUES(value_max))
+"""
+_REPLACE_CLAUSE = """
+    ON DUPLICATE KEY UPDATE
+      row_count = VALUES(row_count),
+      sample_count = VALUES(sample_count),
+      value_sum = VALUES(value_sum),
+      value_min = VALUES(value_min),
+      value_max = VALUES(value_max)
+"""
+
+
+def rollups_enabled() -> bool:
+    return bool(int(os.environ.get("SENSOR_ROLLUPS", "1")))
+
+
+_COVERAGE_TTL_SEC = 60.0
+_coverage = {"covered_from": None, "checked": 0.0}
+_coverage_lock = threading.Lock()
+
+
+def _covered_from(cur):
+    """sensor_rollup_state.covered_from (naive UTC), cached for a minute. None if unknown."""
+    now = time.monotonic()
+    with _coverage_lock:
+        if now - _coverage["checked"] < _COVERAGE_TTL_SEC:
+            return _coverage["covered_from"]
+    try:
+        cur.execute("SELECT covered_from FROM sensor_rollup_state WHERE id = 1")
+        row = cur.fetchone()
+        covered_from = row[0] if row else None
+    except Exception as exc:
+        print(f"[Rollups] Coverage lookup failed: {exc}")
+        covered_from = None
+    with _coverage_lock:
+        _coverage.update(covered_from=covered_from, checked=now)
+    return covered_from
+
+
+def rollups_cover(cur, since) -> bool:
+    """True if rollups are complete for every bucket from `since` (naive UTC) on."""
+    covered_from = _covered_from(cur)
+    return covered_from is not None and since >= covered_from
+
+
+def _extend_coverage(cur, since):
+    cur.execute(
+        """
+        INSERT INTO sensor_rollup_state (id, covered_from) VALUES (1, %s)
+        ON DUPLICATE KEY UPDATE covered_from = LEAST(covered_from, VALUES(covered_from))
+        """,
+        (since,)
+    )
+    with _coverage_lock:
+        _coverage["checked"] = 0.0
+
+
+def pick_resolution(since, step_sec):
+    """
+    Coarsest rollup whose buckets line up with a query starting at `since`
+    (naive UTC) in steps of `step_sec`. None means only raw rows will do.
+    """
+    for resolution, minutes in _RESOLUTION_MINUTES.items():
+        width = minutes * 60
+        if step_sec % width == 0 and minute_bucket(since) % minutes == 0:
+            return resolution
+    return None
+
+
+def _bucket_start(bucket, minutes):
+    return datetime.fromtimestamp((bucket // minutes) * minutes * 60, tz=timezone.utc).replace(tzinfo=None)
+
+
+def build_rollup_upsert(batch):
+    """
+    Fold batch_writer items (user_id, device_id, ts, metrics) into hour and day
+    buckets and build one additive upsert. Returns (sql, params); sql is None for
+    an empty batch.
+    """
+    buckets = {}
+    for user_id, device_id, ts, metrics in batch:
+        bucket = minute_bucket(ts)
+        for resolution, minutes in _RESOLUTION_MINUTES.items():
+            start = _bucket_start(bucket, minutes)
+            for sensor_type, value, vmin, vmax, _, count in metrics:
+                key = (user_id, device_id, sensor_type, resolution, start)
+                acc = buckets.get(key)
+                if acc is None:
+                    buckets[key] = [1, count, value * count, vmin, vmax]
+                else:
+                    acc[0] += 1
+                    acc[1] += count
+                    acc[2] += value * count
+                    acc[3] = min(acc[3], vmin)
+                    acc[4] = max(acc[4], vmax)
+    if not buckets:
+        return None, []
+    params = []
+    for key, acc in buckets.items():
+        params.extend(key)
+        params.extend(acc)
+    placeholders = ", ".join([_ROLLUP_PLACEHOLDER] * len(buckets))
+    return f"INSERT INTO sensor_rollups {_ROLLUP_COLUMNS} VALUES {placeholders}{_ADD_CLAUSE}", params
+
+
+def recompute_rollups(cur, since, until=None, user_id=None, user_ids=None):
+    """
+    Recompute every hour and day bucket overlapping [since, until) from
+    sensor_readings, for one user, a set of users or everyone. Idempotent;
+    the caller commits.
+    """
+    first = minute_bucket(since)
+    last = minute_bucket(until) if until is not None else None
+    for resolution, minutes in _RESOLUTION_MINUTES.items():
+        lo = (first // minutes) * minutes
+        where = ["minute_bucket >= %s"]
+        params = [lo]
+        if last is not None:
+            where.append("minute_bucket < %s")
+            params.append(((last // minutes) + 1) * minutes)
+        if user_id is not None:
+            where.append("user_id = %s")
+            params.append(user_id)
+        if user_ids:
+            where.append(f"user_id IN ({', '.join(['%s'] * len(user_ids))})")
+            params.extend(user_ids)
+        cur.execute(
+            f"""
+            INSERT INTO sensor_rollups {_ROLLUP_COLUMNS}
+            SELECT user_id, device_id, sensor_type, '{resolution}',
+                   FROM_UNIXTIME((minute_bucket DIV {minutes}) * {minutes * 60}) AS bucket_start,
+                   COUNT(*), SUM(sample_count), SUM(value * sample_count),
+                   MIN(COALESCE(value_min, value)), MAX(COALESCE(value_max, value))
+            FROM sensor_readings
+            WHERE {" AND ".join(where)}
+            GROUP BY user_id, device_id, sensor_type, bucket_start
+            {_REPLACE_CLAUSE}
+            """,
+            params
+        )
+
+
+def catch_up_rollups(hours=None):
+    """Scheduler job: recompute the buckets of the last SENSOR_ROLLUP_CATCHUP_HOURS."""
+    if not rollups_enabled():
+        return
+    if hours is None:
+        hours = int(os.environ.get("SENSOR_ROLLUP_CATCHUP_HOURS", 2))
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=hours)
+    conn = None
+    try:
+        conn = get_connection()
+        cur = conn.cursor()
+        recompute_rollups(cur, since)
+        conn.commit()
+        cur.close()
+    except Exception as exc:
+        print(f"[Rollups] Catch-up failed: {exc}")
+        if conn:
+            conn.rollback()
+    finally:
+        if conn:
+            conn.close()
+
+
+def rebuild(days=None, pause_ms=50):
+    """Recompute rollups one day per transaction, newest day first."""
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT MIN(timestamp_utc) FROM sensor_readings")
+        oldest = cur.fetchone()[0]
+        if oldest is None:
+            print("[Rollups] sensor_readings is empty")
+            return
+        day = datetime.now(timezone.utc).replace(tzinfo=None, hour=0, minute=0, second=0, microsecond=0)
+        stop = oldest if days is None else max(oldest, day - timedelta(days=days - 1))
+        while day + timedelta(days=1) > stop:
+            recompute_rollups(cur, day, day + timedelta(hours=23, minutes=59))
+            # Days are rebuilt newest first, so everything from `day` on is complete
+            _extend_coverage(cur, day)
+            conn.commit()
+            print(f"[Rollups] Rebuilt {day:%Y-%m-%d}")
+            day -= timedelta(days=1)
+            if pause_ms:
+                time.sleep(pause_ms / 1000.0)
+        cur.close()
+    finally:
+        conn.close()
+
+
+# ── Read helpers ────────────────────────────────────────────────────────────
+def fetch_metric_averages(cur, user_id, resolution, since):
+    """Per-bucket means as (bucket_start, temp, humidity, co2), oldest first."""
+    cur.execute(
+        """
+        SELECT bucket_start,
+               SUM(CASE WHEN sensor_type = 'temperature' THEN value_sum END)
+                 / SUM(CASE WHEN sensor_type = 'temperature' THEN sample_count END),
+               SUM(CASE WHEN sensor_type = 'humidity' THEN value_sum END)
+                 / SUM(CASE WHEN sensor_type = 'humidity' THEN sample_count END),
+               SUM(CASE WHEN sensor_type = 'co2' THEN value_sum END)
+                 / SUM(CASE WHEN sensor_type = 'co2' THEN sample_count END)
+        FROM sensor_rollups
+        WHERE user_id = %s AND resolution = %s AND bucket_start >= %s
+        GROUP BY bucket_start
+        ORDER BY bucket_start ASC
+        """,
+        (user_id, resolution, since)
+    )
+    return cur.fetchall()
+
+
+def fetch_row_count(cur, user_id, since):
+    """Stored sensor_readings rows since `since`, counted from hour rollups."""
+    cur.execute(
+        """
+        SELECT COALESCE(SUM(row_count), 0) FROM sensor_rollups
+        WHERE user_id = %s AND resolution = 'hour' AND bucket_start >= %s
+        """,
+        (user_id, since)
+    )
+    return int(cur.fetchone()[0])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sensor_rollups maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rb = sub.add_parser("rebuild", help="recompute rollups from sensor_readings")
+    p_rb.add_argument("--days", type=int, default=None, help="only the most recent N days (default: all)")
+    p_rb.add_argument("--pause-ms", type=int, default=50, help="sleep between days")
+    args = parser.parse_args()
+    rebuild(args.days, args.pause_ms)
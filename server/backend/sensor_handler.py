@@ -1,8 +1,18 @@
+import csv
+import io
+import itertools
+import json
+import os
 import re
 import traceback
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 from flask import Blueprint, request, jsonify, session
-from db_connect import get_connection
+from db_connect import get_connection, PRIORITY_INGEST
+from batch_writer import build_insert, window_item, ON_DUPLICATE_IGNORE
+from window_aggregator import WindowAggregator, get_window_aggregator, window_sec
+from snapshot_store import DEFAULT_DEVICE_ID
+from sensor_wide import build_wide_insert, dual_write_enabled
+from rollups import recompute_rollups, rollups_enabled
 
 sensor_bp = Blueprint("sensor_bp", __name__)
 
@@ -63,72 +73,231 @@ def ingest_sensor_data():
         except ValueError:
             return jsonify({"message": "Invalid numeric values detected."}), 400
 
-    conn = get_connection()
     try:
-        cur = conn.cursor()
-
-        # 3. Duplicate Check (1-minute window)
-        # Check the most recent reading for this user
-        cur.execute(
-            "SELECT timestamp_utc FROM sensor_readings WHERE user_id = %s ORDER BY timestamp_utc DESC LIMIT 1",
-            (user_id,)
-        )
-        row = cur.fetchone()
-        
-        if row:
-            last_time = row[0]
-            # Ensure last_time is timezone-aware UTC for comparison
-            if last_time.tzinfo is None:
-                last_time = last_time.replace(tzinfo=timezone.utc)
-            
-            now_utc = datetime.now(timezone.utc)
-            
-            # Print for debugging
-            diff = (now_utc - last_time).total_seconds()
-            print(f"[SensorHandler] User: {user_id}, Last: {last_time}, Now: {now_utc}, Diff: {diff}")
-
-            # If last reading is in the future (skew) or strictly within the last 55s
-            # We allow if diff < 0 (Future) to let the system self-heal, assuming the previous timestamp was wrong/skewed.
-            # OR we block? If we block, they are locked out until time catches up.
-            # Better approach: If diff is massive (e.g. > 1 hour) maybe error? 
-            # For robustness: If it's just 'too frequent' (0 < diff < 55), block.
-            # if diff < 0, we'll log warning but ALLOW it to reset the timeline to 'now'.
-            
-            if 0 <= diff < 55:
-                print("[SensorHandler] Duplicate/Too Frequent - Ignored")
-                return jsonify({"message": "Duplicate/Too frequent submission ignored."}), 429
-            
-            if diff < 0:
-                print("[SensorHandler] Warning: Last timestamp was in the future. Allowing insert to correct skew.")
-
-        # 4. Insert Data
-        # Use Python timestamp to ensure consistency with the check above
-        now_val = datetime.now(timezone.utc)
-        
-        query = """
-            INSERT INTO sensor_readings (user_id, sensor_type, value, timestamp_utc)
-            VALUES 
-            (%s, 'co2', %s, %s),
-            (%s, 'temperature', %s, %s),
-            (%s, 'humidity', %s, %s)
-        """
-        params = (
-            user_id, co2_val, now_val,
-            user_id, temp_val, now_val,
-            user_id, hum_val, now_val
-        )
-        
-        cur.execute(query, params)
-        conn.commit()
-        print("[SensorHandler] Data Inserted Successfully")
-        cur.close()
+        # 3. Fold into the device's 1-minute window. Readings inside the window are
+        # aggregated (mean/min/max/last/count) rather than rejected as duplicates;
+        # the aggregator hands one row per metric per minute to the batch writer.
+        device_id = data.get("device_id") or DEFAULT_DEVICE_ID
+        get_window_aggregator().add(user_id, device_id, co2_val, temp_val, hum_val)
+        print("[SensorHandler] Data Queued Successfully")
 
         return jsonify({"message": "Data ingested successfully."}), 201
 
     except Exception:
-        conn.rollback()
         with open("server_error.log", "a") as f:
             traceback.print_exc(file=f)
         return jsonify({"message": "Internal server error."}), 500
-    finally:
-        conn.close()
+
+
+# ── Bulk ingest ─────────────────────────────────────────────────────────────
+# Gateways coming back online upload their buffered readings in one request.
+# Accepted bodies (one reading per line, each with its device timestamp):
+#   NDJSON : {"ts": "2024-05-01T10:00:00Z", "co2": 410, "temp": 22.1, "humidity": 61, "device_id": "gw1"}
+#   CSV    : header row with ts,co2,temp,humidity[,device_id]
+#   lines  : "<ts> CO2: <ppm>, T: <°C>, H: <%>"
+# Readings are folded into the same 1-minute windows as live data and written in
+# chunked multi-row INSERT IGNOREs; the (user, device, sensor_type, minute_bucket)
+# unique key makes a re-upload of the same batch a no-op without any reads.
+
+BULK_LINE_PATTERN = re.compile(
+    r"^\s*(?P<ts>[^\s,;]+)\s*[,;]?\s*CO2:\s*(?P<co2>-?[\d.]+),\s*T:\s*(?P<temp>-?[\d.]+),\s*H:\s*(?P<hum>-?[\d.]+)",
+    re.IGNORECASE,
+)
+BULK_MAX_LINES = int(os.environ.get("SENSOR_BULK_MAX_LINES", 50000))
+BULK_CHUNK_READINGS = int(os.environ.get("SENSOR_BULK_CHUNK", 500))
+BULK_MAX_AGE = timedelta(days=int(os.environ.get("SENSOR_BULK_MAX_AGE_DAYS", 30)))
+BULK_MAX_SKEW = timedelta(minutes=5)
+BULK_MAX_REJECTS_REPORTED = 100
+
+_MAX_EPOCH = 253402300800   # 10000-01-01T00:00:00Z
+
+# Physical ranges of the deployed sensors (MTP80-A CO2, SCD41 temp/humidity)
+_VALID_RANGES = {"co2": (0, 10000), "temp": (-40, 85), "humidity": (0, 100)}
+
+
+def _parse_timestamp(raw):
+    """Epoch seconds / milliseconds or ISO-8601 → aware UTC datetime."""
+    if isinstance(raw, (int, float)) or (isinstance(raw, str) and re.fullmatch(r"\d+(\.\d+)?", raw.strip())):
+        epoch = float(raw)
+        if epoch > 1e12:
+            epoch /= 1000.0
+        # fromtimestamp raises OverflowError / OSError outside the platform range
+        if not 0 <= epoch < _MAX_EPOCH:
+            raise ValueError(f"timestamp out of range: {raw}")
+        return datetime.fromtimestamp(epoch, tz=timezone.utc)
+    if not isinstance(raw, str) or not raw.strip():
+        raise ValueError("missing timestamp")
+    ts = datetime.fromisoformat(raw.strip().replace("Z", "+00:00"))
+    return ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts.astimezone(timezone.utc)
+
+
+def _reading_from_fields(ts, co2, temp, humidity, device_id):
+    return {
+        "ts":        _parse_timestamp(ts),
+        "co2":       float(co2),
+        "temp":      float(temp),
+        "humidity":  float(humidity),
+        "device_id": (str(device_id).strip() if device_id else "") or DEFAULT_DEVICE_ID,
+    }
+
+
+def _parse_ndjson_line(line, _header):
+    obj = json.loads(line)
+    if not isinstance(obj, dict):
+        raise ValueError("line is not a JSON object")
+    temp = obj.get("temp", obj.get("temperature"))
+    hum = obj.get("humidity", obj.get("hum"))
+    if obj.get("co2") is None or temp is None or hum is None:
+        raise ValueError("co2, temp and humidity are required")
+    return _reading_from_fields(obj.get("ts", obj.get("timestamp")), obj["co2"], temp, hum, obj.get("device_id"))
+
+
+def _parse_csv_line(line, header):
+    row = dict(zip(header, next(csv.reader([line]))))
+    temp = row.get("temp") or row.get("temperature")
+    hum = row.get("humidity") or row.get("hum")
+    if not row.get("co2") or not temp or not hum:
+        raise ValueError("co2, temp and humidity are required")
+    return _reading_from_fields(row.get("ts") or row.get("timestamp"), row["co2"], temp, hum, row.get("device_id"))
+
+
+def _parse_text_line(line, _header):
+    match = BULK_LINE_PATTERN.match(line)
+    if not match:
+        raise ValueError("expected '<ts> CO2: <val>, T: <val>, H: <val>'")
+    return _reading_from_fields(match.group("ts"), match.group("co2"), match.group("temp"),
+                                match.group("hum"), None)
+
+
+def _detect_bulk_format(content_type, first_line):
+    fmt = (request.args.get("format") or "").lower()
+    if fmt in ("ndjson", "csv", "lines"):
+        return fmt
+    content_type = (content_type or "").lower()
+    if "ndjson" in content_type or "jsonl" in content_type:
+        return "ndjson"
+    if "csv" in content_type:
+        return "csv"
+    if first_line.lstrip().startswith("{"):
+        return "ndjson"
+    if "co2:" in first_line.lower():
+        return "lines"
+    return "csv"
+
+
+def _validate_reading(reading, now):
+    for key, (lo, hi) in _VALID_RANGES.items():
+        if not (lo <= reading[key] <= hi):
+            raise ValueError(f"{key} {reading[key]} outside {lo}–{hi}")
+    if reading["ts"] > now + BULK_MAX_SKEW:
+        raise ValueError("timestamp is in the future")
+    if reading["ts"] < now - BULK_MAX_AGE:
+        raise ValueError(f"timestamp older than {BULK_MAX_AGE.days} days")
+
+
+@sensor_bp.post("/api/sensors/ingest/bulk")
+def ingest_sensor_bulk():
+    """
+    Bulk-ingest buffered readings (NDJSON, CSV or 'CO2: x, T: y, H: z' lines).
+    Bad lines are reported individually and never fail the whole batch.
+    """
+    user_id = session.get("user_id")
+    if not user_id:
+        print("[SensorHandler] Unauthorized bulk upload attempt (No Session)")
+        return jsonify({"message": "Unauthorized"}), 401
+
+    stream = io.TextIOWrapper(request.stream, encoding="utf-8", errors="replace")
+    # (physical line number, stripped text) of every non-blank line
+    lines = ((no, line.strip()) for no, line in enumerate(stream, start=1) if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return jsonify({"message": "Empty upload."}), 400
+    _, first_line = first
+
+    fmt = _detect_bulk_format(request.content_type, first_line)
+    parse = {"ndjson": _parse_ndjson_line, "csv": _parse_csv_line, "lines": _parse_text_line}[fmt]
+    header = None
+    pending = itertools.chain([first], lines)
+    if fmt == "csv":
+        header = [h.strip().lower() for h in next(csv.reader([first_line]))]
+        if "co2" not in header:
+            return jsonify({"message": "CSV upload needs a header row with ts,co2,temp,humidity."}), 400
+        next(pending)   # header consumed
+
+    # 1. Streaming parse + validation; rejects are collected per line
+    now = datetime.now(timezone.utc)
+    readings = []
+    rejected = []
+    rejected_count = 0
+    for line_no, line in pending:
+        if len(readings) + rejected_count >= BULK_MAX_LINES:
+            return jsonify({"message": f"Upload exceeds {BULK_MAX_LINES} lines."}), 413
+        try:
+            reading = parse(line, header)
+            _validate_reading(reading, now)
+            readings.append(reading)
+        except (ValueError, TypeError, KeyError, StopIteration, OverflowError, OSError) as exc:
+            rejected_count += 1
+            if len(rejected) < BULK_MAX_REJECTS_REPORTED:
+                rejected.append({"line": line_no, "error": str(exc)})
+
+    # 2. Fold into 1-minute windows per device (same shape as the live path)
+    windows = []
+    aggregator = WindowAggregator(windows.append, window_sec=window_sec())
+    for r in sorted(readings, key=lambda r: (r["device_id"], r["ts"])):
+        aggregator.add(user_id, r["device_id"], r["co2"], r["temp"], r["humidity"], epoch=r["ts"].timestamp())
+    aggregator.flush_all()
+
+    inserted = 0
+    ignored = 0
+    if windows:
+        conn = get_connection(PRIORITY_INGEST)
+        try:
+            cur = conn.cursor()
+            items = [window_item(w) for w in windows]
+            # 3. Chunked multi-row INSERT IGNOREs, one commit per chunk. Windows already
+            # stored hit the unique key and are skipped; IGNORE also drops rows for
+            # other errors and does not say which, so all of them count as ignored.
+            dual_write = dual_write_enabled()
+            for i in range(0, len(items), BULK_CHUNK_READINGS):
+                chunk = items[i:i + BULK_CHUNK_READINGS]
+                sql, params, rows = build_insert(chunk, ON_DUPLICATE_IGNORE)
+                cur.execute(sql, params)
+                inserted += cur.rowcount
+                ignored += rows - cur.rowcount
+                if dual_write:
+                    wide_sql, wide_params, _ = build_wide_insert(chunk, ON_DUPLICATE_IGNORE)
+                    if wide_sql:
+                        cur.execute(wide_sql, wide_params)
+                conn.commit()
+            # INSERT IGNORE hides which windows were new, so rebuild the touched
+            # rollup buckets from the stored rows instead of adding incrementally
+            if inserted and rollups_enabled():
+                first = min(item[2] for item in items).replace(tzinfo=None)
+                last = max(item[2] for item in items).replace(tzinfo=None)
+                recompute_rollups(cur, first, last, user_id=user_id)
+                conn.commit()
+            cur.close()
+        except Exception:
+            conn.rollback()
+            with open("server_error.log", "a") as f:
+                traceback.print_exc(file=f)
+            return jsonify({
+                "message": "Internal server error.",
+                "rows_inserted": inserted,
+            }), 500
+        finally:
+            conn.close()
+
+    print(f"[SensorHandler] Bulk upload ({fmt}) user {user_id}: {len(readings)} accepted, "
+          f"{rejected_count} rejected, {inserted} rows inserted, {ignored} rows ignored")
+    return jsonify({
+        "message": "Bulk upload processed.",
+        "format": fmt,
+        "accepted": len(readings),
+        "rejected_count": rejected_count,
+        "rejected": rejected,
+        "windows": len(windows),
+        "rows_inserted": inserted,
+        "rows_ignored": ignored,
+    }), 200
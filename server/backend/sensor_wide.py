@@ -0,0 +1,184 @@
+"""
+Wide-row sensor storage: one row per (user, device, minute) with co2 / temp /
+humidity columns, instead of three EAV rows in sensor_readings.
+
+Rollout (table created by migration 005_sensor_readings_wide):
+  1. SENSOR_WIDE_DUAL_WRITE=1   – both ingest paths also write the wide table
+                                  in the same transaction as sensor_readings
+  2. python sensor_wide.py backfill
+                                – online, chunked copy of existing EAV rows
+  3. SENSOR_READ_WIDE=1         – history / reports / trends read the wide
+                                  table without any pivot
+
+Only whole windows (all three metrics) are dual-written.  Series compression
+(SENSOR_COMPRESSION) stores metrics independently, so while it is enabled the
+read endpoints stay on sensor_readings and rebuild the series from there.
+
+Command:
+    python sensor_wide.py backfill [--chunk 5000] [--pause-ms 50]
+"""
+
+import argparse
+import os
+import time
+from db_connect import get_connection
+from batch_writer import minute_bucket, ON_DUPLICATE_MERGE, ON_DUPLICATE_IGNORE
+
+_WIDE_COLUMNS = ("(user_id, device_id, timestamp_utc, minute_bucket, sample_count, "
+                 "co2, co2_min, co2_max, temp, temp_min, temp_max, humidity, humidity_min, humidity_max)")
+_WIDE_PLACEHOLDER = "(" + ", ".join(["%s"] * 14) + ")"
+# sensor_type in sensor_readings → column prefix in sensor_readings_wide
+_WIDE_PREFIX = {"co2": "co2", "temperature": "temp", "humidity": "humidity"}
+
+
+def dual_write_enabled() -> bool:
+    return bool(int(os.environ.get("SENSOR_WIDE_DUAL_WRITE", "0")))
+
+
+def read_wide_enabled() -> bool:
+    from series_compression import compression_mode, MODE_OFF
+    return bool(int(os.environ.get("SENSOR_READ_WIDE", "0"))) and compression_mode() == MODE_OFF
+
+
+def _weighted(col):
+    # Count-weighted merge of a window split across a restart. sample_count is
+    # assigned last in the UPDATE list, so it still holds the stored count here.
+    return (f"{col} = (COALESCE({col}, VALUES({col})) * sample_count + VALUES({col}) * VALUES(sample_count))"
+            f" / (sample_count + VALUES(sample_count))")
+
+
+_WIDE_MERGE_CLAUSE = "\n    ON DUPLICATE KEY UPDATE\n      " + ",\n      ".join(
+    [_weighted(p) for p in ("co2", "temp", "humidity")]
+    + [f"{p}_min = LEAST(COALESCE({p}_min, VALUES({p}_min)), VALUES({p}_min))" for p in ("co2", "temp", "humidity")]
+    + [f"{p}_max = GREATEST(COALESCE({p}_max, VALUES({p}_max)), VALUES({p}_max))" for p in ("co2", "temp", "humidity")]
+    + ["sample_count = sample_count + VALUES(sample_count)"]
+)
+
+
+def build_wide_insert(batch, on_duplicate=ON_DUPLICATE_MERGE):
+    """
+    Build a multi-row insert into sensor_readings_wide from batch_writer items
+    (user_id, device_id, ts, metrics). Items without all three metrics are skipped.
+    Returns (sql, params, row_count); sql is None when nothing qualifies.
+    """
+    params = []
+    rows = 0
+    for user_id, device_id, ts, metrics in batch:
+        by_prefix = {_WIDE_PREFIX[m[0]]: m for m in metrics}
+        if len(by_prefix) != 3:
+            continue
+        count = by_prefix["co2"][5]
+        params.extend((user_id, device_id, ts, minute_bucket(ts), count))
+        for prefix in ("co2", "temp", "humidity"):
+            _, value, vmin, vmax, _, _ = by_prefix[prefix]
+            params.extend((value, vmin, vmax))
+        rows += 1
+    if not rows:
+        return None, [], 0
+    placeholders = ", ".join([_WIDE_PLACEHOLDER] * rows)
+    if on_duplicate == ON_DUPLICATE_IGNORE:
+        return f"INSERT IGNORE INTO sensor_readings_wide {_WIDE_COLUMNS} VALUES {placeholders}", params, rows
+    return f"INSERT INTO sensor_readings_wide {_WIDE_COLUMNS} VALUES {placeholders}{_WIDE_MERGE_CLAUSE}", params, rows
+
+
+# ── Read path (no pivot) ────────────────────────────────────────────────────
+def fetch_latest_wide(cur, user_id, limit):
+    """
+    Latest `limit` timestamps for a user, oldest first, as (timestamp, co2, temp, humidity).
+    Devices reporting in the same minute are averaged, matching the old per-timestamp pivot.
+    """
+    cur.execute(
+        """
+        SELECT timestamp_utc, AVG(co2), AVG(temp), AVG(humidity)
+        FROM sensor_readings_wide
+        WHERE user_id = %s
+        GROUP BY timestamp_utc
+        ORDER BY timestamp_utc DESC
+        LIMIT %s
+        """,
+        (user_id, limit)
+    )
+    return list(reversed(cur.fetchall()))
+
+
+def fetch_hourly_wide(cur, user_id):
+    """Hourly averages for the last 24h as (hour, temp, humidity, co2)."""
+    cur.execute(
+        """
+        SELECT HOUR(timestamp_utc) AS hr, AVG(temp), AVG(humidity), AVG(co2)
+        FROM sensor_readings_wide
+        WHERE user_id = %s AND timestamp_utc >= NOW() - INTERVAL 1 DAY
+        GROUP BY hr
+        ORDER BY hr ASC
+        """,
+        (user_id,)
+    )
+    return cur.fetchall()
+
+
+# ── Online backfill ─────────────────────────────────────────────────────────
+_BACKFILL_SQL = f"""
+    INSERT INTO sensor_readings_wide {_WIDE_COLUMNS}
+    SELECT user_id, device_id, MIN(timestamp_utc), minute_bucket, MAX(sample_count),
+           MAX(CASE WHEN sensor_type = 'co2' THEN value END),
+           MAX(CASE WHEN sensor_type = 'co2' THEN value_min END),
+           MAX(CASE WHEN sensor_type = 'co2' THEN value_max END),
+           MAX(CASE WHEN sensor_type = 'temperature' THEN value END),
+           MAX(CASE WHEN sensor_type = 'temperature' THEN value_min END),
+           MAX(CASE WHEN sensor_type = 'temperature' THEN value_max END),
+           MAX(CASE WHEN sensor_type = 'humidity' THEN value END),
+           MAX(CASE WHEN sensor_type = 'humidity' THEN value_min END),
+           MAX(CASE WHEN sensor_type = 'humidity' THEN value_max END)
+    FROM sensor_readings
+    WHERE id > %s AND id <= %s
+    GROUP BY user_id, device_id, minute_bucket
+    ON DUPLICATE KEY UPDATE
+      co2 = COALESCE(co2, VALUES(co2)),
+      co2_min = COALESCE(co2_min, VALUES(co2_min)),
+      co2_max = COALESCE(co2_max, VALUES(co2_max)),
+      temp = COALESCE(temp, VALUES(temp)),
+      temp_min = COALESCE(temp_min, VALUES(temp_min)),
+      temp_max = COALESCE(temp_max, VALUES(temp_max)),
+      humidity = COALESCE(humidity, VALUES(humidity)),
+      humidity_min = COALESCE(humidity_min, VALUES(humidity_min)),
+      humidity_max = COALESCE(humidity_max, VALUES(humidity_max))
+"""
+
+
+def backfill(chunk=5000, pause_ms=50):
+    """
+    Copy sensor_readings into sensor_readings_wide in id-range chunks, one short
+    transaction per chunk. Rows already dual-written are kept (COALESCE only fills
+    gaps), and a triple split across two chunks is completed by the second one,
+    so the job can be stopped and re-run at any time.
+    """
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM sensor_readings")
+        max_id = cur.fetchone()[0]
+        copied = 0
+        lo = 0
+        while lo < max_id:
+            hi = min(lo + chunk, max_id)
+            cur.execute(_BACKFILL_SQL, (lo, hi))
+            conn.commit()
+            copied += hi - lo
+            print(f"[WideBackfill] ids {lo + 1}–{hi} of {max_id} ({copied * 100 // max_id}%)")
+            lo = hi
+            if pause_ms:
+                time.sleep(pause_ms / 1000.0)
+        cur.close()
+        print("[WideBackfill] Done")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="sensor_readings_wide maintenance")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_bf = sub.add_parser("backfill", help="copy existing EAV rows into the wide table")
+    p_bf.add_argument("--chunk", type=int, default=5000, help="sensor_readings ids per transaction")
+    p_bf.add_argument("--pause-ms", type=int, default=50, help="sleep between chunks")
+    args = parser.parse_args()
+    backfill(args.chunk, args.pause_ms)
@@ -0,0 +1,236 @@
+"""
+Optional lossy compression of stored sensor series.
+
+Greenhouse temperature and humidity sit flat for hours, yet every minute
+window produces a full triple.  With SENSOR_COMPRESSION enabled, each
+(user_id, device_id, sensor_type) series passes through a filter that only
+forwards the points needed to rebuild the series within a per-metric
+tolerance:
+
+  deadband       – keep a point when it moves more than `tol` from the last
+                   kept value (rebuild by linear interpolation / hold)
+  swinging-door  – classic swinging-door trending: keep the last point of
+                   every straight segment that stays within ±tol of all
+                   skipped points (rebuild by linear interpolation)
+
+A point is always kept after SENSOR_COMPRESSION_MAX_GAP_SEC so readers never
+interpolate across an outage or wait too long for a flat tail.
+`reconstruct_series` rebuilds a uniform grid from the stored points for the
+history and reports endpoints.
+"""
+
+import os
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+MODE_OFF = "off"
+MODE_DEADBAND = "deadband"
+MODE_SWINGING_DOOR = "swinging-door"
+
+# Default tolerances per sensor_type (units of the stored value)
+DEFAULT_TOLERANCES = {"co2": 10.0, "temperature": 0.2, "humidity": 1.0}
+
+
+class DeadbandFilter:
+    __slots__ = ("tol", "max_gap", "kept_t", "kept_v", "last")
+
+    def __init__(self, tol, max_gap):
+        self.tol = tol
+        self.max_gap = max_gap
+        self.kept_t = None
+        self.kept_v = None
+        self.last = None        # (t, v, payload) of the newest skipped point
+
+    def add(self, t, v, payload):
+        """Return a list of payloads to persist."""
+        if self.kept_t is None or abs(v - self.kept_v) > self.tol or t - self.kept_t >= self.max_gap:
+            out = []
+            # Keep the point just before a step so interpolation doesn't ramp across the plateau
+            if self.last is not None and abs(v - self.kept_v) > self.tol:
+                out.append(self.last[2])
+            self.kept_t, self.kept_v, self.last = t, v, None
+            out.append(payload)
+            return out
+        self.last = (t, v, payload)
+        return []
+
+    def flush(self):
+        pending, self.last = self.last, None
+        return [pending[2]] if pending else []
+
+
+class SwingingDoorFilter:
+    __slots__ = ("tol", "max_gap", "anchor_t", "anchor_v", "slope_hi", "slope_lo", "last")
+
+    def __init__(self, tol, max_gap):
+        self.tol = tol
+        self.max_gap = max_gap
+        self.anchor_t = None
+        self.anchor_v = None
+        self.slope_hi = None    # tightest upper door slope seen since the anchor
+        self.slope_lo = None    # tightest lower door slope seen since the anchor
+        self.last = None        # (t, v, payload) of the newest unarchived point
+
+    def _open_doors(self, t, v):
+        dt = t - self.anchor_t
+        self.slope_hi = (v + self.tol - self.anchor_v) / dt
+        self.slope_lo = (v - self.tol - self.anchor_v) / dt
+
+    def add(self, t, v, payload):
+        """Return a list of payloads to persist."""
+        if self.anchor_t is None or t - self.anchor_t >= self.max_gap:
+            out = [self.last[2]] if self.last is not None else []
+            self.anchor_t, self.anchor_v, self.last = t, v, None
+            self.slope_hi = self.slope_lo = None
+            return out + [payload]
+        if t <= self.anchor_t:
+            return []
+
+        if self.last is None:
+            self._open_doors(t, v)
+            self.last = (t, v, payload)
+            return []
+
+        dt = t - self.anchor_t
+        slope_hi = min(self.slope_hi, (v + self.tol - self.anchor_v) / dt)
+        slope_lo = max(self.slope_lo, (v - self.tol - self.anchor_v) / dt)
+        if slope_lo <= slope_hi:
+            self.slope_hi, self.slope_lo = slope_hi, slope_lo
+            self.last = (t, v, payload)
+            return []
+
+        # Doors crossed: the previous point ends the segment and becomes the new anchor
+        lt, lv, lpayload = self.last
+        self.anchor_t, self.anchor_v = lt, lv
+        self._open_doors(t, v)
+        self.last = (t, v, payload)
+        return [lpayload]
+
+    def flush(self):
+        pending, self.last = self.last, None
+        if pending:
+            self.anchor_t, self.anchor_v = pending[0], pending[1]
+            self.slope_hi = self.slope_lo = None
+            return [pending[2]]
+        return []
+
+
+_FILTERS = {MODE_DEADBAND: DeadbandFilter, MODE_SWINGING_DOOR: SwingingDoorFilter}
+
+
+class SeriesCompressor:
+    """Routes closed window aggregates through one filter per (user, device, sensor_type)."""
+
+    def __init__(self, emit_point, mode, tolerances=None, max_gap_sec=900):
+        if mode not in _FILTERS:
+            raise ValueError(f"Unknown compression mode: {mode}")
+        # emit_point(user_id, device_id, ts, sensor_type, metric_window)
+        self.emit_point = emit_point
+        self.mode = mode
+        self.tolerances = dict(DEFAULT_TOLERANCES, **(tolerances or {}))
+        self.max_gap_sec = max_gap_sec
+        self._filters = {}
+        self._lock = threading.Lock()
+        self._points_in = 0
+        self._points_kept = 0
+
+    def add_window(self, agg):
+        t = agg.window_start.timestamp()
+        kept = []
+        with self._lock:
+            for sensor_type, metric in agg.metrics.items():
+                key = (agg.user_id, agg.device_id, sensor_type)
+                f = self._filters.get(key)
+                if f is None:
+                    f = _FILTERS[self.mode](self.tolerances.get(sensor_type, 0.0), self.max_gap_sec)
+                    self._filters[key] = f
+                self._points_in += 1
+                for payload in f.add(t, metric.mean, (agg.window_start, metric)):
+                    kept.append((key, payload))
+            self._points_kept += len(kept)
+        for (user_id, device_id, sensor_type), (ts, metric) in kept:
+            self.emit_point(user_id, device_id, ts, sensor_type, metric)
+
+    def flush_all(self):
+        """Persist every held-back tail point (shutdown)."""
+        kept = []
+        with self._lock:
+            for key, f in self._filters.items():
+                for payload in f.flush():
+                    kept.append((key, payload))
+            self._points_kept += len(kept)
+        for (user_id, device_id, sensor_type), (ts, metric) in kept:
+            self.emit_point(user_id, device_id, ts, sensor_type, metric)
+
+    def stats(self) -> dict:
+        return {
+            "mode":        self.mode,
+            "series":      len(self._filters),
+            "points_in":   self._points_in,
+            "points_kept": self._points_kept,
+            "ratio":       round(self._points_in / self._points_kept, 2) if self._points_kept else 0.0,
+        }
+
+
+def compression_mode() -> str:
+    mode = os.environ.get("SENSOR_COMPRESSION", MODE_OFF).strip().lower()
+    return mode if mode in _FILTERS else MODE_OFF
+
+
+def compressor_from_env(emit_point):
+    """Return a SeriesCompressor configured from SENSOR_COMPRESSION_* env vars, or None if off."""
+    mode = compression_mode()
+    if mode == MODE_OFF:
+        return None
+    tolerances = {
+        "co2":         float(os.environ.get("SENSOR_COMPRESSION_TOL_CO2", DEFAULT_TOLERANCES["co2"])),
+        "temperature": float(os.environ.get("SENSOR_COMPRESSION_TOL_TEMP", DEFAULT_TOLERANCES["temperature"])),
+        "humidity":    float(os.environ.get("SENSOR_COMPRESSION_TOL_HUMIDITY", DEFAULT_TOLERANCES["humidity"])),
+    }
+    return SeriesCompressor(
+        emit_point, mode, tolerances,
+        max_gap_sec=int(os.environ.get("SENSOR_COMPRESSION_MAX_GAP_SEC", 900)),
+    )
+
+
+def reconstruct_series(rows, step_sec=60, max_points=None):
+    """
+    Rebuild a uniform series from compressed rows.
+
+    rows: iterable of (sensor_type, value, timestamp) in any order.
+    Returns [(timestamp, {sensor_type: value})] on a step_sec grid (most recent
+    `max_points` if given).  Values between stored points are linearly
+    interpolated; past a metric's first/last stored point the edge value is held.
+    """
+    series = {}
+    for sensor_type, value, ts in rows:
+        series.setdefault(sensor_type, []).append((ts.timestamp() if ts.tzinfo else
+                                                   ts.replace(tzinfo=timezone.utc).timestamp(), float(value)))
+    if not series:
+        return []
+    for points in series.values():
+        points.sort()
+
+    start = min(p[0][0] for p in series.values())
+    end = max(p[-1][0] for p in series.values())
+    n = int((end - start) // step_sec) + 1
+    first = 0 if max_points is None else max(0, n - max_points)
+
+    times = {k: [p[0] for p in v] for k, v in series.items()}
+    out = []
+    for i in range(first, n):
+        t = start + i * step_sec
+        values = {}
+        for sensor_type, points in series.items():
+            idx = bisect_right(times[sensor_type], t)
+            if idx == 0:
+                values[sensor_type] = points[0][1]
+            elif idx == len(points):
+                values[sensor_type] = points[-1][1]
+            else:
+                (t0, v0), (t1, v1) = points[idx - 1], points[idx]
+                values[sensor_type] = v0 + (v1 - v0) * (t - t0) / (t1 - t0)
+        ts = datetime(1970, 1, 1) + timedelta(seconds=t)
+        out.append((ts, values))
+    return out
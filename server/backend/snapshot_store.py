@@ -0,0 +1,120 @@
+"""
+Live sensor snapshot store keyed by (user_id, device_id).
+
+Replaces the old process-wide LATEST_SENSOR_DATA dict, which every device
+overwrote and every tenant read.  Each reading becomes a new immutable
+`SensorSnapshot`.  Writers (serialised by a writer lock) copy only the
+user's own device map and publish it, and the snapshot, with one key
+assignment each, so an update costs O(devices of that user) and readers
+never take a lock and always see a consistent co2/temp/humidity triple from
+a single reading.
+
+`fleet()` leaves out users whose latest reading is older than
+SENSOR_SNAPSHOT_MAX_AGE_SEC (default 600), so long-offline devices stop
+feeding the background alert check.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+DEFAULT_DEVICE_ID = "default"
+FLEET_MAX_AGE_SEC = float(os.environ.get("SENSOR_SNAPSHOT_MAX_AGE_SEC", 600))
+
+
+def normalize_user_id(user_id):
+    """Query-string user ids arrive as text; MQTT ones as ints. Key on int where possible."""
+    if isinstance(user_id, str) and user_id.strip().isdigit():
+        return int(user_id.strip())
+    return user_id
+
+
+class SensorSnapshot:
+    """One immutable reading from one device."""
+
+    __slots__ = ("user_id", "device_id", "co2", "temp", "humidity", "monotonic_ts", "wall_time")
+
+    def __init__(self, user_id, device_id, co2, temp, humidity, monotonic_ts=None, wall_time=None):
+        setter = object.__setattr__
+        setter(self, "user_id", user_id)
+        setter(self, "device_id", device_id)
+        setter(self, "co2", float(co2))
+        setter(self, "temp", float(temp))
+        setter(self, "humidity", float(humidity))
+        setter(self, "monotonic_ts", time.monotonic() if monotonic_ts is None else monotonic_ts)
+        setter(self, "wall_time", datetime.now() if wall_time is None else wall_time)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SensorSnapshot is immutable")
+
+    def age(self) -> float:
+        """Seconds since this reading was received."""
+        return time.monotonic() - self.monotonic_ts
+
+    def as_dict(self) -> dict:
+        """Shape used by the API and alert checks (same keys as the old global dict)."""
+        return {
+            "co2":       self.co2,
+            "temp":      self.temp,
+            "humidity":  self.humidity,
+            "timestamp": self.wall_time.strftime("%H:%M:%S"),
+            "user_id":   self.user_id,
+            "device_id": self.device_id,
+        }
+
+    def __repr__(self):
+        return (f"SensorSnapshot(user_id={self.user_id!r}, device_id={self.device_id!r}, "
+                f"co2={self.co2}, temp={self.temp}, humidity={self.humidity})")
+
+
+class SnapshotStore:
+    """Latest SensorSnapshot per device and per user; per-user maps are copy-on-write."""
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        # { user_id: { device_id: SensorSnapshot } } — inner dicts are never mutated once published
+        self._devices_by_user = {}
+        # { user_id: SensorSnapshot } — most recent reading across the user's devices
+        self._latest_by_user = {}
+
+    def update(self, user_id, device_id, co2, temp, humidity) -> SensorSnapshot:
+        user_id = normalize_user_id(user_id)
+        device_id = device_id or DEFAULT_DEVICE_ID
+        snap = SensorSnapshot(user_id, device_id, co2, temp, humidity)
+        with self._write_lock:
+            devices = dict(self._devices_by_user.get(user_id, {}))
+            devices[device_id] = snap
+            # Publish: each single-key assignment is atomic for readers
+            self._devices_by_user[user_id] = devices
+            self._latest_by_user[user_id] = snap
+        return snap
+
+    def latest(self, user_id, device_id=None):
+        """Latest snapshot for one device, or for the user's most recently seen device."""
+        user_id = normalize_user_id(user_id)
+        if device_id is None:
+            return self._latest_by_user.get(user_id)
+        return self._devices_by_user.get(user_id, {}).get(device_id)
+
+    def devices(self, user_id) -> dict:
+        """{ device_id: SensorSnapshot } for one user. Do not mutate the returned dict."""
+        return self._devices_by_user.get(normalize_user_id(user_id), {})
+
+    def fleet(self, max_age=None) -> dict:
+        """
+        { user_id: SensorSnapshot } for every user seen within `max_age` seconds
+        (default FLEET_MAX_AGE_SEC; 0 or less keeps everyone). A new dict.
+        """
+        if max_age is None:
+            max_age = FLEET_MAX_AGE_SEC
+        # dict.copy runs without releasing the GIL, so a concurrent insert cannot break it
+        latest = self._latest_by_user.copy()
+        if max_age <= 0:
+            return latest
+        return {user_id: snap for user_id, snap in latest.items() if snap.age() <= max_age}
+
+    def clear(self):
+        with self._write_lock:
+            self._devices_by_user = {}
+            self._latest_by_user = {}
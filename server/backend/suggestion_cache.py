@@ -0,0 +1,174 @@
+"""
+LRU + TTL cache of Gemini alert suggestions.
+
+Alerts repeat: the same crop, stage and metric keep drifting a few tenths
+around the same out-of-range value.  Suggestions are cached under
+
+    (crop, stage, metric, direction, ideal_min, ideal_max, value bucket)
+
+where the value is quantised to VALUE_BUCKETS of its metric, so neighbouring
+readings share one answer.  The ideal range is part of the key because it
+comes from the (editable) crop_thresholds table.
+
+  SUGGESTION_CACHE_SIZE     entries kept, least recently used evicted (1000)
+  SUGGESTION_CACHE_TTL_SEC  lifetime of an entry (21600, 6 hours)
+  SUGGESTION_CACHE_PATH     optional JSON file; loaded on first use and
+                            written on interpreter shutdown, so a restart
+                            does not go back to Gemini for every alert
+
+Only real model answers are cached; fallbacks are not, so the cache fills up
+again as soon as Gemini recovers.
+"""
+
+import atexit
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Bucket width per metric, in the metric's unit
+VALUE_BUCKETS = {"temp": 0.5, "humidity": 2.0, "co2": 25.0}
+_DEFAULT_BUCKET = 1.0
+# Types of the suggestion_key parts, checked when loading SUGGESTION_CACHE_PATH
+_KEY_TYPES = (str, str, str, str, (int, float), (int, float), int)
+
+
+def _parse_record(record):
+    """(key, expires, text) of one persisted [key, expires, text] record, or None if malformed."""
+    if not isinstance(record, list) or len(record) != 3:
+        return None
+    key, expires, text = record
+    if not isinstance(key, list) or len(key) != len(_KEY_TYPES):
+        return None
+    if not all(isinstance(part, kind) and not isinstance(part, bool) for part, kind in zip(key, _KEY_TYPES)):
+        return None
+    if not isinstance(expires, (int, float)) or isinstance(expires, bool) or not isinstance(text, str):
+        return None
+    return tuple(key[:4]) + (float(key[4]), float(key[5]), key[6]), float(expires), text
+
+
+def suggestion_key(alert, crop_type, crop_stage):
+    step = VALUE_BUCKETS.get(alert["metric"], _DEFAULT_BUCKET)
+    return (
+        (crop_type or "").strip().lower(),
+        (crop_stage or "").strip().lower(),
+        alert["metric"],
+        alert["direction"],
+        float(alert["ideal_min"]),
+        float(alert["ideal_max"]),
+        math.floor(float(alert["value"]) / step),
+    )
+
+
+class SuggestionCache:
+    def __init__(self, max_entries=1000, ttl_sec=21600.0, path=None):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_sec = ttl_sec
+        self.path = path
+        self._lock = threading.Lock()
+        # key -> (expires_at epoch, text); oldest use first
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+        if path:
+            self.load()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            if entry[0] <= now:
+                del self._entries[key]
+                self._expired += 1
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key, text):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_sec, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    # ── Persistence ──────────────────────────────────────────────────────
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                records = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as exc:
+            print(f"[AI] Suggestion cache {self.path} not loaded: {exc}")
+            return
+        if not isinstance(records, list):
+            print(f"[AI] Suggestion cache {self.path} not loaded: expected a JSON list")
+            return
+        now = time.time()
+        skipped = 0
+        with self._lock:
+            for record in records[-self.max_entries:]:
+                parsed = _parse_record(record)
+                if parsed is None:
+                    skipped += 1
+                    continue
+                key, expires, text = parsed
+                if expires > now:
+                    self._entries[key] = (expires, text)
+        print(f"[AI] Loaded {len(self._entries)} cached suggestion(s) from {self.path}"
+              + (f", skipped {skipped} malformed" if skipped else ""))
+
+    def save(self):
+        now = time.time()
+        with self._lock:
+            records = [[list(k), e, t] for k, (e, t) in self._entries.items() if e > now]
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(records, f)
+            os.replace(tmp, self.path)
+        except OSError as exc:
+            print(f"[AI] Suggestion cache {self.path} not saved: {exc}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries":   len(self._entries),
+                "capacity":  self.max_entries,
+                "hits":      self._hits,
+                "misses":    self._misses,
+                "hit_ratio": round(self._hits / lookups, 3) if lookups else 0.0,
+                "evictions": self._evictions,
+                "expired":   self._expired,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_suggestion_cache() -> SuggestionCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = os.environ.get("SUGGESTION_CACHE_PATH", "").strip() or None
+                _cache = SuggestionCache(
+                    max_entries=int(os.environ.get("SUGGESTION_CACHE_SIZE", 1000)),
+                    ttl_sec=float(os.environ.get("SUGGESTION_CACHE_TTL_SEC", 21600)),
+                    path=path,
+                )
+                if path:
+                    atexit.register(_cache.save)
+    return _cache
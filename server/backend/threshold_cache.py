@@ -0,0 +1,177 @@
+"""
+In-process cache of crop_thresholds, keyed by normalised crop name.
+
+The whole table (a handful of rows per crop) is loaded in one query, at
+startup by `start_services` and again whenever the copy is invalidated or
+older than CROP_THRESHOLD_TTL_SEC (default 300).  Lookups on the prediction
+and alerting paths are then a dict lookup instead of a pooled connection and
+a `LOWER(crop_name)` scan.
+
+`db_connect.save_crop_threshold` (and so POST /api/thresholds) invalidates
+the cache after its commit; the TTL covers writes made by other processes.
+If a reload fails the previous copy keeps being served and the reload is
+retried after CROP_THRESHOLD_RETRY_SEC.
+
+Every invalidation bumps a generation counter; a reload that started before
+the latest invalidation discards its result, so a query that read the table
+before a commit can never install pre-write data for a full TTL.
+
+The MQTT alert path looks up with refresh=False and never queries the
+database on its thread; the scheduler's `refresh_thresholds` job reloads an
+expired or invalidated copy every CROP_THRESHOLD_REFRESH_SEC instead.
+"""
+
+import os
+import threading
+import time
+from db_connect import get_connection
+
+
+def normalize_crop_name(name) -> str:
+    return (name or "").strip().lower()
+
+
+class ThresholdCache:
+    def __init__(self, ttl_sec=300.0, retry_sec=10.0):
+        self.ttl_sec = ttl_sec
+        self.retry_sec = retry_sec
+        self._by_name = None
+        self._expires = 0.0
+        self._generation = 0
+        self._reload_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._reloads = 0
+        self._reload_failures = 0
+        self._discarded = 0
+
+    def _load(self):
+        conn = get_connection()
+        try:
+            cur = conn.cursor()
+            cur.execute(
+                """
+                SELECT crop_name, temp_min, temp_max,
+                       humidity_min, humidity_max,
+                       co2_min, co2_max
+                FROM crop_thresholds
+                ORDER BY id
+                """
+            )
+            rows = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        by_name = {}
+        for name, t_min, t_max, h_min, h_max, c_min, c_max in rows:
+            # Oldest row wins for duplicate names, as the old LIMIT 1 lookup did
+            by_name.setdefault(normalize_crop_name(name), {
+                "temp":     (float(t_min), float(t_max)),
+                "humidity": (float(h_min), float(h_max)),
+                "co2":      (float(c_min), float(c_max)),
+            })
+        return by_name
+
+    def reload(self) -> bool:
+        generation = self._generation
+        try:
+            by_name = self._load()
+        except Exception as exc:
+            self._reload_failures += 1
+            with self._state_lock:
+                if generation == self._generation:
+                    self._expires = time.monotonic() + self.retry_sec
+            print(f"[Thresholds] Reload failed: {exc}")
+            return False
+        with self._state_lock:
+            if generation != self._generation:
+                # Invalidated while loading: the rows may predate the write
+                self._discarded += 1
+                return False
+            self._by_name = by_name
+            self._expires = time.monotonic() + self.ttl_sec
+        self._reloads += 1
+        return True
+
+    def refresh_if_stale(self):
+        """Reload an expired or invalidated copy (scheduler job; never blocks on another reload)."""
+        if self._by_name is not None and time.monotonic() < self._expires:
+            return
+        if self._reload_lock.acquire(blocking=False):
+            try:
+                self.reload()
+            finally:
+                self._reload_lock.release()
+
+    def _current(self, refresh=True):
+        by_name = self._by_name
+        if not refresh or (by_name is not None and time.monotonic() < self._expires):
+            return by_name
+        if by_name is not None:
+            # Stale copy: one thread reloads, the others keep using it meanwhile
+            if self._reload_lock.acquire(blocking=False):
+                try:
+                    self.reload()
+                finally:
+                    self._reload_lock.release()
+            return self._by_name
+        with self._reload_lock:
+            if self._by_name is None and time.monotonic() >= self._expires:
+                self.reload()
+        return self._by_name
+
+    def get(self, crop_name, refresh=True):
+        """
+        {'temp': (min, max), 'humidity': ..., 'co2': ...} or None if the crop has
+        no row. With refresh=False the current copy is used as is, even if stale.
+        """
+        ranges = (self._current(refresh) or {}).get(normalize_crop_name(crop_name))
+        if ranges is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return ranges
+
+    def invalidate(self):
+        """Force a reload on the next lookup (call after committing a threshold write)."""
+        with self._state_lock:
+            self._generation += 1
+            self._expires = 0.0
+
+    def stats(self) -> dict:
+        by_name = self._by_name
+        return {
+            "crops":           len(by_name) if by_name is not None else None,
+            "hits":            self._hits,
+            "misses":          self._misses,
+            "reloads":         self._reloads,
+            "reload_failures": self._reload_failures,
+            "discarded":       self._discarded,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_threshold_cache() -> ThresholdCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ThresholdCache(
+                    ttl_sec=float(os.environ.get("CROP_THRESHOLD_TTL_SEC", 300)),
+                    retry_sec=float(os.environ.get("CROP_THRESHOLD_RETRY_SEC", 10)),
+                )
+    return _cache
+
+
+def invalidate_thresholds():
+    if _cache is not None:
+        _cache.invalidate()
+
+
+def refresh_thresholds():
+    """Scheduler job: keep the copy used by refresh=False lookups current."""
+    get_threshold_cache().refresh_if_stale()
@@ -0,0 +1,62 @@
+"""
+Topic → (user_id, device_id, payload_format) routing for MQTT ingest.
+
+Devices publish to  <prefix>/<tenant>/<device_key>/sensors  and the backend
+subscribes once with  <prefix>/+/+/sensors.  The routing table is built from
+the devices table in one query and swapped in atomically on reload, so the
+per-message lookup is a single dict get with no DB access.
+"""
+
+import threading
+import time
+from snapshot_store import normalize_user_id
+
+
+class TopicRouter:
+    RETRY_AFTER_SEC = 30
+
+    def __init__(self, loader, prefix="ecogrow", suffix="sensors"):
+        # loader() -> iterable of (tenant, device_key, user_id, payload_format)
+        self.loader = loader
+        self.prefix = prefix
+        self.suffix = suffix
+        self._routes = {}
+        self._lock = threading.Lock()
+        self._unrouted = 0
+        self._loaded = False
+        self._retry_at = 0.0
+
+    def topic_for(self, tenant, device_key) -> str:
+        return f"{self.prefix}/{tenant}/{device_key}/{self.suffix}"
+
+    def subscriptions(self) -> list:
+        """Wildcard filter covering every tenant/device topic."""
+        return [f"{self.prefix}/+/+/{self.suffix}"]
+
+    def reload(self):
+        """Rebuild the routing table from the loader and publish it in one swap."""
+        with self._lock:
+            try:
+                routes = {
+                    self.topic_for(tenant, device_key): (normalize_user_id(user_id), device_key, payload_format)
+                    for tenant, device_key, user_id, payload_format in self.loader()
+                }
+            except Exception as exc:
+                print(f"[MQTT] Topic route reload failed, keeping previous table: {exc}")
+                self._retry_at = time.monotonic() + self.RETRY_AFTER_SEC
+                return
+            self._routes = routes
+            self._loaded = True
+        print(f"[MQTT] Loaded {len(routes)} topic route(s)")
+
+    def resolve(self, topic):
+        """Return (user_id, device_id, payload_format) for a device topic, or None if unregistered."""
+        if not self._loaded and time.monotonic() >= self._retry_at:
+            self.reload()
+        route = self._routes.get(topic)
+        if route is None:
+            self._unrouted += 1
+        return route
+
+    def stats(self) -> dict:
+        return {"routes": len(self._routes), "unrouted_messages": self._unrouted}
@@ -0,0 +1,86 @@
+"""
+Import-time budget check for the backend modules.
+
+Each module is imported in a fresh interpreter under `python -X importtime`.
+The check fails if an import takes longer than its budget, or if it leaves
+work behind: a DB pool, extra threads, or heavy SDKs (Gemini, Google OAuth,
+APScheduler) that should only load on first use.
+
+Needs the packages from requirements.txt but no database, MQTT broker or
+network.
+
+Command:
+    python verify_import_time.py [--budget-ms 1500] [module ...]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Cumulative import time allowed per module, milliseconds
+DEFAULT_BUDGET_MS = int(os.environ.get("IMPORT_BUDGET_MS", 1500))
+MODULES = ("db_connect", "mqtt_service", "ai_service", "sensor_handler", "app")
+
+# Modules that must not be imported as a side effect of importing ours
+LAZY_MODULES = ("google.generativeai", "google_auth_oauthlib", "google.oauth2.id_token",
+                "apscheduler", "mysql.connector.pooling")
+
+_CHECK = """
+import sys, threading
+import {module}
+import db_connect
+problems = []
+if db_connect._pools:
+    problems.append("pool created: " + ", ".join(db_connect._pools))
+if threading.active_count() != 1:
+    problems.append("threads started: " + ", ".join(t.name for t in threading.enumerate()
+                                                      if t is not threading.main_thread()))
+for name in {lazy!r}:
+    if name in sys.modules:
+        problems.append("imported eagerly: " + name)
+print("\\n".join(problems))
+"""
+
+
+def measure(module):
+    """Returns (cumulative import ms, [problems])."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _CHECK.format(module=module, lazy=LAZY_MODULES)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+        return None, ["import failed: " + (tail[-1] if tail else f"exit {proc.returncode}")]
+    cumulative_us = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    problems = [line for line in proc.stdout.splitlines() if line]
+    return (cumulative_us / 1000.0 if cumulative_us is not None else None), problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time budget check")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        ms, problems = measure(module)
+        if ms is not None and ms > args.budget_ms:
+            problems.append(f"over budget ({args.budget_ms:.0f} ms)")
+        status = "FAIL" if problems else "ok"
+        took = f"{ms:8.1f} ms" if ms is not None else "       ? ms"
+        print(f"{status:4}  {module:16} {took}  {'; '.join(problems)}")
+        failed = failed or bool(problems)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
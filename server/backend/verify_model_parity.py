@@ -0,0 +1,127 @@
+"""
+Parity check between the remote risk model and a local ensemble export.
+
+record  posts a grid of readings (every crop and stage, temperature /
+        humidity / CO2 from well below to well above the ideal ranges) to
+        MODEL_URL and writes one {"input": [...], "output": {...}} JSON line
+        per answer
+check   scores the recorded inputs with the local ensemble in one batch and
+        compares: status must match, risk_score within --tolerance.  Exits 1
+        on any mismatch, so it can gate a RISK_MODEL_BACKEND=local rollout.
+        With NumPy installed the vectorised and pure-Python paths of
+        LocalTreeEnsemble are also compared with each other.
+selftest
+        `check` against the committed fixtures (no network, no model file
+        needed): fixtures/risk_model_sample.json is a small ensemble in the
+        export format and fixtures/parity_sample.ndjson its pinned answers.
+        Guards the scorer itself; re-run `record` and `check` against the
+        real service before switching backends.
+
+Commands:
+    python verify_model_parity.py record parity.ndjson [--url URL]
+    python verify_model_parity.py check parity.ndjson --model risk_model.json [--tolerance 0.01]
+    python verify_model_parity.py selftest
+"""
+
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from model_engine import INPUTS, LocalTreeEnsemble
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURE_MODEL = os.path.join(FIXTURE_DIR, "risk_model_sample.json")
+FIXTURE_ANSWERS = os.path.join(FIXTURE_DIR, "parity_sample.ndjson")
+# Both paths round risk_score to 4 places; NumPy and Python may round a tie differently
+_PATH_TOLERANCE = 1e-4
+
+CROPS = ("tomato", "capsicum", "cucumber", "lettuce", "strawberry")
+STAGES = ("seedling", "vegetative", "flowering", "fruiting")
+TEMPS = (8.0, 15.0, 20.5, 24.0, 28.0, 33.5, 40.0)
+HUMIDITIES = (30.0, 55.0, 68.0, 80.0, 92.0)
+CO2S = (250.0, 400.0, 750.0, 1200.0, 2000.0)
+
+
+def record(path, url):
+    import requests
+    session = requests.Session()
+    written = 0
+    with open(path, "w", encoding="utf-8") as out:
+        for crop, stage, temp, hum, co2 in itertools.product(CROPS, STAGES, TEMPS, HUMIDITIES, CO2S):
+            row = (temp, hum, co2, crop, stage)
+            resp = session.post(url, json=dict(zip(INPUTS, row)), timeout=30)
+            resp.raise_for_status()
+            out.write(json.dumps({"input": row, "output": resp.json()}) + "\n")
+            written += 1
+    print(f"Recorded {written} answer(s) to {path}")
+
+
+def compare_paths(model_path, rows):
+    """Score rows with the NumPy and pure-Python paths; True if they agree."""
+    vectorised = LocalTreeEnsemble.load(model_path)
+    if vectorised._numpy is None:
+        print("NumPy not installed: vectorised path not compared")
+        return True
+    pure = LocalTreeEnsemble.load(model_path, use_numpy=False)
+    mismatches = 0
+    for row, a, b in zip(rows, vectorised.predict_batch(rows), pure.predict_batch(rows)):
+        if a["status"] != b["status"] or abs(a["risk_score"] - b["risk_score"]) > _PATH_TOLERANCE:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"PATH MISMATCH {list(row)}: numpy={a} python={b}")
+    print(f"NumPy vs pure Python: {len(rows)} row(s), {mismatches} mismatch(es)")
+    return mismatches == 0
+
+
+def check(path, model_path, tolerance):
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    engine = LocalTreeEnsemble.load(model_path)
+    rows = [tuple(r["input"]) for r in records]
+
+    started = time.perf_counter()
+    answers = engine.predict_batch(rows)
+    elapsed = time.perf_counter() - started
+
+    mismatches = 0
+    worst = 0.0
+    for rec, got in zip(records, answers):
+        want = rec["output"]
+        diff = abs(float(want.get("risk_score", 0)) - got["risk_score"])
+        worst = max(worst, diff)
+        if str(want.get("status", "")).lower() != got["status"].lower() or diff > tolerance:
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"MISMATCH {rec['input']}: remote={want} local={got}")
+
+    print(f"{len(records)} row(s) in {elapsed * 1000:.1f} ms "
+          f"({elapsed * 1e6 / max(1, len(records)):.1f} us/row), "
+          f"{mismatches} mismatch(es), max risk_score diff {worst:.4f}")
+    return compare_paths(model_path, rows) and mismatches == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remote vs local risk model parity")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rec = sub.add_parser("record", help="record remote model answers for a grid of readings")
+    p_rec.add_argument("path")
+    p_rec.add_argument("--url", default=None, help="model endpoint (default: ai_service.MODEL_URL)")
+    p_chk = sub.add_parser("check", help="compare a local ensemble against recorded answers")
+    p_chk.add_argument("path")
+    p_chk.add_argument("--model", required=True, help="JSON ensemble from model_engine.py export")
+    p_chk.add_argument("--tolerance", type=float, default=0.01)
+    sub.add_parser("selftest", help="check the committed fixture ensemble against its pinned answers (no network)")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        url = args.url
+        if url is None:
+            from ai_service import MODEL_URL
+            url = MODEL_URL
+        record(args.path, url)
+    elif args.cmd == "selftest":
+        sys.exit(0 if check(FIXTURE_ANSWERS, FIXTURE_MODEL, _PATH_TOLERANCE) else 1)
+    else:
+        sys.exit(0 if check(args.path, args.model, args.tolerance) else 1)
@@ -0,0 +1,193 @@
+"""
+Per-device windowed aggregation at ingest.
+
+Devices publish every ~10s but sensor_readings only keeps one row per metric
+per minute.  Instead of keeping the first reading of each minute and dropping
+the rest, every reading is folded into an O(1) running summary
+(count / min / max / sum / last) for its (user_id, device_id) and minute bucket.
+When a newer bucket starts — or the periodic sweep notices the device went
+quiet — the closed window is emitted as a single aggregated reading.
+"""
+
+import atexit
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from snapshot_store import DEFAULT_DEVICE_ID, normalize_user_id
+
+# Metric name on the wire → sensor_type stored in sensor_readings
+METRIC_SENSOR_TYPES = (("co2", "co2"), ("temp", "temperature"), ("humidity", "humidity"))
+
+
+class MetricWindow:
+    """Running summary of one metric inside one window."""
+
+    __slots__ = ("count", "total", "vmin", "vmax", "last")
+
+    def __init__(self, value):
+        self.count = 1
+        self.total = value
+        self.vmin = value
+        self.vmax = value
+        self.last = value
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.vmin:
+            self.vmin = value
+        if value > self.vmax:
+            self.vmax = value
+        self.last = value
+
+    @property
+    def mean(self):
+        return self.total / self.count
+
+
+class WindowAggregate:
+    """A closed window for one device, ready to be written."""
+
+    __slots__ = ("user_id", "device_id", "window_start", "metrics")
+
+    def __init__(self, user_id, device_id, window_start, metrics):
+        self.user_id = user_id
+        self.device_id = device_id
+        self.window_start = window_start   # aware UTC datetime
+        self.metrics = metrics             # { sensor_type: MetricWindow }
+
+
+class _OpenWindow:
+    __slots__ = ("bucket", "metrics")
+
+    def __init__(self, bucket, values):
+        self.bucket = bucket
+        self.metrics = {sensor_type: MetricWindow(values[key]) for key, sensor_type in METRIC_SENSOR_TYPES}
+
+    def add(self, values):
+        for key, sensor_type in METRIC_SENSOR_TYPES:
+            self.metrics[sensor_type].add(values[key])
+
+
+class WindowAggregator:
+    """Folds readings into per-device tumbling windows and emits one aggregate per window."""
+
+    def __init__(self, emit, window_sec=60):
+        self.emit = emit
+        self.window_sec = max(1, int(window_sec))
+        self._open = {}
+        self._lock = threading.Lock()
+        self._readings = 0
+        self._windows_emitted = 0
+
+    def _bucket(self, epoch):
+        return int(epoch // self.window_sec)
+
+    def _close(self, key, window):
+        user_id, device_id = key
+        start = datetime.fromtimestamp(window.bucket * self.window_sec, tz=timezone.utc)
+        return WindowAggregate(user_id, device_id, start, window.metrics)
+
+    def add(self, user_id, device_id, co2, temp, humidity, epoch=None):
+        """Fold one reading into its window. Emits the previous window if this one is newer."""
+        key = (normalize_user_id(user_id), device_id or DEFAULT_DEVICE_ID)
+        bucket = self._bucket(time.time() if epoch is None else epoch)
+        values = {"co2": float(co2), "temp": float(temp), "humidity": float(humidity)}
+        closed = None
+        with self._lock:
+            self._readings += 1
+            window = self._open.get(key)
+            if window is None:
+                self._open[key] = _OpenWindow(bucket, values)
+            elif bucket == window.bucket:
+                window.add(values)
+            elif bucket > window.bucket:
+                closed = self._close(key, window)
+                self._open[key] = _OpenWindow(bucket, values)
+            else:
+                # Late reading for a window already emitted: fold into the current one
+                window.add(values)
+        if closed is not None:
+            self._emit(closed)
+
+    def sweep(self, epoch=None):
+        """Emit windows whose bucket has ended (devices that stopped publishing)."""
+        current = self._bucket(time.time() if epoch is None else epoch)
+        with self._lock:
+            expired = [(k, w) for k, w in self._open.items() if w.bucket < current]
+            for k, _ in expired:
+                del self._open[k]
+            closed = [self._close(k, w) for k, w in expired]
+        for agg in closed:
+            self._emit(agg)
+        return len(closed)
+
+    def flush_all(self):
+        """Emit every open window, complete or not (shutdown)."""
+        with self._lock:
+            closed = [self._close(k, w) for k, w in self._open.items()]
+            self._open = {}
+        for agg in closed:
+            self._emit(agg)
+
+    def _emit(self, agg):
+        self._windows_emitted += 1
+        try:
+            self.emit(agg)
+        except Exception as exc:
+            print(f"[Aggregator] Emit failed for user {agg.user_id}/{agg.device_id}: {exc}")
+
+    def stats(self) -> dict:
+        return {
+            "open_windows":    len(self._open),
+            "readings":        self._readings,
+            "windows_emitted": self._windows_emitted,
+            "window_sec":      self.window_sec,
+        }
+
+
+_aggregator = None
+_compressor = None
+_aggregator_lock = threading.Lock()
+
+
+def window_sec() -> int:
+    return int(os.environ.get("SENSOR_WINDOW_SEC", 60))
+
+
+def get_window_aggregator() -> WindowAggregator:
+    """Process-wide aggregator feeding the write-behind batch writer."""
+    global _aggregator, _compressor
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                from batch_writer import get_batch_writer
+                from series_compression import compressor_from_env
+                writer = get_batch_writer()
+                _compressor = compressor_from_env(writer.add_point)
+                aggregator = WindowAggregator(
+                    _compressor.add_window if _compressor else writer.add_window,
+                    window_sec=window_sec(),
+                )
+                # atexit runs hooks in reverse order: aggregator, then compressor, then writer
+                if _compressor:
+                    atexit.register(_compressor.flush_all)
+                atexit.register(aggregator.flush_all)
+                _aggregator = aggregator
+    return _aggregator
+
+
+def sweep_windows():
+    """Scheduler entry point: close windows for devices that went quiet."""
+    if _aggregator is not None:
+        _aggregator.sweep()
+
+
+def get_window_stats() -> dict:
+    if _aggregator is None:
+        return {}
+    stats = _aggregator.stats()
+    if _compressor is not None:
+        stats["compression"] = _compressor.stats()
+    return stats